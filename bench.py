@@ -0,0 +1,370 @@
+"""Бенчмарки бота.
+
+    python bench.py validator [--file inputs.txt]
+    python bench.py batching [--users 50 100 200]
+    python bench.py storage [--migrate]     (нужен настоящий DATABASE_URL)
+    python bench.py explain                 (нужен настоящий DATABASE_URL; код выхода 1 при регрессии)
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+# config.py требует DATABASE_URL; бенчмаркам без БД хватает заглушки
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/bench")
+
+logger = logging.getLogger("bench")
+
+# Типичные первые сообщения пользователей (смесь продуктов, опечаток, мусора)
+SAMPLE_INPUTS = [
+    "картошка, лук, морковь",
+    "яйца молоко мука",
+    "курица, рис, чеснок, соевый соус",
+    "у меня есть свинина и капуста",
+    "помидоры огурцы перец",
+    "памидоры, агурцы",
+    "кортошка малако",
+    "гречка, тушёнка",
+    "фарш, макароны, сыр",
+    "творог, сметана, изюм",
+    "лосось, лимон, укроп",
+    "говядина 500 г, свекла, капуста, морковь, лук",
+    "бананы, яблоки, овсянка",
+    "куриные бёдрышки, картофель",
+    "chicken, potatoes, garlic",
+    "eggs, milk, flour, sugar",
+    "rice and beans",
+    "tomatoes, basil, mozzarella",
+    "鸡蛋, 面粉",
+    "huevos, leche",
+    "сахарный песок",
+    "заварной крем",
+    "мясо и овощи",
+    "остатки ужина",
+    "всё что есть в холодильнике",
+    "Привет",
+    "привет, как дела?",
+    "спасибо",
+    "ok",
+    "123",
+    "asdfgh",
+    "бензин",
+    "кирпичи и цемент",
+    "шампунь, мыло",
+    "дай денег",
+    "расскажи анекдот",
+    "крабовые палочки, кукуруза, яйца, майонез",
+    "шампиньоны, сливки, паста",
+    "кабачки, баклажаны, помидоры, чеснок",
+    "пельмени",
+    "привет, у меня курица и рис",
+    "курица, рис и лук, пока всё",
+    "glass noodles, shrimp, garlic",
+    "shitake mushrooms, rice",
+    "сыр",
+    "соя",
+    "зелень",
+    "почки",
+    "сом",
+    "clove",
+    "свежий сыр",
+    "сыр 200 г",
+    "сыр, зелень",
+]
+
+
+def bench_validator(args):
+    """Какую долю трафика локальный валидатор решает без LLM и сколько это стоит"""
+    from ingredient_validator import IngredientValidator
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            inputs = [line.strip() for line in f if line.strip()]
+    else:
+        inputs = SAMPLE_INPUTS
+
+    validator = IngredientValidator(enabled=True)
+    verdicts = {}
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for text in inputs:
+            verdicts[text] = validator.classify(text)
+    elapsed = time.perf_counter() - started
+    calls = args.rounds * len(inputs)
+
+    accepted = sum(1 for v in verdicts.values() if v is True)
+    rejected = sum(1 for v in verdicts.values() if v is False)
+    ambiguous = len(verdicts) - accepted - rejected
+
+    if args.verbose:
+        for text, verdict in verdicts.items():
+            label = {True: "ACCEPT", False: "REJECT", None: "LLM"}[verdict]
+            print(f"{label:7} {text}")
+        print()
+
+    print(f"Входов:             {len(verdicts)}")
+    print(f"Принято локально:   {accepted}")
+    print(f"Отклонено локально: {rejected}")
+    print(f"Ушло бы в LLM:      {ambiguous}")
+    print(f"Доля без LLM:       {(accepted + rejected) / len(verdicts):.1%}")
+    print(f"Время на проверку:  {elapsed / calls * 1e6:.1f} мкс")
+
+
+class SimulatedGroq:
+    """Модель Groq для бенчмарков: задержка ответа и лимиты RPM/TPM
+    с заголовками x-ratelimit-*. speed ускоряет время симуляции"""
+
+    _ITEM_RE = re.compile(r'^(\d+)\. Текст: "(.*)"$', re.MULTILINE)
+
+    def __init__(self, rpm: int, tpm: int, speed: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.speed = speed
+        self.requests_level = float(rpm)
+        self.tokens_level = float(tpm)
+        self.updated_at = time.monotonic()
+        self.calls = 0
+        self.tokens = 0
+        self.over_limit = 0  # реальный Groq ответил бы 429
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = (now - self.updated_at) * self.speed
+        self.requests_level = min(self.rpm, self.requests_level + elapsed * self.rpm / 60)
+        self.tokens_level = min(self.tpm, self.tokens_level + elapsed * self.tpm / 60)
+        self.updated_at = now
+
+    @staticmethod
+    def _answer(text: str) -> Dict:
+        items = [p.strip() for p in text.split(",") if p.strip()]
+        return {"valid": True, "reason": "еда", "ingredients": items, "categories": ["main", "soup"]}
+
+    async def call(self, model, messages, temperature, max_tokens, on_progress=None, json_mode=False):
+        user_text = messages[-1]["content"]
+        batch = self._ITEM_RE.findall(user_text) if "ПАКЕТ" in messages[0]["content"] else []
+        if batch:
+            content = json.dumps([{"id": int(i), **self._answer(t)} for i, t in batch], ensure_ascii=False)
+        else:
+            match = re.search(r'"(.*)"', user_text)
+            content = json.dumps(self._answer(match.group(1) if match else user_text), ensure_ascii=False)
+
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 3
+        output_tokens = len(content) // 3
+        # Время до первого токена + генерация (~500 токенов/с)
+        await asyncio.sleep((0.25 + prompt_tokens * 0.00005 + output_tokens * 0.002) / self.speed)
+
+        self._refill()
+        self.calls += 1
+        self.tokens += prompt_tokens + output_tokens
+        self.requests_level -= 1
+        self.tokens_level -= prompt_tokens + output_tokens
+        if self.requests_level < 0 or self.tokens_level < 0:
+            self.over_limit += 1
+        headers = {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(max(0, int(self.requests_level))),
+            "x-ratelimit-reset-requests": f"{(self.rpm - self.requests_level) / self.rpm * 60 / self.speed:.2f}s",
+            "x-ratelimit-limit-tokens": str(self.tpm),
+            "x-ratelimit-remaining-tokens": str(max(0, int(self.tokens_level))),
+            "x-ratelimit-reset-tokens": f"{(self.tpm - self.tokens_level) / self.tpm * 60 / self.speed:.2f}s",
+        }
+        return content, headers
+
+
+async def _run_batching(users: int, batched: bool, args) -> Dict:
+    import groq_service
+    from groq_service import GroqService
+    from llm_scheduler import LLMScheduler
+    from model_router import ModelRouter
+    from singleflight import SingleFlight
+    from ingredient_validator import ingredient_validator
+
+    sim = SimulatedGroq(args.rpm, args.tpm, args.speed)
+    GroqService._call_groq = staticmethod(sim.call)
+    groq_service.llm_scheduler = LLMScheduler()
+    groq_service.model_router = ModelRouter()
+    groq_service.inflight_requests = SingleFlight()
+    groq_service.intake_batcher.enabled = batched
+    # Меряем только путь через LLM
+    ingredient_validator.enabled = False
+
+    latencies = []
+
+    async def user(i: int):
+        await asyncio.sleep(random.uniform(0, args.spread) / args.speed)
+        text = f"{SAMPLE_INPUTS[i % len(SAMPLE_INPUTS)]}, вариант {i}"
+        started = time.monotonic()
+        await GroqService.validate_and_categorize(text)
+        latencies.append((time.monotonic() - started) * args.speed)
+
+    started = time.monotonic()
+    await asyncio.gather(*(user(i) for i in range(users)))
+    elapsed = (time.monotonic() - started) * args.speed
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "throughput": users / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "calls": sim.calls,
+        "tokens": sim.tokens,
+        "over_limit": sim.over_limit,
+    }
+
+
+def bench_batching(args):
+    """Пропускная способность проверки первого сообщения: по одному запросу и пакетами"""
+    random.seed(args.seed)
+    print(f"Симуляция Groq: {args.rpm} RPM, {args.tpm} TPM, пользователи приходят за {args.spread:.1f}с")
+    print(f"{'польз.':>7} {'режим':>9} {'время,с':>8} {'польз/с':>8} {'p50,с':>6} {'p95,с':>6} {'вызовов':>8} {'токенов':>8} {'429':>4}")
+    for users in args.users:
+        results = {}
+        for batched in (False, True):
+            results[batched] = asyncio.run(_run_batching(users, batched, args))
+            r = results[batched]
+            mode = "пакеты" if batched else "поштучно"
+            print(f"{users:>7} {mode:>9} {r['elapsed']:>8.1f} {r['throughput']:>8.2f} {r['p50']:>6.2f} "
+                  f"{r['p95']:>6.2f} {r['calls']:>8} {r['tokens']:>8} {r['over_limit']:>4}")
+        gain = results[True]["throughput"] / results[False]["throughput"]
+        print(f"{'':>7} {'выигрыш':>9} x{gain:.2f}")
+
+
+def _size(n: int) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} ГБ"
+
+
+async def _storage(args):
+    from database import db
+    await db.connect()
+    try:
+        if args.migrate:
+            await db.run_body_migration(pause=0)
+        return await db.get_recipe_storage_report()
+    finally:
+        await db.close()
+
+
+def bench_storage(args):
+    """Экономия места от хранения текстов рецептов в recipe_bodies (zlib + дедупликация)"""
+    r = asyncio.run(_storage(args))
+    print(f"Строк истории со ссылкой: {r['referenced_rows']}, со старым текстом в строке: {r['legacy_rows']}")
+    print(f"Уникальных текстов: {r['bodies']}")
+    print(f"Текст во всех строках истории: {_size(r['logical_bytes'])}")
+    if r["referenced_rows"]:
+        dedup = r["logical_bytes"] / max(r["unique_raw_bytes"], 1)
+        compress = r["unique_raw_bytes"] / max(r["stored_bytes"], 1)
+        print(f"  без повторов:              {_size(r['unique_raw_bytes'])} (x{dedup:.2f})")
+        print(f"  сжато:                     {_size(r['stored_bytes'])} (x{compress:.2f}, всего x{dedup * compress:.2f})")
+    print(f"Таблица recipes: {_size(r['recipes_table_bytes'])}, recipe_bodies: {_size(r['bodies_table_bytes'])}")
+
+
+def hot_queries() -> List[Tuple[str, str, list]]:
+    """Горячие запросы БД — те же строки, что выполняет database.py, с примерными параметрами"""
+    import database as d
+    now = datetime.now(timezone.utc)
+    return [
+        ("get_session", d.SQL_GET_SESSION, [1]),
+        ("get_user_recipes", d.SQL_GET_USER_RECIPES, [1, 5]),
+        ("recipe_page_first", d.SQL_RECIPE_PAGE_FIRST, [1, 6]),
+        ("recipe_page_older", d.SQL_RECIPE_PAGE_OLDER, [1, 6, now, 1]),
+        ("recipe_page_newer", d.SQL_RECIPE_PAGE_NEWER, [1, 6, now, 1]),
+        ("get_recipe_text", d.SQL_GET_RECIPE_TEXT, [1, 1, now]),
+        ("get_cached_recipe", d.SQL_GET_CACHED_RECIPE, ["x", 3600.0]),
+        ("legacy_recipe_texts", d.SQL_LEGACY_RECIPE_TEXTS, [500]),
+        ("cleanup_old_sessions", d.SQL_CLEANUP_OLD_SESSIONS, [0, 7, 1000]),
+        ("trim_recipe_history", d.SQL_TRIM_RECIPE_HISTORY, [0, 500, 200, 1000]),
+        ("delete_orphan_bodies", d.SQL_DELETE_ORPHAN_BODIES, [b"", 1000]),
+        ("cleanup_recipe_cache", d.SQL_CLEANUP_RECIPE_CACHE, ["", 3600.0, 1000]),
+    ]
+
+
+def _plan_nodes(plan: Dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+async def _explain(args):
+    from database import db
+    await db.connect()
+    results = []
+    try:
+        async with db.acquire() as conn:
+            for name, sql, params in hot_queries():
+                async with conn.transaction():
+                    # На маленькой базе планировщик честно выбирает Seq Scan. С enable_seqscan = off
+                    # он выберет его, только если подходящего индекса нет — это и проверяем
+                    if not args.real_costs:
+                        await conn.execute("SET LOCAL enable_seqscan = off")
+                    raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *params)
+                plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+                nodes = list(_plan_nodes(plan))
+                seq_scans = [n.get("Relation Name") for n in nodes if n["Node Type"] == "Seq Scan"]
+                indexes = [n["Index Name"] for n in nodes if "Index Name" in n]
+                results.append((name, seq_scans, indexes, plan.get("Total Cost")))
+    finally:
+        await db.close()
+    return results
+
+
+def bench_explain(args):
+    """Планы горячих запросов: ни один не должен читать таблицу целиком"""
+    results = asyncio.run(_explain(args))
+    failed = 0
+    print(f"{'запрос':<24} {'итог':<5} {'стоимость':>10}  план")
+    for name, seq_scans, indexes, cost in results:
+        ok = not seq_scans
+        failed += not ok
+        detail = f"Seq Scan: {', '.join(seq_scans)}" if seq_scans else f"индексы: {', '.join(indexes) or '-'}"
+        print(f"{name:<24} {'OK' if ok else 'FAIL':<5} {cost:>10.1f}  {detail}")
+    if failed:
+        print(f"\n❌ {failed} запрос(ов) без индекса")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки кулинарного бота")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    validator = subparsers.add_parser("validator", help="локальный валидатор продуктов")
+    validator.add_argument("--file", help="файл с входами, по одному на строку")
+    validator.add_argument("--rounds", type=int, default=200)
+    validator.add_argument("-v", "--verbose", action="store_true")
+    validator.set_defaults(func=bench_validator)
+
+    batching = subparsers.add_parser("batching", help="пакетная проверка продуктов под нагрузкой")
+    batching.add_argument("--users", type=int, nargs="+", default=[50, 100, 200])
+    batching.add_argument("--rpm", type=int, default=1000, help="лимит запросов в минуту")
+    batching.add_argument("--tpm", type=int, default=250000, help="лимит токенов в минуту")
+    batching.add_argument("--spread", type=float, default=1.0, help="за сколько секунд приходят пользователи")
+    batching.add_argument("--speed", type=float, default=10.0, help="ускорение времени симуляции")
+    batching.add_argument("--seed", type=int, default=1)
+    batching.set_defaults(func=bench_batching)
+
+    storage = subparsers.add_parser("storage", help="место под тексты рецептов в БД")
+    storage.add_argument("--migrate", action="store_true", help="сначала перенести старые строки в recipe_bodies")
+    storage.set_defaults(func=bench_storage)
+
+    explain = subparsers.add_parser("explain", help="проверка планов горячих запросов (нет ли Seq Scan)")
+    explain.add_argument("--real-costs", action="store_true",
+                         help="не запрещать Seq Scan (план, который выберет планировщик на этих данных)")
+    explain.set_defaults(func=bench_explain)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, stream=sys.stdout)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
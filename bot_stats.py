@@ -0,0 +1,108 @@
+"""Статистика для /stats без обращения к БД на каждый запрос.
+
+Общие числа берутся из снимка, который фоновая задача обновляет раз в BOT_STATS_REFRESH
+секунд: из таблицы bot_counters (её ведут триггеры) или из оценок pg_class.reltuples
+(BOT_STATS_SOURCE=estimate). Последние рецепты пользователя — из маленького LRU-кеша,
+который пополняется при сохранении рецепта.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from config import BOT_STATS_REFRESH, BOT_STATS_SOURCE, BOT_STATS_RECENT_USERS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("counters", "estimate")
+# Сколько последних рецептов показывает /stats
+RECENT_LIMIT = 5
+
+
+class BotStats:
+    def __init__(
+        self,
+        refresh_interval: float = BOT_STATS_REFRESH,
+        source: str = BOT_STATS_SOURCE,
+        recent_users: int = BOT_STATS_RECENT_USERS
+    ):
+        if source not in SOURCES:
+            raise ValueError(f"BOT_STATS_SOURCE должен быть одним из {SOURCES}, а не {source!r}")
+        self.refresh_interval = refresh_interval
+        self.source = source
+        self.recent_users = recent_users
+        self._snapshot: Optional[Dict] = None
+        self._refreshed_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        # user_id -> последние рецепты, новые первыми
+        self._recent: "OrderedDict[int, List[Dict]]" = OrderedDict()
+        self._stats = {"refreshes": 0, "refresh_errors": 0, "recent_hits": 0, "recent_misses": 0}
+
+    async def refresh(self):
+        try:
+            self._snapshot = await db.get_stats(estimate=self.source == "estimate")
+            self._refreshed_at = time.monotonic()
+            self._stats["refreshes"] += 1
+        except Exception as e:
+            # Оставляем прежний снимок: устаревшие числа лучше ошибки в /stats
+            self._stats["refresh_errors"] += 1
+            logger.error(f"Ошибка обновления статистики: {e}")
+
+    async def run_refresh(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    async def get(self) -> Dict:
+        """Снимок общей статистики. До первого обновления — один запрос к БД"""
+        if self._snapshot is None:
+            async with self._refresh_lock:
+                if self._snapshot is None:
+                    await self.refresh()
+        if self._snapshot is None:
+            raise RuntimeError("статистика недоступна")
+        return self._snapshot
+
+    async def recent_recipes(self, user_id: int) -> List[Dict]:
+        recipes = self._recent.get(user_id)
+        if recipes is not None:
+            self._recent.move_to_end(user_id)
+            self._stats["recent_hits"] += 1
+            return recipes
+        self._stats["recent_misses"] += 1
+        rows = await db.get_user_recipes(user_id, limit=RECENT_LIMIT)
+        recipes = [{"dish_name": r["dish_name"], "created_at": r["created_at"]} for r in rows]
+        self._remember(user_id, recipes)
+        return recipes
+
+    def _remember(self, user_id: int, recipes: List[Dict]):
+        self._recent[user_id] = recipes
+        self._recent.move_to_end(user_id)
+        while len(self._recent) > self.recent_users:
+            self._recent.popitem(last=False)
+
+    def note_recipe(self, user_id: int, dish_name: str):
+        """Рецепт сохранён в БД. Не закешированного пользователя не трогаем — прочитаем при /stats"""
+        recipes = self._recent.get(user_id)
+        if recipes is not None:
+            entry = {"dish_name": dish_name, "created_at": datetime.now(timezone.utc)}
+            self._recent[user_id] = [entry, *recipes][:RECENT_LIMIT]
+
+    def forget_recipes(self, user_id: int):
+        """История пользователя очищена"""
+        self._remember(user_id, [])
+
+    def get_stats(self) -> Dict:
+        age = round(time.monotonic() - self._refreshed_at, 1) if self._snapshot is not None else None
+        return {
+            **self._stats,
+            "source": self.source,
+            "snapshot_age": age,
+            "recent_cached": len(self._recent),
+        }
+
+
+# Глобальный экземпляр
+bot_stats = BotStats()
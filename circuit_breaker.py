@@ -0,0 +1,106 @@
+import time
+import logging
+from typing import Dict, Optional
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS, CIRCUIT_OPEN_MAX_SECONDS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут — запрос не отправлялся"""
+
+
+class CircuitBreaker:
+    """Предохранитель вокруг внешнего API.
+
+    closed    — запросы идут как обычно, считаем сбои подряд;
+    open      — после failure_threshold сбоев запросы сразу отклоняются;
+    half_open — по истечении паузы пропускаем один пробный запрос:
+                успех замыкает цепь, сбой размыкает её снова с удвоенной паузой.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        open_max_seconds: float = CIRCUIT_OPEN_MAX_SECONDS
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.open_max_seconds = open_max_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._pause = open_seconds
+        self._probe_in_flight = False
+        self._stats = {"rejected": 0, "opened": 0, "probes": 0}
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self._pause:
+            self.state = HALF_OPEN
+            logger.info(f"🟡 {self.name}: пробный запрос после {self._pause:.0f}с паузы")
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            self._stats["probes"] += 1
+            return True
+        self._stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"🟢 {self.name}: сервис восстановился, предохранитель замкнут")
+        self.state = CLOSED
+        self._failures = 0
+        self._pause = self.open_seconds
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+            self._pause = min(self._pause * 2, self.open_max_seconds)
+            self._open()
+        elif self.state == CLOSED and self._failures >= self.failure_threshold:
+            self._open()
+
+    def record_cancel(self):
+        """Запрос отменён, исход неизвестен: освобождаем место пробы"""
+        self._probe_in_flight = False
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._stats["opened"] += 1
+        logger.warning(f"🔴 {self.name}: {self._failures} сбоев подряд, предохранитель разомкнут на {self._pause:.0f}с")
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == CLOSED
+
+    def retry_in(self) -> Optional[float]:
+        """Сколько секунд до следующей пробы (None, если цепь замкнута)"""
+        if self.state == CLOSED:
+            return None
+        return max(0.0, self._pause - (time.monotonic() - self._opened_at))
+
+    def get_stats(self) -> Dict:
+        retry_in = self.retry_in()
+        return {
+            **self._stats,
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_in": round(retry_in, 1) if retry_in is not None else None,
+        }
+
+
+# Предохранитель для всех запросов к Groq
+groq_breaker = CircuitBreaker("Groq")
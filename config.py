@@ -22,4 +22,101 @@ GROQ_MAX_TOKENS = 2000
 TEMP_DIR = "temp"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-MAX_HISTORY_MESSAGES = 8
\ No newline at end of file
+MAX_HISTORY_MESSAGES = 8
+
+# Кеш рецептов (in-memory LRU + таблица recipe_cache в БД)
+RECIPE_CACHE_SIZE = int(os.getenv("RECIPE_CACHE_SIZE", 500))
+RECIPE_CACHE_TTL = int(os.getenv("RECIPE_CACHE_TTL", 6 * 3600))  # секунды
+RECIPE_CACHE_DB_TTL = int(os.getenv("RECIPE_CACHE_DB_TTL", 7 * 24 * 3600))  # секунды
+
+# Потоковая выдача рецептов (редактирование сообщения по мере генерации)
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))  # секунды между правками
+
+# Планировщик запросов к Groq
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))  # секунды
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 20))  # секунды
+
+# Упреждающая генерация списков блюд после выбора категорий
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0") == "1"
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", 2))
+PREFETCH_MAX_CONCURRENT = int(os.getenv("PREFETCH_MAX_CONCURRENT", 2))
+
+# Локальная проверка продуктов по словарю (до запроса к LLM)
+LOCAL_VALIDATOR_ENABLED = os.getenv("LOCAL_VALIDATOR_ENABLED", "1") == "1"
+LOCAL_VALIDATOR_ACCEPT_RATIO = float(os.getenv("LOCAL_VALIDATOR_ACCEPT_RATIO", 0.6))
+
+# Маршрутизация моделей: быстрая модель для коротких задач, переключение на запасные
+GROQ_FAST_MODEL = os.getenv("GROQ_FAST_MODEL", "llama-3.1-8b-instant")
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", 50))  # последних запросов на модель
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", 10))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", 0.25))
+ROUTER_RECOVER_RATIO = float(os.getenv("ROUTER_RECOVER_RATIO", 0.7))  # запас для возврата на основную
+ROUTER_RECOVER_SAMPLES = int(os.getenv("ROUTER_RECOVER_SAMPLES", 5))
+ROUTER_PROBE_INTERVAL = float(os.getenv("ROUTER_PROBE_INTERVAL", 15))  # секунды между пробами
+
+# Пакетная проверка продуктов: запросы разных пользователей копятся несколько мс и уходят одним промптом
+VALIDATION_BATCH_ENABLED = os.getenv("VALIDATION_BATCH_ENABLED", "0") == "1"
+VALIDATION_BATCH_WINDOW_MS = int(os.getenv("VALIDATION_BATCH_WINDOW_MS", 30))
+VALIDATION_BATCH_MAX = int(os.getenv("VALIDATION_BATCH_MAX", 10))
+
+# Комплексный обед: рецепты блюд генерируются параллельно и приходят по мере готовности
+MIX_PARALLEL_ENABLED = os.getenv("MIX_PARALLEL_ENABLED", "1") == "1"
+
+# Предохранитель Groq: после серии сбоев запросы не отправляются, ответы берутся из сохранённых рецептов
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))  # сбоев подряд
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+CIRCUIT_OPEN_MAX_SECONDS = float(os.getenv("CIRCUIT_OPEN_MAX_SECONDS", 300))
+FALLBACK_CORPUS_SIZE = int(os.getenv("FALLBACK_CORPUS_SIZE", 2000))
+FALLBACK_CORPUS_REFRESH = int(os.getenv("FALLBACK_CORPUS_REFRESH", 3600))  # секунды
+FALLBACK_CORPUS_DAYS = int(os.getenv("FALLBACK_CORPUS_DAYS", 90))  # корпус собирается из рецептов за столько дней
+
+# Кеш категорий и списков блюд по набору продуктов (с поиском похожих наборов через MinHash/LSH)
+PRODUCT_INDEX_ENABLED = os.getenv("PRODUCT_INDEX_ENABLED", "1") == "1"
+PRODUCT_INDEX_SIZE = int(os.getenv("PRODUCT_INDEX_SIZE", 5000))  # записей в памяти
+PRODUCT_INDEX_JACCARD = float(os.getenv("PRODUCT_INDEX_JACCARD", 0.75))  # порог схожести наборов
+PRODUCT_INDEX_TTL = int(os.getenv("PRODUCT_INDEX_TTL", 7 * 24 * 3600))  # секунды
+
+# Библиотека заранее сгенерированных популярных рецептов (python recipe_library.py)
+LIBRARY_REFRESH_DAYS = int(os.getenv("LIBRARY_REFRESH_DAYS", 30))
+LIBRARY_MAX_ATTEMPTS = int(os.getenv("LIBRARY_MAX_ATTEMPTS", 3))
+
+# Трейсы взаимодействий: сохраняются только медленные (GET /traces)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 5000))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 100))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 200))  # защита от разрастания одного трейса
+
+# Транспорт LLM: live | record | replay (llm_transport.py)
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT", "live")
+LLM_JOURNAL = os.getenv("LLM_JOURNAL", os.path.join(TEMP_DIR, "llm_journal.jsonl.gz"))
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "recorded")  # recorded | sampled | none
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", 1.0))  # >1 — воспроизводить быстрее записи
+
+# Реестр известных пользователей в памяти и пакетная запись last_active
+USER_REGISTRY_SIZE = int(os.getenv("USER_REGISTRY_SIZE", 50000))
+USER_ACTIVITY_FLUSH_SECONDS = int(os.getenv("USER_ACTIVITY_FLUSH_SECONDS", 30))
+
+# Отложенная запись сессий: изменения копятся в памяти и пишутся пакетом
+SESSION_WRITE_BEHIND = os.getenv("SESSION_WRITE_BEHIND", "1") == "1"
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", 2))  # максимальное отставание БД от памяти
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", 50))  # запись раньше срока, если набралось столько сессий
+
+# Статистика /stats: снимок в памяти вместо COUNT(*) на каждый запрос (bot_stats.py)
+BOT_STATS_REFRESH = float(os.getenv("BOT_STATS_REFRESH", 60))  # секунды
+BOT_STATS_SOURCE = os.getenv("BOT_STATS_SOURCE", "counters")  # counters — точно (триггеры) | estimate — pg_class.reltuples
+BOT_STATS_RECENT_USERS = int(os.getenv("BOT_STATS_RECENT_USERS", 10000))  # пользователей в кеше последних рецептов
+
+# Обслуживание БД: пакетное удаление устаревших данных (maintenance.py)
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "1") == "1"
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", 3600))  # секунды между проходами
+MAINTENANCE_BATCH = int(os.getenv("MAINTENANCE_BATCH", 1000))  # строк за один запрос
+MAINTENANCE_PAUSE = float(os.getenv("MAINTENANCE_PAUSE", 0.2))  # пауза между пакетами, секунды
+SESSION_RETENTION_DAYS = int(os.getenv("SESSION_RETENTION_DAYS", 30))
+RECIPE_HISTORY_PER_USER = int(os.getenv("RECIPE_HISTORY_PER_USER", 200))
+
+# Секции recipes по месяцам: создаются заранее, старые удаляются целиком (0 — хранить всё)
+RECIPE_PARTITIONS_AHEAD = int(os.getenv("RECIPE_PARTITIONS_AHEAD", 3))
+RECIPE_RETENTION_MONTHS = int(os.getenv("RECIPE_RETENTION_MONTHS", 0))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 5))  # рецептов на странице /history
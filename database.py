@@ -1,15 +1,442 @@
 import asyncpg
 from typing import List, Dict, Any, Optional
 import json
+import time
+import zlib
+import hashlib
+import asyncio
 import logging
-from datetime import datetime
-from config import DATABASE_URL  # Импортируем из config.py
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from config import DATABASE_URL, USER_REGISTRY_SIZE, USER_ACTIVITY_FLUSH_SECONDS  # Импортируем из config.py
+from config import RECIPE_PARTITIONS_AHEAD
+from metrics import DB_ACQUIRE_WAIT
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
+# Таблицы, для которых bot_counters ведёт число строк
+COUNTED_TABLES = ("users", "sessions", "recipes")
+
+
+def pack_recipe_body(recipe_text: str) -> tuple:
+    """Текст рецепта -> (sha256, zlib, размер в байтах). Одинаковые тексты дают один ключ"""
+    raw = recipe_text.encode("utf-8")
+    return hashlib.sha256(raw).digest(), zlib.compress(raw, 9), len(raw)
+
+
+def unpack_recipe_body(body: bytes) -> str:
+    return zlib.decompress(body).decode("utf-8")
+
+
+# ==================== МИГРАЦИИ ====================
+# Версии схемы применяются по порядку, каждая в своей транзакции, и записываются в schema_migrations.
+# Применённые миграции не меняем — изменения схемы добавляются новой версией в конец списка.
+# Шаг — SQL-строка или корутина от соединения. Все шаги идемпотентны: базы, созданные
+# до появления schema_migrations, проходят миграции без ошибок.
+
+# Ключ pg_advisory_lock: схему обновляет один инстанс, остальные ждут
+_MIGRATION_LOCK_ID = 0x4D49_4752  # "MIGR"
+
+
+async def _install_counters(conn):
+    """Счётчики строк для /stats. Ведутся триггерами уровня оператора (одно UPDATE на INSERT/DELETE),
+    начальное значение — один COUNT(*) при установке триггера"""
+    for table in COUNTED_TABLES:
+        if await conn.fetchval("SELECT 1 FROM bot_counters WHERE name = $1", table):
+            continue
+        await conn.execute(f"""
+            DROP TRIGGER IF EXISTS {table}_count_insert ON {table};
+            DROP TRIGGER IF EXISTS {table}_count_delete ON {table};
+            CREATE TRIGGER {table}_count_insert AFTER INSERT ON {table}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION bot_counters_track();
+            CREATE TRIGGER {table}_count_delete AFTER DELETE ON {table}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION bot_counters_track();
+            INSERT INTO bot_counters (name, value) SELECT '{table}', COUNT(*) FROM {table};
+        """)
+        logger.info(f"🔢 Счётчик строк {table} установлен")
+
+
+def _month_start(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month: datetime) -> datetime:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def recipe_partition_name(month: datetime) -> str:
+    return f"recipes_p{month:%Y%m}"
+
+
+async def _create_recipe_partition(conn, month: datetime, parent: str = "recipes"):
+    """Секция recipes за месяц month (границы по UTC)"""
+    await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {recipe_partition_name(month)} PARTITION OF {parent}
+        FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')
+    """)
+
+
+async def _partition_recipes(conn):
+    """recipes -> таблица, секционированная по месяцам created_at. Данные копируются один раз,
+    id и последовательность сохраняются; ключ становится (id, created_at)"""
+    if await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = 'recipes'::regclass") == "p":
+        return
+    now = datetime.now(timezone.utc)
+    oldest = await conn.fetchval("SELECT MIN(created_at) FROM recipes") or now
+    sequence = await conn.fetchval("SELECT pg_get_serial_sequence('recipes', 'id')")
+    await conn.execute("""
+        CREATE TABLE recipes_partitioned (
+            id INTEGER NOT NULL,
+            user_id BIGINT,
+            dish_name TEXT NOT NULL,
+            recipe_text TEXT,
+            products_used TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            body_hash BYTEA
+        ) PARTITION BY RANGE (created_at)
+    """)
+    month, last = _month_start(oldest), _month_start(now)
+    for _ in range(RECIPE_PARTITIONS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        await _create_recipe_partition(conn, month, "recipes_partitioned")
+        month = _next_month(month)
+    copied = await conn.execute("""
+        INSERT INTO recipes_partitioned (id, user_id, dish_name, recipe_text, products_used, created_at, body_hash)
+        SELECT id, user_id, dish_name, recipe_text, products_used, COALESCE(created_at, NOW()), body_hash
+        FROM recipes
+    """)
+    await conn.execute(f"""
+        ALTER SEQUENCE {sequence} OWNED BY NONE;
+        DROP TABLE recipes;
+        ALTER TABLE recipes_partitioned RENAME TO recipes;
+        ALTER TABLE recipes ALTER COLUMN id SET DEFAULT nextval('{sequence}');
+        ALTER SEQUENCE {sequence} OWNED BY recipes.id;
+        ALTER TABLE recipes ADD CONSTRAINT recipes_pkey PRIMARY KEY (id, created_at);
+        ALTER TABLE recipes ADD CONSTRAINT recipes_user_id_fkey
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
+        ALTER TABLE recipes ADD CONSTRAINT recipes_body_hash_fkey
+            FOREIGN KEY (body_hash) REFERENCES recipe_bodies (hash);
+        CREATE INDEX recipes_user_created_idx ON recipes (user_id, created_at DESC, id DESC);
+        CREATE INDEX recipes_legacy_text_idx ON recipes (id) WHERE body_hash IS NULL;
+        CREATE INDEX recipes_body_hash_idx ON recipes (body_hash) WHERE body_hash IS NOT NULL;
+        DELETE FROM bot_counters WHERE name = 'recipes';
+    """)
+    # Триггеры счётчика ушли вместе со старой таблицей
+    await _install_counters(conn)
+    logger.info(f"🗂 recipes разбита на секции по месяцам ({copied.split()[-1]} строк)")
+
+
+MIGRATIONS = [
+    (1, "base_schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            language TEXT DEFAULT 'ru',
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            last_active TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(id) ON DELETE CASCADE,
+            products TEXT,
+            state TEXT,
+            categories JSONB DEFAULT '[]'::jsonb,
+            generated_dishes JSONB DEFAULT '[]'::jsonb,
+            current_dish TEXT,
+            history JSONB DEFAULT '[]'::jsonb,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipes (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(id) ON DELETE CASCADE,
+            dish_name TEXT NOT NULL,
+            recipe_text TEXT NOT NULL,
+            products_used TEXT,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+    ]),
+    (2, "cache_tables", [
+        """
+        CREATE TABLE IF NOT EXISTS recipe_cache (
+            cache_key TEXT PRIMARY KEY,
+            dish_name TEXT NOT NULL,
+            products_key TEXT,
+            language TEXT,
+            recipe_text TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            last_hit_at TIMESTAMPTZ
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS product_index (
+            set_key TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            items TEXT[] NOT NULL,
+            payload TEXT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (set_key, kind)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_library (
+            dish_key TEXT PRIMARY KEY,
+            dish_name TEXT NOT NULL,
+            language TEXT NOT NULL DEFAULT 'ru',
+            requests INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            recipe_text TEXT,
+            error TEXT,
+            generated_at TIMESTAMPTZ,
+            refresh_after TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    (3, "row_counters", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_counters (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION bot_counters_track() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE bot_counters SET value = value + (SELECT COUNT(*) FROM new_rows)
+                WHERE name = TG_TABLE_NAME;
+            ELSE
+                UPDATE bot_counters SET value = value - (SELECT COUNT(*) FROM old_rows)
+                WHERE name = TG_TABLE_NAME;
+            END IF;
+            RETURN NULL;
+        END $$
+        """,
+        _install_counters,
+    ]),
+    # Тексты рецептов храним отдельно: сжатые zlib и без повторов (ключ — sha256 текста).
+    # В recipes остаётся ссылка body_hash; recipe_text заполнен только у старых строк до переноса
+    (4, "recipe_bodies", [
+        """
+        CREATE TABLE IF NOT EXISTS recipe_bodies (
+            hash BYTEA PRIMARY KEY,
+            body BYTEA NOT NULL,
+            raw_size INTEGER NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        "ALTER TABLE recipes ADD COLUMN IF NOT EXISTS body_hash BYTEA",
+        "ALTER TABLE recipes ALTER COLUMN recipe_text DROP NOT NULL",
+    ]),
+    # Одна сессия на пользователя: оставляем самую свежую, дальше upsert через ON CONFLICT (user_id)
+    (5, "sessions_unique_user", [
+        """
+        DELETE FROM sessions s
+        USING sessions newer
+        WHERE newer.user_id = s.user_id
+        AND (COALESCE(newer.updated_at, '-infinity'), newer.id) > (COALESCE(s.updated_at, '-infinity'), s.id)
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS sessions_user_id_key ON sessions (user_id)",
+    ]),
+    (6, "hot_query_indexes", [
+        # История пользователя (get_user_recipes, /stats): поиск и сортировка по индексу
+        "CREATE INDEX IF NOT EXISTS recipes_user_created_idx ON recipes (user_id, created_at DESC)",
+        # Очистка старых сессий и кеша по времени
+        "CREATE INDEX IF NOT EXISTS sessions_updated_idx ON sessions (updated_at)",
+        "CREATE INDEX IF NOT EXISTS recipe_cache_created_idx ON recipe_cache (created_at)",
+        # Перенос старых текстов (migrate_recipe_bodies) и поиск текстов без ссылок
+        "CREATE INDEX IF NOT EXISTS recipes_legacy_text_idx ON recipes (id) WHERE body_hash IS NULL",
+        "CREATE INDEX IF NOT EXISTS recipes_body_hash_idx ON recipes (body_hash) WHERE body_hash IS NOT NULL",
+    ]),
+    # Ссылка на текст под защитой FK: вставка рецепта блокирует строку recipe_bodies (FOR KEY SHARE),
+    # поэтому очистка текстов без ссылок не удалит текст, на который прямо сейчас ссылаются
+    (7, "recipe_bodies_fk", [
+        """
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'recipes_body_hash_fkey') THEN
+                ALTER TABLE recipes ADD CONSTRAINT recipes_body_hash_fkey
+                    FOREIGN KEY (body_hash) REFERENCES recipe_bodies (hash) NOT VALID;
+            END IF;
+        END $$
+        """,
+        "ALTER TABLE recipes VALIDATE CONSTRAINT recipes_body_hash_fkey",
+    ]),
+    # Секции по месяцам: свежая история — маленькая горячая секция, старые месяцы отцепляются целиком
+    (8, "recipes_monthly_partitions", [_partition_recipes]),
+    # Ключи наборов продуктов считались со стоп-словами по основе: "курица, сыр, рис" совпадал
+    # с "курица, рис". Это кеш — старые записи проще выбросить, чем пересчитывать
+    (9, "product_index_rekey", ["TRUNCATE product_index"]),
+]
+
+
+# ==================== ГОРЯЧИЕ ЗАПРОСЫ ====================
+# Запросы, которые бот выполняет постоянно, и пакетные запросы обслуживания.
+# bench.py explain проверяет планы именно этих строк — SQL здесь не дублируем.
+
+SQL_GET_SESSION = """
+    SELECT * FROM sessions
+    WHERE user_id = $1
+"""
+
+SQL_GET_USER_RECIPES = """
+    SELECT id, user_id, dish_name, products_used, created_at FROM recipes
+    WHERE user_id = $1
+    ORDER BY created_at DESC
+    LIMIT $2
+"""
+
+# Страница истории по ключу (created_at, id). Отдельное условие на created_at — для отсечения секций
+SQL_RECIPE_PAGE_FIRST = """
+    SELECT id, dish_name, created_at FROM recipes
+    WHERE user_id = $1
+    ORDER BY created_at DESC, id DESC
+    LIMIT $2
+"""
+
+SQL_RECIPE_PAGE_OLDER = """
+    SELECT id, dish_name, created_at FROM recipes
+    WHERE user_id = $1 AND created_at <= $3 AND (created_at, id) < ($3, $4)
+    ORDER BY created_at DESC, id DESC
+    LIMIT $2
+"""
+
+SQL_RECIPE_PAGE_NEWER = """
+    SELECT id, dish_name, created_at FROM recipes
+    WHERE user_id = $1 AND created_at >= $3 AND (created_at, id) > ($3, $4)
+    ORDER BY created_at ASC, id ASC
+    LIMIT $2
+"""
+
+SQL_GET_RECIPE_TEXT = """
+    SELECT r.recipe_text, b.body
+    FROM recipes r LEFT JOIN recipe_bodies b ON b.hash = r.body_hash
+    WHERE r.id = $1 AND r.user_id = $2 AND r.created_at = $3
+"""
+
+SQL_GET_CACHED_RECIPE = """
+    UPDATE recipe_cache
+    SET hits = hits + 1, last_hit_at = NOW()
+    WHERE cache_key = $1
+    AND created_at > NOW() - make_interval(secs => $2)
+    RETURNING recipe_text
+"""
+
+# Старые строки recipes с текстом прямо в таблице (перенос в recipe_bodies)
+SQL_LEGACY_RECIPE_TEXTS = """
+    SELECT id, recipe_text FROM recipes
+    WHERE body_hash IS NULL AND recipe_text IS NOT NULL
+    LIMIT $1
+"""
+
+# Обслуживание (maintenance.py): пакет по ключу после курсора $1, возвращают (scanned, deleted, last)
+SQL_CLEANUP_OLD_SESSIONS = """
+    WITH batch AS (
+        SELECT id FROM sessions
+        WHERE id > $1 AND updated_at < NOW() - make_interval(days => $2)
+        ORDER BY id
+        LIMIT $3
+    ),
+    deleted AS (
+        -- Условие повторяем: сессия могла обновиться, пока выбирали пакет
+        DELETE FROM sessions s USING batch
+        WHERE s.id = batch.id AND s.updated_at < NOW() - make_interval(days => $2)
+        RETURNING s.id
+    )
+    SELECT (SELECT COUNT(*) FROM batch) AS scanned,
+           (SELECT COUNT(*) FROM deleted) AS deleted,
+           (SELECT MAX(id) FROM batch) AS last
+"""
+
+SQL_TRIM_RECIPE_HISTORY = """
+    WITH batch_users AS (
+        SELECT id FROM users WHERE id > $1 ORDER BY id LIMIT $2
+    ),
+    extra AS (
+        SELECT old.id, old.created_at
+        FROM batch_users u
+        CROSS JOIN LATERAL (
+            SELECT id, created_at FROM recipes
+            WHERE user_id = u.id
+            -- Тот же порядок, что у /history и recipes_user_created_idx
+            ORDER BY created_at DESC, id DESC
+            OFFSET $3
+        ) old
+        LIMIT $4
+    ),
+    deleted AS (
+        DELETE FROM recipes r USING extra
+        WHERE r.id = extra.id AND r.created_at = extra.created_at
+        RETURNING r.id
+    )
+    SELECT (SELECT COUNT(*) FROM batch_users) AS scanned,
+           (SELECT COUNT(*) FROM deleted) AS deleted,
+           (SELECT MAX(id) FROM batch_users) AS last
+"""
+
+# Строки, заблокированные вставкой рецепта (FK), пропускаем до следующего прохода
+SQL_DELETE_ORPHAN_BODIES = """
+    WITH batch AS (
+        SELECT hash FROM recipe_bodies WHERE hash > $1 ORDER BY hash LIMIT $2
+    ),
+    orphans AS (
+        SELECT b.hash FROM recipe_bodies b JOIN batch USING (hash)
+        WHERE NOT EXISTS (SELECT 1 FROM recipes r WHERE r.body_hash = b.hash)
+        FOR UPDATE OF b SKIP LOCKED
+    ),
+    deleted AS (
+        DELETE FROM recipe_bodies b USING orphans WHERE b.hash = orphans.hash
+        RETURNING b.hash
+    )
+    SELECT (SELECT COUNT(*) FROM batch) AS scanned,
+           (SELECT COUNT(*) FROM deleted) AS deleted,
+           (SELECT hash FROM batch ORDER BY hash DESC LIMIT 1) AS last
+"""
+
+SQL_CLEANUP_RECIPE_CACHE = """
+    WITH batch AS (
+        SELECT cache_key FROM recipe_cache
+        WHERE cache_key > $1 AND created_at < NOW() - make_interval(secs => $2)
+        ORDER BY cache_key
+        LIMIT $3
+    ),
+    deleted AS (
+        DELETE FROM recipe_cache c USING batch
+        WHERE c.cache_key = batch.cache_key AND c.created_at < NOW() - make_interval(secs => $2)
+        RETURNING c.cache_key
+    )
+    SELECT (SELECT COUNT(*) FROM batch) AS scanned,
+           (SELECT COUNT(*) FROM deleted) AS deleted,
+           (SELECT MAX(cache_key) FROM batch) AS last
+"""
+
+
 class Database:
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        # Реестр известных пользователей: повторный /start не ходит в БД
+        self._users: "OrderedDict[int, Dict]" = OrderedDict()
+        # user_id -> (время последней команды, username) для пакетной записи last_active
+        self._pending_activity: Dict[int, tuple] = {}
+        self._registry_stats = {"hits": 0, "misses": 0, "activity_flushes": 0, "activity_rows": 0}
+        # Хранилище текстов рецептов (recipe_bodies): байты до/после сжатия и дедупликации
+        self._body_stats = {"saved": 0, "deduplicated": 0, "raw_bytes": 0, "written_bytes": 0, "migrated": 0}
 
     async def connect(self):
         """Подключение к базе данных Supabase"""
@@ -22,7 +449,8 @@ class Database:
                 command_timeout=60,
                 max_inactive_connection_lifetime=300
             )
-            await self._check_tables()
+            await self.migrate()
+            await self.ensure_recipe_partitions()
             logger.info("✅ Успешное подключение к Supabase PostgreSQL")
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к БД: {e}")
@@ -31,24 +459,57 @@ class Database:
     async def close(self):
         """Graceful shutdown пула соединений"""
         if self.pool:
+            await self.flush_user_activity()
             await self.pool.close()
             logger.info("💤 Соединение с БД закрыто")
 
-    async def _check_tables(self):
-        """Проверяем существование таблиц (не создаём автоматически)"""
+    async def migrate(self):
+        """Применяем недостающие миграции (MIGRATIONS)"""
+        async with self.acquire() as conn:
+            await conn.execute("SELECT pg_advisory_lock($1)", _MIGRATION_LOCK_ID)
+            try:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    )
+                """)
+                applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+                for version, name, steps in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    started = time.perf_counter()
+                    async with conn.transaction():
+                        for step in steps:
+                            if isinstance(step, str):
+                                await conn.execute(step)
+                            else:
+                                await step(conn)
+                        await conn.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                            version, name
+                        )
+                    logger.info(f"🧱 Миграция {version} ({name}) применена за {time.perf_counter() - started:.1f}с")
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", _MIGRATION_LOCK_ID)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Соединение из пула с замером ожидания (bot_db_acquire_seconds)"""
+        started = time.perf_counter()
         async with self.pool.acquire() as conn:
-            tables = await conn.fetch("""
-                SELECT tablename 
-                FROM pg_tables 
-                WHERE schemaname = 'public' 
-                AND tablename IN ('users', 'sessions', 'recipes')
-            """)
-            if len(tables) < 3:
-                logger.warning("⚠️  Некоторые таблицы отсутствуют. Убедись, что выполнил SQL из шага 2!")
-                logger.warning(f"Найдены таблицы: {[t['tablename'] for t in tables]}")
+            DB_ACQUIRE_WAIT.observe(time.perf_counter() - started)
+            yield conn
+
+    def get_pool_stats(self) -> Dict:
+        if not self.pool:
+            return {}
+        return {"size": self.pool.get_size(), "idle": self.pool.get_idle_size(), "max_size": self.pool.get_max_size()}
 
     # ==================== ПОЛЬЗОВАТЕЛИ ====================
 
+    @traced()
     async def get_or_create_user(
         self, 
         telegram_id: int, 
@@ -57,53 +518,88 @@ class Database:
         last_name: str = None,
         language: str = 'ru'
     ) -> Dict:
-        """Создаём или получаем пользователя"""
-        async with self.pool.acquire() as conn:
-            # Пробуем найти существующего
+        """Создаём или получаем пользователя.
+        Известных пользователей отдаём из памяти, а last_active пишем пакетом (flush_user_activity)"""
+        known = self._users.get(telegram_id)
+        if known is not None:
+            self._users.move_to_end(telegram_id)
+            if username:
+                known["username"] = username
+            self._pending_activity[telegram_id] = (datetime.now(timezone.utc), username)
+            self._registry_stats["hits"] += 1
+            return known
+
+        # Один запрос вместо SELECT + INSERT/UPDATE + SELECT; xmax = 0 только у вставленной строки
+        async with self.acquire() as conn:
             user = await conn.fetchrow(
-                "SELECT * FROM users WHERE id = $1",
-                telegram_id
+                """
+                INSERT INTO users (id, username, first_name, last_name, language)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (id) DO UPDATE
+                SET last_active = NOW(),
+                    username = COALESCE(EXCLUDED.username, users.username)
+                RETURNING *, (xmax = 0) AS created
+                """,
+                telegram_id, username, first_name, last_name, language
             )
-            
-            if not user:
-                # Создаём нового
-                user = await conn.fetchrow(
-                    """
-                    INSERT INTO users (id, username, first_name, last_name, language)
-                    VALUES ($1, $2, $3, $4, $5)
-                    RETURNING *
-                    """,
-                    telegram_id, username, first_name, last_name, language
-                )
-                logger.info(f"👤 Создан новый пользователь: {telegram_id}")
-            else:
-                # Обновляем активность
+        user = dict(user)
+        if user.pop("created"):
+            logger.info(f"👤 Создан новый пользователь: {telegram_id}")
+        self._registry_stats["misses"] += 1
+        self._users[telegram_id] = user
+        while len(self._users) > USER_REGISTRY_SIZE:
+            self._users.popitem(last=False)
+        return user
+
+    async def flush_user_activity(self):
+        """Пишем накопленные last_active одним UPDATE ... FROM unnest"""
+        if not self._pending_activity or not self.pool:
+            return
+        pending, self._pending_activity = self._pending_activity, {}
+        ids = list(pending)
+        try:
+            async with self.acquire() as conn:
                 await conn.execute(
                     """
-                    UPDATE users 
-                    SET last_active = NOW(), 
-                        username = COALESCE($2, username)
-                    WHERE id = $1
+                    UPDATE users u
+                    SET last_active = GREATEST(u.last_active, v.seen_at),
+                        username = COALESCE(v.username, u.username)
+                    FROM unnest($1::bigint[], $2::timestamptz[], $3::text[]) AS v(id, seen_at, username)
+                    WHERE u.id = v.id
                     """,
-                    telegram_id, username
+                    ids, [pending[i][0] for i in ids], [pending[i][1] for i in ids]
                 )
-                user = await conn.fetchrow(
-                    "SELECT * FROM users WHERE id = $1",
-                    telegram_id
-                )
-            
-            return dict(user)
+            self._registry_stats["activity_flushes"] += 1
+            self._registry_stats["activity_rows"] += len(ids)
+        except Exception as e:
+            # Не теряем отметки: более свежие (пришедшие во время записи) важнее
+            for user_id, value in pending.items():
+                self._pending_activity.setdefault(user_id, value)
+            logger.error(f"Ошибка записи активности пользователей: {e}")
 
+    async def run_activity_flush(self):
+        """Фоновая запись last_active раз в USER_ACTIVITY_FLUSH_SECONDS"""
+        while True:
+            await asyncio.sleep(USER_ACTIVITY_FLUSH_SECONDS)
+            await self.flush_user_activity()
+
+    def get_registry_stats(self) -> Dict:
+        return {**self._registry_stats, "size": len(self._users), "pending_activity": len(self._pending_activity)}
+
+    @traced()
     async def update_user_language(self, telegram_id: int, language: str):
         """Обновляем язык пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE users SET language = $1 WHERE id = $2",
                 language, telegram_id
             )
+        if telegram_id in self._users:
+            self._users[telegram_id]["language"] = language
 
     # ==================== СЕССИИ ====================
 
+    @traced()
     async def create_or_update_session(
         self,
         telegram_id: int,
@@ -115,62 +611,73 @@ class Database:
         history: Optional[List[Dict]] = None
     ) -> Dict:
         """Создаёт или обновляет сессию пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             # Преобразуем Python объекты в JSON
             categories_json = json.dumps(categories) if categories else None
             dishes_json = json.dumps(generated_dishes) if generated_dishes else None
             history_json = json.dumps(history) if history else None
 
-            # Проверяем существующую сессию
-            existing = await conn.fetchrow(
-                "SELECT id FROM sessions WHERE user_id = $1",
-                telegram_id
+            # Одна сессия на пользователя (уникальный индекс sessions_user_id_key)
+            session = await conn.fetchrow(
+                """
+                INSERT INTO sessions 
+                (user_id, products, state, categories, generated_dishes, current_dish, history)
+                VALUES ($1, $2, $3, $4::jsonb, $5::jsonb, $6, $7::jsonb)
+                ON CONFLICT (user_id) DO UPDATE
+                SET 
+                    products = COALESCE(EXCLUDED.products, sessions.products),
+                    state = COALESCE(EXCLUDED.state, sessions.state),
+                    categories = COALESCE(EXCLUDED.categories, sessions.categories),
+                    generated_dishes = COALESCE(EXCLUDED.generated_dishes, sessions.generated_dishes),
+                    current_dish = COALESCE(EXCLUDED.current_dish, sessions.current_dish),
+                    history = COALESCE(EXCLUDED.history, sessions.history),
+                    updated_at = NOW()
+                RETURNING *
+                """,
+                telegram_id, products, state, categories_json, 
+                dishes_json, current_dish, history_json
             )
-
-            if existing:
-                # Обновляем существующую
-                session = await conn.fetchrow(
-                    """
-                    UPDATE sessions 
-                    SET 
-                        products = COALESCE($2, products),
-                        state = COALESCE($3, state),
-                        categories = COALESCE($4::jsonb, categories),
-                        generated_dishes = COALESCE($5::jsonb, generated_dishes),
-                        current_dish = COALESCE($6, current_dish),
-                        history = COALESCE($7::jsonb, history),
-                        updated_at = NOW()
-                    WHERE user_id = $1
-                    RETURNING *
-                    """,
-                    telegram_id, products, state, categories_json, 
-                    dishes_json, current_dish, history_json
-                )
-            else:
-                # Создаём новую
-                session = await conn.fetchrow(
-                    """
-                    INSERT INTO sessions 
-                    (user_id, products, state, categories, generated_dishes, current_dish, history)
-                    VALUES ($1, $2, $3, $4::jsonb, $5::jsonb, $6, $7::jsonb)
-                    RETURNING *
-                    """,
-                    telegram_id, products, state, categories_json, 
-                    dishes_json, current_dish, history_json
-                )
             
             return dict(session) if session else None
 
+    @traced()
+    async def save_sessions_batch(self, rows: List[tuple]) -> set:
+        """Записываем сессии целиком одним запросом (upsert по уникальному user_id).
+        Строка: (user_id, products, state, categories, generated_dishes, current_dish, history), JSON-поля строками.
+        Сессии пользователей без строки в users (get_or_create_user ещё не отработал) пропускаются,
+        иначе FK sessions_user_id_fkey уронил бы весь пакет. Возвращает user_id записанных сессий"""
+        if not rows:
+            return set()
+        columns = list(zip(*rows))
+        async with self.acquire() as conn:
+            written = await conn.fetch(
+                """
+                INSERT INTO sessions (user_id, products, state, categories, generated_dishes, current_dish, history)
+                SELECT d.user_id, d.products, d.state, d.categories::jsonb, d.generated_dishes::jsonb,
+                       d.current_dish, d.history::jsonb
+                FROM unnest($1::bigint[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[], $7::text[])
+                AS d(user_id, products, state, categories, generated_dishes, current_dish, history)
+                JOIN users u ON u.id = d.user_id
+                ON CONFLICT (user_id) DO UPDATE
+                SET products = EXCLUDED.products,
+                    state = EXCLUDED.state,
+                    categories = EXCLUDED.categories,
+                    generated_dishes = EXCLUDED.generated_dishes,
+                    current_dish = EXCLUDED.current_dish,
+                    history = EXCLUDED.history,
+                    updated_at = NOW()
+                RETURNING user_id
+                """,
+                *[list(column) for column in columns]
+            )
+        return {row["user_id"] for row in written}
+
+    @traced()
     async def get_session(self, telegram_id: int) -> Optional[Dict]:
         """Получаем текущую сессию пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             session = await conn.fetchrow(
-                """
-                SELECT * FROM sessions 
-                WHERE user_id = $1
-                ORDER BY updated_at DESC 
-                LIMIT 1
-                """,
+                SQL_GET_SESSION,
                 telegram_id
             )
             
@@ -202,25 +709,28 @@ class Database:
                 return session_dict
             return None
 
+    @traced()
     async def update_session_state(self, telegram_id: int, state: str):
         """Обновляем только состояние сессии"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE sessions SET state = $1, updated_at = NOW() WHERE user_id = $2",
                 state, telegram_id
             )
 
+    @traced()
     async def update_session_products(self, telegram_id: int, products: str):
         """Обновляем только продукты в сессии"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE sessions SET products = $1, updated_at = NOW() WHERE user_id = $2",
                 products, telegram_id
             )
 
+    @traced()
     async def clear_session(self, telegram_id: int):
         """Очищаем сессию пользователя (мягкое удаление)"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 """
                 UPDATE sessions 
@@ -238,9 +748,10 @@ class Database:
             )
             logger.info(f"🧹 Сессия очищена для пользователя {telegram_id}")
 
+    @traced()
     async def delete_session(self, telegram_id: int):
         """Полное удаление сессии"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "DELETE FROM sessions WHERE user_id = $1",
                 telegram_id
@@ -248,6 +759,7 @@ class Database:
 
     # ==================== РЕЦЕПТЫ ====================
 
+    @traced()
     async def save_recipe(
         self,
         telegram_id: int,
@@ -255,59 +767,489 @@ class Database:
         recipe_text: str,
         products_used: Optional[str] = None
     ) -> int:
-        """Сохраняем рецепт в историю"""
-        async with self.pool.acquire() as conn:
-            recipe = await conn.fetchrow(
+        """Сохраняем рецепт в историю: текст — в recipe_bodies (если такого ещё нет), в recipes — ссылка"""
+        body_hash, body, raw_size = pack_recipe_body(recipe_text)
+
+        async def insert():
+            async with self.acquire() as conn:
+                return await conn.fetchrow(
+                    """
+                    WITH stored AS (
+                        INSERT INTO recipe_bodies (hash, body, raw_size)
+                        VALUES ($3, $4, $5)
+                        ON CONFLICT (hash) DO NOTHING
+                        RETURNING 1
+                    )
+                    INSERT INTO recipes (user_id, dish_name, body_hash, products_used)
+                    VALUES ($1, $2, $3, $6)
+                    RETURNING id, EXISTS (SELECT 1 FROM stored) AS stored
+                    """,
+                    telegram_id, dish_name, body_hash, body, raw_size, products_used
+                )
+
+        try:
+            recipe = await insert()
+        except asyncpg.CheckViolationError:
+            # Нет секции на текущий месяц (обслуживание давно не запускалось) — создаём и повторяем
+            await self.ensure_recipe_partitions()
+            recipe = await insert()
+        except asyncpg.ForeignKeyViolationError:
+            # Текст уже был (ON CONFLICT DO NOTHING), но обслуживание удалило его как ничейный
+            # до проверки FK. Повторная вставка запишет текст заново
+            recipe = await insert()
+        self._body_stats["saved"] += 1
+        self._body_stats["raw_bytes"] += raw_size
+        if recipe["stored"]:
+            self._body_stats["written_bytes"] += len(body)
+        else:
+            self._body_stats["deduplicated"] += 1
+        logger.info(f"📝 Рецепт сохранён: {dish_name} для пользователя {telegram_id}")
+        return recipe['id']
+
+    @traced()
+    async def get_user_recipes(self, telegram_id: int, limit: int = 10) -> List[Dict]:
+        """Получаем историю рецептов пользователя (без текста — он нужен только при открытии рецепта)"""
+        async with self.acquire() as conn:
+            recipes = await conn.fetch(
+                SQL_GET_USER_RECIPES,
+                telegram_id, limit
+            )
+            return [dict(r) for r in recipes]
+
+    @traced()
+    async def get_recipe_page(
+        self,
+        telegram_id: int,
+        limit: int,
+        cursor: Optional[tuple] = None,
+        newer: bool = False
+    ) -> tuple:
+        """Страница истории по ключу (created_at, id), новые первыми, без OFFSET.
+        cursor — (created_at, id) крайней записи соседней страницы: newer=False — записи старше неё,
+        newer=True — новее. Возвращает (записи, есть ли ещё записи в ту же сторону)"""
+        if cursor is None:
+            sql, args = SQL_RECIPE_PAGE_FIRST, [telegram_id, limit + 1]
+        elif newer:
+            sql, args = SQL_RECIPE_PAGE_NEWER, [telegram_id, limit + 1, *cursor]
+        else:
+            sql, args = SQL_RECIPE_PAGE_OLDER, [telegram_id, limit + 1, *cursor]
+        async with self.acquire() as conn:
+            rows = await conn.fetch(sql, *args)
+        recipes = [dict(r) for r in rows[:limit]]
+        if newer and cursor is not None:
+            recipes.reverse()
+        return recipes, len(rows) > limit
+
+    @traced()
+    async def get_recipe_text(self, recipe_id: int, telegram_id: int, created_at: datetime) -> Optional[str]:
+        """Полный текст рецепта из истории пользователя.
+        created_at обязателен: без него запрос прошёл бы по всем месячным секциям recipes"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                SQL_GET_RECIPE_TEXT,
+                recipe_id, telegram_id, created_at
+            )
+        if row is None:
+            return None
+        return unpack_recipe_body(row["body"]) if row["body"] is not None else row["recipe_text"]
+
+    async def migrate_recipe_bodies(self, batch_size: int = 500) -> int:
+        """Переносим текст старых строк recipes в recipe_bodies. Возвращает число перенесённых строк"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                SQL_LEGACY_RECIPE_TEXTS,
+                batch_size
+            )
+            if not rows:
+                return 0
+            packed = [pack_recipe_body(row["recipe_text"]) for row in rows]
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO recipe_bodies (hash, body, raw_size)
+                    SELECT * FROM unnest($1::bytea[], $2::bytea[], $3::int[])
+                    ON CONFLICT (hash) DO NOTHING
+                    """,
+                    [p[0] for p in packed], [p[1] for p in packed], [p[2] for p in packed]
+                )
+                # Строку могли удалить или перенести параллельно — условие на recipe_text это учитывает
+                await conn.execute(
+                    """
+                    UPDATE recipes r SET body_hash = data.hash, recipe_text = NULL
+                    FROM unnest($1::int[], $2::bytea[]) AS data(id, hash)
+                    WHERE r.id = data.id AND r.recipe_text IS NOT NULL
+                    """,
+                    [row["id"] for row in rows], [p[0] for p in packed]
+                )
+        self._body_stats["migrated"] += len(rows)
+        return len(rows)
+
+    async def run_body_migration(self, batch_size: int = 500, pause: float = 1.0):
+        """Фоновый перенос старых рецептов небольшими пакетами, чтобы не мешать боту"""
+        total = 0
+        while True:
+            try:
+                moved = await self.migrate_recipe_bodies(batch_size)
+            except Exception as e:
+                logger.error(f"Ошибка переноса текстов рецептов: {e}")
+                return
+            if not moved:
+                break
+            total += moved
+            await asyncio.sleep(pause)
+        if total:
+            logger.info(f"🗜 Тексты {total} старых рецептов перенесены в recipe_bodies")
+
+    def get_body_stats(self) -> Dict:
+        stats = self._body_stats
+        return {
+            **stats,
+            # Во сколько раз меньше байт ушло в БД, чем при записи текста в каждую строку
+            "write_ratio": round(stats["raw_bytes"] / stats["written_bytes"], 2) if stats["written_bytes"] else None,
+        }
+
+    async def ensure_recipe_partitions(self, months_ahead: int = RECIPE_PARTITIONS_AHEAD):
+        """Секции recipes на текущий месяц и months_ahead следующих"""
+        month = _month_start(datetime.now(timezone.utc))
+        async with self.acquire() as conn:
+            if await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = 'recipes'::regclass") != "p":
+                return
+            for _ in range(months_ahead + 1):
+                await _create_recipe_partition(conn, month)
+                month = _next_month(month)
+
+    async def drop_old_recipe_partitions(self, retention_months: int) -> List[str]:
+        """Отцепляем и удаляем секции, целиком старше retention_months месяцев.
+        Это дешевле DELETE: строки не перебираются, только вычитаются из счётчика"""
+        cutoff = _month_start(datetime.now(timezone.utc))
+        for _ in range(retention_months):
+            cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+        dropped = []
+        async with self.acquire() as conn:
+            partitions = await conn.fetch(
+                """
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'recipes'::regclass
+                ORDER BY c.relname
+                """
+            )
+            for partition in partitions:
+                name = partition["relname"]
+                month = datetime.strptime(name, "recipes_p%Y%m").replace(tzinfo=timezone.utc)
+                if _next_month(month) > cutoff:
+                    break
+                async with conn.transaction():
+                    await conn.execute(f"""
+                        UPDATE bot_counters SET value = value - (SELECT COUNT(*) FROM {name}) WHERE name = 'recipes';
+                        ALTER TABLE recipes DETACH PARTITION {name};
+                        DROP TABLE {name};
+                    """)
+                dropped.append(name)
+                logger.info(f"🗂 Секция {name} удалена")
+        return dropped
+
+    async def get_recipe_storage_report(self) -> Dict:
+        """Сколько места занимают тексты рецептов в БД (для python bench.py storage)"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM recipe_bodies) AS bodies,
+                    (SELECT COALESCE(SUM(raw_size), 0) FROM recipe_bodies) AS unique_raw_bytes,
+                    (SELECT COALESCE(SUM(octet_length(body)), 0) FROM recipe_bodies) AS stored_bytes,
+                    (SELECT COALESCE(SUM(b.raw_size), 0)
+                     FROM recipes r JOIN recipe_bodies b ON b.hash = r.body_hash) AS logical_bytes,
+                    (SELECT COUNT(*) FROM recipes WHERE body_hash IS NOT NULL) AS referenced_rows,
+                    (SELECT COUNT(*) FROM recipes WHERE body_hash IS NULL) AS legacy_rows,
+                    (pg_total_relation_size('recipes') + (
+                        SELECT COALESCE(SUM(pg_total_relation_size(inhrelid)), 0)
+                        FROM pg_inherits WHERE inhparent = 'recipes'::regclass
+                    ))::bigint AS recipes_table_bytes,
+                    pg_total_relation_size('recipe_bodies') AS bodies_table_bytes
+                """
+            )
+            return dict(row)
+
+    async def get_fallback_recipes(self, limit: int, days: int) -> List[Dict]:
+        """Последние уникальные по названию рецепты за days дней для запасного корпуса.
+        Окно по created_at отсекает старые секции recipes; сортируются строки с одним
+        body_hash, а тексты читаются и распаковываются только для отобранных рецептов"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT l.dish_name, l.recipe_text, b.body, l.products_used
+                FROM (
+                    SELECT * FROM (
+                        SELECT DISTINCT ON (lower(r.dish_name))
+                            r.dish_name, r.recipe_text, r.body_hash, r.products_used, r.created_at
+                        FROM recipes r LEFT JOIN recipe_bodies rb ON rb.hash = r.body_hash
+                        WHERE r.created_at > NOW() - make_interval(days => $2)
+                        -- Размер в байтах UTF-8: 600 байт — примерно 300 символов кириллицей
+                        AND COALESCE(rb.raw_size, octet_length(r.recipe_text)) > 600
+                        AND r.dish_name NOT LIKE '% + %'
+                        ORDER BY lower(r.dish_name), r.created_at DESC
+                    ) latest
+                    ORDER BY created_at DESC
+                    LIMIT $1
+                ) l
+                LEFT JOIN recipe_bodies b ON b.hash = l.body_hash
+                ORDER BY l.created_at DESC
+                """,
+                limit, days
+            )
+        result = []
+        for row in rows:
+            recipe = dict(row)
+            body = recipe.pop("body")
+            if body is not None:
+                recipe["recipe_text"] = unpack_recipe_body(body)
+            result.append(recipe)
+        return result
+
+    # ==================== КЕШ РЕЦЕПТОВ ====================
+
+    @traced()
+    async def get_cached_recipe(self, cache_key: str, max_age_seconds: int) -> Optional[str]:
+        """Достаём рецепт из кеша (с учётом TTL) и отмечаем попадание"""
+        async with self.acquire() as conn:
+            return await conn.fetchval(
+                SQL_GET_CACHED_RECIPE,
+                cache_key, float(max_age_seconds)
+            )
+
+    @traced()
+    async def save_cached_recipe(
+        self,
+        cache_key: str,
+        dish_name: str,
+        products_key: str,
+        language: str,
+        recipe_text: str
+    ):
+        """Кладём рецепт в кеш (перезаписывая старый вариант)"""
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO recipe_cache (cache_key, dish_name, products_key, language, recipe_text)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET recipe_text = EXCLUDED.recipe_text,
+                    created_at = NOW(),
+                    hits = 0
+                """,
+                cache_key, dish_name, products_key, language, recipe_text
+            )
+
+    # ==================== ИНДЕКС НАБОРОВ ПРОДУКТОВ ====================
+
+    @traced()
+    async def save_product_index_entry(self, set_key: str, items: List[str], kind: str, payload: str):
+        """Сохраняем результат (категории / список блюд) для набора продуктов"""
+        async with self.acquire() as conn:
+            await conn.execute(
                 """
-                INSERT INTO recipes (user_id, dish_name, recipe_text, products_used)
+                INSERT INTO product_index (set_key, kind, items, payload)
                 VALUES ($1, $2, $3, $4)
-                RETURNING id
+                ON CONFLICT (set_key, kind) DO UPDATE
+                SET payload = EXCLUDED.payload,
+                    updated_at = NOW()
                 """,
-                telegram_id, dish_name, recipe_text, products_used
+                set_key, kind, items, payload
             )
-            logger.info(f"📝 Рецепт сохранён: {dish_name} для пользователя {telegram_id}")
-            return recipe['id']
 
-    async def get_user_recipes(self, telegram_id: int, limit: int = 10) -> List[Dict]:
-        """Получаем историю рецептов пользователя"""
-        async with self.pool.acquire() as conn:
-            recipes = await conn.fetch(
+    async def get_product_index_entries(self, max_sets: int, max_age_seconds: int) -> List[Dict]:
+        """Записи для max_sets последних наборов, новые первыми"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
                 """
-                SELECT * FROM recipes 
-                WHERE user_id = $1 
-                ORDER BY created_at DESC 
-                LIMIT $2
+                SELECT p.set_key, p.kind, p.items, p.payload, p.updated_at
+                FROM product_index p
+                JOIN (
+                    SELECT set_key, MAX(updated_at) AS last_update
+                    FROM product_index
+                    WHERE updated_at > NOW() - make_interval(secs => $2)
+                    GROUP BY set_key
+                    ORDER BY last_update DESC
+                    LIMIT $1
+                ) recent ON recent.set_key = p.set_key
+                WHERE p.updated_at > NOW() - make_interval(secs => $2)
+                ORDER BY recent.last_update DESC
                 """,
-                telegram_id, limit
+                max_sets, float(max_age_seconds)
             )
-            return [dict(r) for r in recipes]
+            return [dict(r) for r in rows]
 
-    # ==================== АДМИНИСТРАТИВНЫЕ ====================
+    # ==================== БИБЛИОТЕКА РЕЦЕПТОВ ====================
 
-    async def cleanup_old_sessions(self, days_old: int = 7):
-        """Удаляем старые сессии"""
-        async with self.pool.acquire() as conn:
-            result = await conn.execute(
+    async def get_top_dishes(self, limit: int) -> List[Dict]:
+        """Самые частые названия блюд из истории (без сборных меню)"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
                 """
-                DELETE FROM sessions 
-                WHERE updated_at < NOW() - INTERVAL '$1 days'
+                SELECT MIN(dish_name) AS dish_name, COUNT(*) AS requests
+                FROM recipes
+                WHERE dish_name NOT LIKE '% + %'
+                GROUP BY lower(dish_name)
+                ORDER BY requests DESC
+                LIMIT $1
                 """,
-                days_old
+                limit
             )
-            logger.info(f"🧹 Удалены старые сессии: {result}")
+            return [dict(r) for r in rows]
 
-    async def get_stats(self) -> Dict:
-        """Статистика базы данных"""
-        async with self.pool.acquire() as conn:
-            users_count = await conn.fetchval("SELECT COUNT(*) FROM users")
-            sessions_count = await conn.fetchval("SELECT COUNT(*) FROM sessions")
-            recipes_count = await conn.fetchval("SELECT COUNT(*) FROM recipes")
-            
-            return {
-                "users": users_count,
-                "active_sessions": sessions_count,
-                "saved_recipes": recipes_count
-            }
+    async def upsert_library_candidates(self, candidates: List[tuple]):
+        """Добавляем блюда в очередь библиотеки: (dish_key, dish_name, language, requests).
+        Уже готовые записи не трогаем, только обновляем популярность"""
+        async with self.acquire() as conn:
+            await conn.executemany(
+                """
+                INSERT INTO recipe_library (dish_key, dish_name, language, requests)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (dish_key) DO UPDATE
+                SET requests = GREATEST(recipe_library.requests, EXCLUDED.requests)
+                """,
+                candidates
+            )
+
+    async def get_library_work(self, limit: int, max_attempts: int) -> List[Dict]:
+        """Что осталось сделать: новые, упавшие (с запасом попыток) и устаревшие записи"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT dish_key, dish_name, language, status, attempts
+                FROM recipe_library
+                WHERE status = 'pending'
+                OR (status = 'failed' AND attempts < $2)
+                OR (status = 'done' AND refresh_after < NOW())
+                ORDER BY requests DESC, dish_key
+                LIMIT $1
+                """,
+                limit, max_attempts
+            )
+            return [dict(r) for r in rows]
+
+    async def save_library_recipe(self, dish_key: str, recipe_text: str, refresh_seconds: float):
+        """Готовый рецепт: сбрасываем попытки и назначаем следующее обновление"""
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE recipe_library
+                SET recipe_text = $2, status = 'done', attempts = 0, error = NULL,
+                    generated_at = NOW(),
+                    refresh_after = NOW() + make_interval(secs => $3),
+                    updated_at = NOW()
+                WHERE dish_key = $1
+                """,
+                dish_key, recipe_text, float(refresh_seconds)
+            )
+
+    async def mark_library_failed(self, dish_key: str, error: str):
+        """Неудачная попытка. Старый рецепт (если был) остаётся в выдаче"""
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE recipe_library
+                SET status = CASE WHEN recipe_text IS NULL THEN 'failed' ELSE status END,
+                    attempts = attempts + 1,
+                    error = $2,
+                    refresh_after = CASE WHEN recipe_text IS NULL THEN refresh_after
+                                         ELSE NOW() + INTERVAL '1 day' END,
+                    updated_at = NOW()
+                WHERE dish_key = $1
+                """,
+                dish_key, error[:500]
+            )
+
+    async def get_library_recipes(self) -> List[Dict]:
+        """Все готовые рецепты библиотеки"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT dish_key, recipe_text FROM recipe_library WHERE recipe_text IS NOT NULL"
+            )
+            return [dict(r) for r in rows]
+
+    async def get_library_status(self) -> Dict:
+        """Сводка по библиотеке для CLI"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT status, COUNT(*) AS n FROM recipe_library GROUP BY status")
+            stale = await conn.fetchval(
+                "SELECT COUNT(*) FROM recipe_library WHERE status = 'done' AND refresh_after < NOW()"
+            )
+            return {**{r["status"]: r["n"] for r in rows}, "stale": stale}
+
+    # ==================== АДМИНИСТРАТИВНЫЕ ====================
+
+    # Очистка идёт пакетами по первичному ключу (maintenance.py): каждый вызов трогает
+    # не больше limit строк после курсора after и возвращает (просмотрено, удалено, новый курсор)
+
+    async def cleanup_old_sessions(self, days_old: int = 7, after: int = 0, limit: int = 1000) -> tuple:
+        """Удаляем сессии без активности дольше days_old дней"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                SQL_CLEANUP_OLD_SESSIONS,
+                after, days_old, limit
+            )
+        return row["scanned"], row["deleted"], row["last"]
+
+    async def trim_recipe_history(self, keep: int, after: int = 0, users_limit: int = 500, limit: int = 1000) -> tuple:
+        """Оставляем пользователям users_limit штук после курсора по users.id только keep последних рецептов.
+        Если удалено ровно limit, у этих пользователей могло остаться лишнее — курсор не двигается"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                SQL_TRIM_RECIPE_HISTORY,
+                after, users_limit, keep, limit
+            )
+        last = after if row["deleted"] >= limit else row["last"]
+        return row["scanned"], row["deleted"], last
+
+    async def delete_orphan_bodies(self, after: bytes = b"", limit: int = 1000) -> tuple:
+        """Удаляем тексты рецептов, на которые не ссылается ни одна строка recipes.
+        Строки, заблокированные вставкой рецепта (FK), пропускаем до следующего прохода"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                SQL_DELETE_ORPHAN_BODIES,
+                after, limit
+            )
+        return row["scanned"], row["deleted"], row["last"]
+
+    async def cleanup_recipe_cache(self, max_age_seconds: int, after: str = "", limit: int = 1000) -> tuple:
+        """Удаляем из recipe_cache записи старше TTL (при чтении они всё равно не используются)"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                SQL_CLEANUP_RECIPE_CACHE,
+                after, float(max_age_seconds), limit
+            )
+        return row["scanned"], row["deleted"], row["last"]
+
+    async def get_stats(self, estimate: bool = False) -> Dict:
+        """Статистика базы данных: счётчики bot_counters (точно) или pg_class.reltuples (оценка).
+        COUNT(*) по растущим таблицам не делаем"""
+        async with self.acquire() as conn:
+            if estimate:
+                # Для секционированных таблиц складываем оценки секций
+                rows = await conn.fetch(
+                    """
+                    SELECT c.relname AS name,
+                           (GREATEST(c.reltuples, 0) + COALESCE((
+                               SELECT SUM(GREATEST(p.reltuples, 0))
+                               FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+                               WHERE i.inhparent = c.oid
+                           ), 0))::bigint AS value
+                    FROM pg_class c
+                    WHERE c.relname = ANY($1::text[])
+                    AND c.relnamespace = 'public'::regnamespace
+                    AND c.relkind IN ('r', 'p')
+                    """,
+                    list(COUNTED_TABLES)
+                )
+            else:
+                rows = await conn.fetch("SELECT name, value FROM bot_counters")
+        counts = {row["name"]: row["value"] for row in rows}
+        return {
+            "users": counts.get("users", 0),
+            "active_sessions": counts.get("sessions", 0),
+            "saved_recipes": counts.get("recipes", 0)
+        }
 
 # Глобальный экземпляр для использования
 db = Database()
@@ -0,0 +1,127 @@
+import re
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from config import FALLBACK_CORPUS_SIZE, FALLBACK_CORPUS_REFRESH, FALLBACK_CORPUS_DAYS
+from database import db
+from ingredients import normalize_text, canonical_products
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'[a-zа-я]{3,}')
+# Грубая основа слова: "котлеты"/"котлетами" -> "котле"
+_STEM_LENGTH = 5
+# Минимальное сходство названия, чтобы отдать рецепт вместо запрошенного
+MIN_NAME_SCORE = 0.5
+
+
+def _stems(text: str) -> FrozenSet[str]:
+    return frozenset(w[:_STEM_LENGTH] for w in _WORD_RE.findall(normalize_text(text)))
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("dish_name", "recipe_text", "name_stems", "product_stems")
+
+    def __init__(self, dish_name: str, recipe_text: str, products: str):
+        self.dish_name = dish_name
+        self.recipe_text = recipe_text
+        self.name_stems = _stems(dish_name)
+        self.product_stems = frozenset(s for item in canonical_products(products or "") for s in _stems(item))
+
+
+class FallbackCorpus:
+    """Запасные рецепты на время недоступности Groq.
+
+    Собирается из ранее сгенерированных рецептов (таблица recipes) и пополняется
+    свежими рецептами на лету. Поиск — по сходству названия и пересечению продуктов.
+    """
+
+    def __init__(
+        self,
+        max_size: int = FALLBACK_CORPUS_SIZE,
+        refresh_interval: int = FALLBACK_CORPUS_REFRESH,
+        window_days: int = FALLBACK_CORPUS_DAYS
+    ):
+        self.max_size = max_size
+        self.refresh_interval = refresh_interval
+        self.window_days = window_days
+        # нормализованное название -> запись
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._stats = {"served_recipes": 0, "served_dishes": 0, "misses": 0}
+
+    async def load(self):
+        """Загружаем последние уникальные рецепты из БД за window_days дней"""
+        if not db.pool:
+            return
+        try:
+            rows = await db.get_fallback_recipes(self.max_size, self.window_days)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки запасных рецептов: {e}")
+            return
+        # Из БД приходят новые первыми; добавляем от старых к новым, чтобы LRU-порядок совпал
+        for row in reversed(rows):
+            self.add(row["dish_name"], row["products_used"], row["recipe_text"])
+        logger.info(f"📚 Запасных рецептов загружено: {len(self._entries)}")
+
+    async def run_refresh(self):
+        """Фоновое обновление из БД (рецепты других инстансов и после рестарта)"""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.load()
+
+    def add(self, dish_name: str, products: Optional[str], recipe_text: str):
+        if not dish_name or not recipe_text:
+            return
+        key = normalize_text(dish_name)
+        self._entries[key] = _Entry(dish_name, recipe_text, products or "")
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _score(self, entry: _Entry, name_stems: FrozenSet[str], product_stems: FrozenSet[str]) -> Tuple[float, float]:
+        return _jaccard(entry.name_stems, name_stems), _jaccard(entry.product_stems, product_stems)
+
+    def find_recipe(self, dish_name: str, products: str = "") -> Optional[str]:
+        """Рецепт с похожим названием; при равенстве — с большим пересечением продуктов"""
+        name_stems = _stems(dish_name)
+        product_stems = _stems(products)
+        best, best_score = None, (MIN_NAME_SCORE, 0.0)
+        for entry in self._entries.values():
+            score = self._score(entry, name_stems, product_stems)
+            if score >= best_score:
+                best, best_score = entry, score
+        if best is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["served_recipes"] += 1
+        return best.recipe_text
+
+    def suggest_dishes(self, products: str, limit: int = 5) -> List[Dict[str, str]]:
+        """Блюда из сохранённых рецептов, в которых больше всего продуктов пользователя"""
+        product_stems = _stems(products)
+        scored = []
+        for entry in self._entries.values():
+            overlap = _jaccard(entry.product_stems, product_stems)
+            if overlap > 0:
+                scored.append((overlap, entry.dish_name))
+        scored.sort(reverse=True)
+        dishes = [{"name": name, "desc": "📚 Из сохранённых рецептов"} for _, name in scored[:limit]]
+        if dishes:
+            self._stats["served_dishes"] += 1
+        else:
+            self._stats["misses"] += 1
+        return dishes
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, "size": len(self._entries)}
+
+
+# Глобальный экземпляр
+fallback_corpus = FallbackCorpus()
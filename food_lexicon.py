@@ -0,0 +1,109 @@
+"""Словарь продуктов для локальной проверки ввода (русский и английский).
+
+Слова даны в начальной форме: падежные окончания и опечатки
+обрабатывает ingredient_validator.
+"""
+
+FOOD_WORDS_RU = """
+картофель картошка морковь морковка лук луковица чеснок помидор томат черри огурец огурчик
+капуста брокколи цветная кольраби свекла свёкла редис редиска редька репа пастернак сельдерей
+перец болгарский халапеньо чили кабачок цуккини баклажан тыква патиссон спаржа артишок
+горох горошек фасоль стручковая чечевица нут маш соя кукуруза оливка маслина каперс
+шпинат щавель руккола салат айсберг романо латук кресс-салат мангольд
+зелень укроп петрушка кинза базилик розмарин тимьян чабрец мята мелисса орегано майоран шалфей эстрагон лавровый
+имбирь хрен васаби горчица кориандр куркума корица гвоздика мускатный паприка кардамон ваниль ванилин шафран зира кумин анис бадьян карри хмели-сунели
+гриб грибы шампиньон вешенка опенок опята лисичка подосиновик подберезовик трюфель шиитаке
+яблоко груша банан апельсин мандарин лимон лайм грейпфрут помело киви ананас манго папайя авокадо
+виноград изюм клубника земляника малина ежевика черника голубика брусника клюква смородина крыжовник вишня черешня
+слива чернослив персик нектарин абрикос курага инжир финик гранат хурма айва дыня арбуз кокос маракуйя фейхоа облепиха рябина шиповник
+орех грецкий фундук миндаль кешью арахис фисташка пекан кедровый семечки кунжут лен чиа мак
+яйцо яйца желток белок перепелиный
+молоко кефир ряженка простокваша йогурт сметана сливки творог сыр брынза моцарелла пармезан фета рикотта маскарпоне сулугуни адыгейский
+масло маргарин майонез кетчуп соус уксус горчица аджика песто ткемали
+мясо говядина телятина свинина баранина ягнятина козлятина конина крольчатина оленина
+курица цыпленок цыплёнок курочка бедро бедрышко голень грудка филе крылышко окорочок индейка утка гусь перепел
+фарш котлета колбаса сосиска сарделька ветчина бекон грудинка буженина карбонад салями сало шпик печень печенка сердце язык почки желудки
+рыба лосось семга сёмга форель горбуша кета нерка треска минтай хек пикша камбала палтус скумбрия сельдь селедка сёмга килька шпроты сардина
+тунец карп щука судак окунь сом толстолобик лещ карась мойва корюшка анчоус дорадо сибас тилапия пангасиус
+креветка кальмар мидия осьминог краб крабовые гребешок устрица рапан икра
+рис гречка гречиха пшено овсянка овес овёс хлопья мюсли манка перловка ячка булгур кускус киноа полба
+макароны спагетти паста лапша вермишель фунчоза рожки пенне феттучини лазанья равиоли пельмени вареники
+мука крахмал дрожжи разрыхлитель сода желатин агар
+хлеб батон багет лаваш тортилья булка булочка сухари гренки панировка хлебцы
+сахар соль мед мёд сироп патока варенье джем повидло шоколад какао кофе чай
+вода бульон сок компот квас пиво вино коньяк ром водка
+тофу хумус сейтан тесто
+овощ фрукт ягода крупа зерно консервы тушенка тушёнка сгущенка сгущёнка пюре крем
+"""
+
+FOOD_WORDS_EN = """
+potato carrot onion garlic tomato cucumber cabbage broccoli cauliflower beet beetroot radish turnip celery
+pepper chili jalapeno zucchini courgette eggplant aubergine pumpkin squash asparagus artichoke
+pea bean lentil chickpea corn olive caper spinach arugula rocket lettuce kale chard
+herb dill parsley cilantro coriander basil rosemary thyme mint oregano sage tarragon bay
+ginger horseradish wasabi mustard turmeric cinnamon clove nutmeg paprika cardamom vanilla saffron cumin anise curry
+mushroom champignon chanterelle truffle shiitake
+apple pear banana orange tangerine mandarin lemon lime grapefruit kiwi pineapple mango papaya avocado
+grape raisin strawberry raspberry blackberry blueberry cranberry currant gooseberry cherry
+plum prune peach nectarine apricot fig date pomegranate persimmon quince melon watermelon coconut
+nut walnut hazelnut almond cashew peanut pistachio pecan seed sesame flax chia poppy
+egg yolk milk kefir yogurt yoghurt cream buttermilk cheese mozzarella parmesan feta ricotta mascarpone cheddar
+butter margarine mayonnaise ketchup sauce vinegar pesto
+meat beef veal pork lamb mutton rabbit venison chicken hen breast thigh drumstick wing fillet turkey duck goose quail
+mince sausage ham bacon salami lard liver heart tongue kidney
+fish salmon trout cod pollock hake haddock flounder halibut mackerel herring sprat sardine tuna carp pike perch catfish anchovy tilapia
+shrimp prawn squid mussel octopus crab scallop oyster caviar
+rice buckwheat millet oat oatmeal flake muesli semolina barley bulgur couscous quinoa
+pasta spaghetti noodle macaroni vermicelli penne fettuccine lasagna ravioli dumpling
+flour starch yeast soda gelatin
+bread baguette loaf bun tortilla pita cracker breadcrumb
+sugar salt honey syrup jam chocolate cocoa coffee tea
+water broth stock juice beer wine rum vodka tofu hummus dough
+vegetable fruit berry grain cereal
+"""
+
+# Формы, которые не получаются из начальной формы окончанием
+IRREGULAR_FORMS = """
+яиц яичко яички яичный куриный куры кур мяса луку чесноку potatoes tomatoes
+"""
+
+# Приветствия и служебные слова: ввод только из них — точно не список продуктов
+FILLER_WORDS = """
+у меня есть имеется в наличии и или с со а еще ещё вот всё все
+продукты ингредиенты холодильнике
+привет здравствуй здравствуйте добрый день вечер утро пока спасибо пожалуйста
+hello hi hey bye thanks please
+have some and or with a an of the
+"""
+
+# Слова, которые не являются продуктами, но часто встречаются в списках.
+# Слово, которое распознаётся как продукт ("сыр" и "сырой", "соя" и "со"), нейтральным не считается
+NEUTRAL_WORDS = FILLER_WORDS + """
+немного много пару пара несколько
+кусок кусочек банка пачка упаковка пакет бутылка стакан ложка щепотка пучок головка зубчик
+штука штуки шт грамм гр г кг килограмм литр л мл
+свежий свежая свежие замороженный замороженная копченый копчёный вареный варёный жареный
+сырой красный зеленый зелёный желтый жёлтый черный чёрный большой маленький домашний
+fresh frozen smoked red green yellow black big small
+piece pack can bottle cup spoon pinch bunch clove kg g gram grams l ml
+"""
+
+# Корни мата: русские ищем в начале слова (в том числе после приставки), английские — как
+# слово целиком с обычными суффиксами. Такой ввод отклоняем без запроса к LLM
+BLOCKED_ROOTS = (
+    "хуй", "хуе", "хуё", "хуя", "пизд", "ебан", "ебат", "ебал", "еблан", "ёбан", "бляд", "блят",
+    "мудак", "мудил", "залуп", "гандон", "шлюх", "fuck", "shit", "bitch", "cunt",
+)
+
+# Заведомо несъедобное. Отклоняем, только если во вводе нет ни одного продукта:
+# "glass noodles" или "stone fruit" — это еда
+BLOCKED_WORDS_RU = """
+яд отрава цианид мышьяк ртуть бензин керосин ацетон растворитель антифриз
+стекло гвоздь кирпич камень бетон цемент пластик резина клей краска мыло шампунь
+таблетка наркотик кокаин героин
+"""
+
+BLOCKED_WORDS_EN = """
+poison cyanide arsenic mercury gasoline petrol kerosene acetone antifreeze
+glass nail brick stone sand concrete cement plastic rubber glue paint soap shampoo
+"""
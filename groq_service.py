@@ -1,22 +1,71 @@
 from groq import AsyncGroq
-from config import GROQ_API_KEY, GROQ_MODEL
-from typing import Dict, List, Optional
-import json
+from config import GROQ_API_KEY, GROQ_MODEL, GROQ_FAST_MODEL
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+from recipe_cache import recipe_cache
+from ingredients import split_products
+from singleflight import SingleFlight
+from ingredient_validator import ingredient_validator
+from llm_scheduler import llm_scheduler, StreamInterrupted
+from model_router import model_router
+from validation_batcher import MicroBatcher
+from circuit_breaker import groq_breaker, CircuitOpenError
+from fallback_corpus import fallback_corpus
+from product_index import product_index
+from recipe_library import recipe_library
+from metrics import observe_groq
+from tracing import span, traced
+from llm_transport import llm_transport
+import groq
+from structured_output import parse_structured, reask_prompt, structured_stats, uses_json_mode
 import re
+import time
+import asyncio
 import logging
 
-client = AsyncGroq(api_key=GROQ_API_KEY)
+# Клиент создаётся при первом настоящем запросе: в режиме replay (llm_transport.py) ключ API не нужен
+_client: Optional[AsyncGroq] = None
 logger = logging.getLogger(__name__)
 
+# Склейка одинаковых запросов, которые выполняются одновременно
+inflight_requests = SingleFlight()
+
+
+def get_client() -> AsyncGroq:
+    global _client
+    if _client is None:
+        # Повторы делает llm_scheduler, поэтому встроенные ретраи клиента выключены
+        _client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
+    return _client
+
 class GroqService:
     
+    # model — основная модель, fallbacks — запасные по порядку,
+    # max_p95 — порог p95 латентности (сек), после которого model_router уходит на запасную
     LLM_CONFIG = {
-        "validation": {"temperature": 0.1, "max_tokens": 200},
-        "categorization": {"temperature": 0.2, "max_tokens": 500},
-        "generation": {"temperature": 0.5, "max_tokens": 1500},
-        "recipe": {"temperature": 0.4, "max_tokens": 3000},
-        "freestyle": {"temperature": 0.6, "max_tokens": 2000},
-        "full_menu": {"temperature": 0.4, "max_tokens": 4000}
+        "validation": {"temperature": 0.1, "max_tokens": 200,
+                       "model": GROQ_FAST_MODEL, "fallbacks": [GROQ_MODEL], "max_p95": 3.0},
+        "intake": {"temperature": 0.1, "max_tokens": 500,
+                   "model": GROQ_FAST_MODEL, "fallbacks": [GROQ_MODEL], "max_p95": 4.0},
+        "categorization": {"temperature": 0.2, "max_tokens": 500,
+                           "model": GROQ_FAST_MODEL, "fallbacks": [GROQ_MODEL], "max_p95": 4.0},
+        "generation": {"temperature": 0.5, "max_tokens": 1500,
+                       "model": GROQ_MODEL, "fallbacks": [GROQ_FAST_MODEL], "max_p95": 10.0},
+        "recipe": {"temperature": 0.4, "max_tokens": 3000,
+                   "model": GROQ_MODEL, "fallbacks": [GROQ_FAST_MODEL], "max_p95": 30.0},
+        "freestyle": {"temperature": 0.6, "max_tokens": 2000,
+                      "model": GROQ_MODEL, "fallbacks": [GROQ_FAST_MODEL], "max_p95": 25.0},
+        # Заготовка списков блюд (prefetch.py): то же, что generation, но в фоновой полосе
+        "prefetch": {"temperature": 0.5, "max_tokens": 1500,
+                     "model": GROQ_MODEL, "fallbacks": [GROQ_FAST_MODEL], "max_p95": 30.0},
+        # Фоновая генерация библиотеки популярных рецептов (recipe_library.py): только основная модель
+        "library": {"temperature": 0.5, "max_tokens": 2000, "model": GROQ_MODEL, "max_p95": 60.0},
+        "full_menu": {"temperature": 0.4, "max_tokens": 4000,
+                      "model": GROQ_MODEL, "fallbacks": [GROQ_FAST_MODEL], "max_p95": 45.0},
+        # Пакетные проверки: max_tokens считается от размера пакета
+        "validation_batch": {"temperature": 0.1, "max_tokens": 60,
+                             "model": GROQ_FAST_MODEL, "fallbacks": [GROQ_MODEL], "max_p95": 5.0},
+        "intake_batch": {"temperature": 0.1, "max_tokens": 250,
+                         "model": GROQ_FAST_MODEL, "fallbacks": [GROQ_MODEL], "max_p95": 8.0}
     }
     
     FLAVOR_RULES = """❗️ ПРАВИЛА СОЧЕТАЕМОСТИ:
@@ -25,6 +74,32 @@ class GroqService:
 👑 ОДИН ГЛАВНЫЙ ИНГРЕДИЕНТ: В каждом блюде один "король".
 ❌ ТАБУ: Рыба + Молочные продукты (в горячем), два сильных мяса в одной композиции."""
 
+    VALIDATION_PROMPT = """Ты эксперт по безопасности продуктов. Проверь текст на валидность.
+📋 КРИТЕРИИ: ✅ ПРИНЯТЬ (еда, специи, опечатки), ❌ ОТКЛОНИТЬ (яд, мат, бред, приветствия, <3 симв).
+🎯 СТРОГИЙ JSON: {"valid": true, "reason": "кратко"}"""
+
+    INTAKE_PROMPT = """Ты шеф-повар и эксперт по безопасности продуктов. Разбери текст пользователя.
+📋 ВАЛИДНОСТЬ: ✅ ПРИНЯТЬ (еда, специи, опечатки), ❌ ОТКЛОНИТЬ (яд, мат, бред, приветствия, <3 симв).
+🛒 ИНГРЕДИЕНТЫ: список продуктов из текста, по одному на элемент, как написал пользователь.
+📦 БАЗА (ВСЕГДА В НАЛИЧИИ, в список не включай): соль, сахар, вода, подсолнечное масло, специи.
+
+📚 КАТЕГОРИИ:
+- "mix" (ПОЛНЫЙ ОБЕД) — ОБЯЗАТЕЛЬНО ПЕРВЫМ, если продуктов >= 8.
+- "soup", "main", "salad", "breakfast", "dessert", "drink", "snack".
+1. Если продуктов >= 8, верни "mix" и еще 3 подходящие категории.
+2. Если продуктов < 8, верни от 2 до 4 категорий.
+3. Если текст невалиден — пустой список категорий.
+
+🎯 СТРОГИЙ JSON: {"valid": true, "ingredients": ["...", "..."], "categories": ["cat1", "cat2"]}"""
+
+    FALLBACK_NOTICE = "⚠️ <i>Сервис рецептов временно недоступен. Вот похожий рецепт из сохранённых:</i>\n\n"
+
+    BATCH_SUFFIX = """
+
+📨 ПАКЕТ: тебе дан нумерованный список текстов от РАЗНЫХ пользователей. Разбери КАЖДЫЙ отдельно, независимо от остальных.
+🎯 Верни СТРОГО JSON-массив: по одному объекту указанного выше вида на каждый номер, с полем "id" = номер текста.
+Пример: [{"id": 1, ...}, {"id": 2, ...}]"""
+
     @staticmethod
     def _detect_input_language(text: str) -> str:
         """Определяет язык ввода: 'ru' или 'other'"""
@@ -52,63 +127,234 @@ class GroqService:
         user_text: str, 
         task_type: str = "generation",
         temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        coalesce: bool = True,
+        json_mode: bool = False
     ) -> str:
-        try:
-            config = GroqService.LLM_CONFIG.get(task_type, GroqService.LLM_CONFIG["generation"])
-            final_temperature = temperature if temperature is not None else config["temperature"]
-            final_max_tokens = max_tokens if max_tokens is not None else config["max_tokens"]
-            
-            response = await client.chat.completions.create(
-                model=GROQ_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_text}
-                ],
-                max_tokens=final_max_tokens,
-                temperature=final_temperature
+        """Запрос к Groq. Одинаковые одновременные запросы склеиваются в один (если coalesce=True)"""
+        config = GroqService.LLM_CONFIG.get(task_type, GroqService.LLM_CONFIG["generation"])
+        final_temperature = temperature if temperature is not None else config["temperature"]
+        final_max_tokens = max_tokens if max_tokens is not None else config["max_tokens"]
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_text}
+        ]
+
+        def request(progress=on_progress):
+            return GroqService._request_groq(
+                task_type, messages, final_temperature, final_max_tokens, progress, json_mode
             )
-            return response.choices[0].message.content.strip()
+
+        # Спан включает ожидание склеенного запроса и очередь планировщика; сам вызов API — groq.call
+        with span(f"groq.{task_type}"):
+            if not coalesce:
+                return await request()
+            # Стрим склеиваем только со стримом: куски ответа SingleFlight раздаёт всем ожидающим
+            key = (task_type, system_prompt, user_text, final_temperature, final_max_tokens, json_mode, on_progress is not None)
+            return await inflight_requests.do(key, request, on_progress=on_progress)
+
+    @staticmethod
+    async def _request_groq(
+        task_type: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        json_mode: bool = False
+    ) -> str:
+        """Один запрос к Groq через общий планировщик (очередь, лимиты, повторы).
+        Модель выбирает model_router; если она так и не ответила — пробуем следующую.
+        Пока groq_breaker разомкнут, запрос сразу возвращает "" без обращения к API"""
+        config = GroqService.LLM_CONFIG.get(task_type, GroqService.LLM_CONFIG["generation"])
+        # Грубая оценка: ~3 символа на токен промпта + весь бюджет ответа
+        prompt_chars = sum(len(m["content"]) for m in messages)
+        estimated_tokens = prompt_chars // 3 + max_tokens
+
+        for model in model_router.candidates(task_type, config):
+            async def call(model=model):
+                if not groq_breaker.allow():
+                    raise CircuitOpenError("Groq недоступен")
+                started = time.monotonic()
+                try:
+                    with span("groq.call", model=model):
+                        result = await llm_transport.call(
+                            GroqService._call_groq, task_type, model,
+                            messages, temperature, max_tokens, on_progress, json_mode
+                        )
+                except asyncio.CancelledError:
+                    groq_breaker.record_cancel()
+                    raise
+                except Exception as e:
+                    elapsed = time.monotonic() - started
+                    model_router.record(task_type, model, elapsed, False, config)
+                    observe_groq(task_type, model, elapsed, False, prompt_chars, 0)
+                    GroqService._record_breaker_failure(e)
+                    raise
+                elapsed = time.monotonic() - started
+                model_router.record(task_type, model, elapsed, True, config)
+                observe_groq(task_type, model, elapsed, True, prompt_chars, len(result[0]))
+                groq_breaker.record_success()
+                return result
+
+            try:
+                return await llm_scheduler.run(llm_scheduler.lane_for(task_type), estimated_tokens, call, model)
+            except CircuitOpenError:
+                logger.warning(f"⚡️ Groq недоступен, запрос {task_type} отклонён предохранителем")
+                return ""
+            except StreamInterrupted as e:
+                # Часть ответа уже у пользователя — другая модель начала бы заново
+                logger.error(f"Groq API Error ({model}): {e}")
+                return ""
+            except Exception as e:
+                logger.error(f"Groq API Error ({model}): {e}")
+        return ""
+
+    @staticmethod
+    def _record_breaker_failure(error: Exception):
+        """Сбоем сервиса считаем только недоступность и 5xx; 429 и 4xx — не сбой Groq"""
+        if isinstance(error, (groq.APIConnectionError, groq.InternalServerError, StreamInterrupted)):
+            groq_breaker.record_failure()
+        else:
+            groq_breaker.record_cancel()
+
+    @staticmethod
+    async def _call_groq(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        json_mode: bool = False
+    ) -> Tuple[str, Mapping[str, str]]:
+        """Сырой вызов API. Если передан on_progress — читаем ответ потоком.
+        json_mode включает response_format=json_object (Groq не стримит в этом режиме).
+        Возвращает текст и заголовки ответа (для учёта лимитов)"""
+        if on_progress is None or json_mode:
+            extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+            raw = await get_client().chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **extra
+            )
+            response = raw.parse()
+            return response.choices[0].message.content.strip(), raw.headers
+
+        raw = await get_client().chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+        parts = []
+        try:
+            async for chunk in raw.parse():
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                try:
+                    await on_progress(delta)
+                except Exception as e:
+                    logger.warning(f"Ошибка обработки стрима: {e}")
         except Exception as e:
-            logger.error(f"Groq API Error: {e}")
-            return ""
+            if parts:
+                # Часть ответа уже показана пользователю — повтор дал бы дубли
+                raise StreamInterrupted(str(e)) from e
+            raise
+        return "".join(parts).strip(), raw.headers
 
     @staticmethod
-    def _extract_json(text: str) -> str:
-        text = text.replace("```json", "").replace("```", "")
-        start_brace = text.find('{')
-        start_bracket = text.find('[')
-        if start_brace == -1: start = start_bracket
-        elif start_bracket == -1: start = start_brace
-        else: start = min(start_brace, start_bracket)
-        end_brace = text.rfind('}')
-        end_bracket = text.rfind(']')
-        end = max(end_brace, end_bracket)
-        if start != -1 and end != -1 and end > start:
-            return text[start:end+1]
-        return text.strip()
+    async def _request_structured(
+        system_prompt: str,
+        user_text: str,
+        task_type: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        reask: bool = True,
+        coalesce: bool = True
+    ) -> Tuple[Optional[Any], str]:
+        """JSON-ответ, проверенный по схеме задачи (structured_output.SCHEMAS).
+        Обрезанный ответ чинится на месте; повторный запрос — только если починить не удалось.
+        Возвращает (данные или None, сырой текст последнего ответа)"""
+        json_mode = uses_json_mode(task_type)
+        res = await GroqService._send_groq_request(
+            system_prompt, user_text, task_type=task_type, temperature=temperature,
+            max_tokens=max_tokens, coalesce=coalesce, json_mode=json_mode
+        )
+        structured_stats.record(task_type, "total")
+        data, status = parse_structured(task_type, res)
+        if status != "failed":
+            structured_stats.record(task_type, status)
+            return data, res
+        if not res or not reask:
+            # Groq недоступен — переспрашивать бессмысленно; пакеты вместо этого разбираются поштучно
+            structured_stats.record(task_type, "failed")
+            return None, res
+
+        logger.warning(f"⚠️ Не удалось разобрать JSON ({task_type}), переспрашиваем: {res[:200]!r}")
+        structured_stats.record(task_type, "reasked")
+        retry = await GroqService._send_groq_request(
+            system_prompt, reask_prompt(task_type, user_text, res), task_type=task_type,
+            temperature=0.0, max_tokens=max_tokens, json_mode=json_mode, coalesce=False
+        )
+        data, status = parse_structured(task_type, retry)
+        structured_stats.record(task_type, "reask_ok" if status != "failed" else "failed")
+        return data, retry or res
 
     @staticmethod
+    @traced()
     async def validate_ingredients(text: str) -> bool:
-        prompt = """Ты эксперт по безопасности продуктов. Проверь текст на валидность.
-📋 КРИТЕРИИ: ✅ ПРИНЯТЬ (еда, специи, опечатки), ❌ ОТКЛОНИТЬ (яд, мат, бред, приветствия, <3 симв).
-🎯 СТРОГИЙ JSON: {"valid": true, "reason": "кратко"}"""
+        # Однозначные случаи решаем по словарю, к LLM идём только с сомнительными
+        local_verdict = ingredient_validator.classify(text)
+        if local_verdict is not None:
+            return local_verdict
+
         safe_text = GroqService._sanitize_input(text, max_length=200)
-        res = await GroqService._send_groq_request(prompt, f'Текст: "{safe_text}"', task_type="validation")
-        try:
-            data = json.loads(GroqService._extract_json(res))
-            return data.get("valid", False)
-        except:
-            return "true" in res.lower()
+        data = await validation_batcher.submit(safe_text)
+        return data["valid"]
 
     @staticmethod
+    async def _validate_single(safe_text: str) -> Dict:
+        data, res = await GroqService._request_structured(
+            GroqService.VALIDATION_PROMPT, f'Текст: "{safe_text}"', task_type="validation"
+        )
+        if data is None:
+            # Groq недоступен (пустой ответ) — не отказываем пользователю из-за сбоя
+            return {"valid": not res or "true" in res.lower()}
+        return data
+
+    @staticmethod
+    async def _request_batch(task_type: str, system_prompt: str, texts: List[str]) -> List[Optional[Dict]]:
+        """Один запрос на несколько текстов. Результаты по порядку texts, None — не разобран"""
+        user_text = "\n".join(f'{i}. Текст: "{text}"' for i, text in enumerate(texts, 1))
+        batch_task = f"{task_type}_batch"
+        per_item_tokens = GroqService.LLM_CONFIG[batch_task]["max_tokens"]
+        data, _ = await GroqService._request_structured(
+            system_prompt + GroqService.BATCH_SUFFIX, user_text, task_type=batch_task,
+            max_tokens=per_item_tokens * len(texts) + 50, reask=False, coalesce=False
+        )
+        results: List[Optional[Dict]] = [None] * len(texts)
+        for item in data or []:
+            index = item.pop("id") - 1
+            if 0 <= index < len(texts) and results[index] is None:
+                results[index] = item
+        return results
+
+    @staticmethod
+    async def _validate_batch(texts: List[str]) -> List[Optional[Dict]]:
+        return await GroqService._request_batch("validation", GroqService.VALIDATION_PROMPT, texts)
+
+    @staticmethod
+    @traced()
     async def analyze_categories(products: str) -> List[str]:
         safe_products = GroqService._sanitize_input(products, max_length=300)
-
-        if ',' not in safe_products and ';' not in safe_products and '\n' not in safe_products:
-            items = [i.strip() for i in safe_products.split() if len(i.strip()) > 1]
-        else:
-            items = [i.strip() for i in re.split(r'[,;\n\.]', safe_products) if len(i.strip()) > 1]
+        items = split_products(safe_products)
 
         items_count = len(items)
         mix_available = items_count >= 8
@@ -127,25 +373,89 @@ class GroqService:
 2. Если продуктов < 8, верни от 2 до 4 категорий.
 🎯 JSON: ["mix", "cat2", "cat3", "cat4"]"""
         
-        res = await GroqService._send_groq_request(prompt, "Определи категории", task_type="categorization", temperature=0.1)
-        try:
-            data = json.loads(GroqService._extract_json(res))
-            if isinstance(data, list):
-                if mix_available and "mix" not in data:
-                    data.insert(0, "mix")
-                elif not mix_available and "mix" in data:
-                    data = [item for item in data if item != "mix"]
-                return data[:4]
-        except:
-            pass
+        # Тот же или почти тот же набор продуктов уже разбирали
+        cached = product_index.get(safe_products, "categories")
+        if cached:
+            return GroqService._normalize_categories(list(cached), mix_available)
+
+        data, _ = await GroqService._request_structured(prompt, "Определи категории", task_type="categorization", temperature=0.1)
+        if data is not None:
+            categories = GroqService._normalize_categories(data, mix_available)
+            await product_index.put(safe_products, "categories", categories)
+            return categories
+        return GroqService._default_categories(mix_available)
+
+    @staticmethod
+    def _normalize_categories(data: List[str], mix_available: bool) -> List[str]:
+        """"mix" первым, только если продуктов хватает на полный обед; не больше 4 категорий"""
+        if mix_available and "mix" not in data:
+            data.insert(0, "mix")
+        elif not mix_available and "mix" in data:
+            data = [item for item in data if item != "mix"]
+        return data[:4]
+
+    @staticmethod
+    def _default_categories(mix_available: bool) -> List[str]:
         return ["mix", "main", "soup", "salad"] if mix_available else ["main", "soup"]
 
     @staticmethod
-    async def generate_dishes_list(products: str, category: str) -> List[Dict[str, str]]:
+    @traced()
+    async def validate_and_categorize(text: str) -> Dict:
+        """Проверка продуктов и подбор категорий одним запросом.
+        Возвращает {"valid": bool, "ingredients": [...], "categories": [...] или None}"""
+        local_verdict = ingredient_validator.classify(text)
+        if local_verdict is False:
+            return {"valid": False, "ingredients": [], "categories": None}
+        if local_verdict is True:
+            # Валидность ясна и так; категории посчитаем по кнопке "Готовить"
+            return {"valid": True, "ingredients": split_products(text), "categories": None}
+
+        safe_text = GroqService._sanitize_input(text, max_length=300)
+        # Категории для этого набора уже есть — значит, он уже признавался продуктами
+        cached = product_index.get(safe_text, "categories")
+        if cached:
+            ingredients = split_products(safe_text)
+            categories = GroqService._normalize_categories(list(cached), len(ingredients) >= 8)
+            return {"valid": True, "ingredients": ingredients, "categories": categories}
+
+        data = await intake_batcher.submit(safe_text)
+        valid = data["valid"]
+        ingredients = [i.strip() for i in data["ingredients"] if i.strip()]
+        if not ingredients:
+            ingredients = split_products(safe_text)
+        categories = data["categories"]
+        if valid and categories:
+            categories = GroqService._normalize_categories(categories, len(ingredients) >= 8)
+            await product_index.put(safe_text, "categories", categories)
+        else:
+            categories = None
+        return {"valid": valid, "ingredients": ingredients, "categories": categories}
+
+    @staticmethod
+    async def _intake_single(safe_text: str) -> Dict:
+        data, res = await GroqService._request_structured(
+            GroqService.INTAKE_PROMPT, f'Текст: "{safe_text}"', task_type="intake"
+        )
+        if data is None:
+            # Groq недоступен (пустой ответ) — не отказываем пользователю из-за сбоя
+            return {"valid": not res or "true" in res.lower(), "ingredients": [], "categories": []}
+        return data
+
+    @staticmethod
+    async def _intake_batch(texts: List[str]) -> List[Optional[Dict]]:
+        return await GroqService._request_batch("intake", GroqService.INTAKE_PROMPT, texts)
+
+    @staticmethod
+    @traced()
+    async def generate_dishes_list(products: str, category: str, task_type: str = "generation") -> List[Dict[str, str]]:
         # --- ЭТОТ МЕТОД ОСТАВЛЕН БЕЗ ИЗМЕНЕНИЙ (ПО ВАШЕЙ ПРОСЬБЕ) ---
         safe_products = GroqService._sanitize_input(products, max_length=400)
         input_language = GroqService._detect_input_language(safe_products)
         base_instruction = "⚠️ ВАЖНО: соль, сахар, вода, масло и специи ДОСТУПНЫ ВСЕГДА."
+
+        cached = product_index.get(safe_products, f"dishes:{category}")
+        if cached:
+            return [dict(dish) for dish in cached]
         
         if category == "mix":
             if input_language == "ru": name_template = "Суп"
@@ -192,9 +502,14 @@ class GroqService:
 - Описания должны быть аппетитными и краткими
 🎯 JSON: [{{ "name": "...", "desc": "..." }}]"""
         
-        res = await GroqService._send_groq_request(prompt, "Генерируй меню", task_type="generation")
+        dishes, res = await GroqService._request_structured(prompt, "Генерируй меню", task_type=task_type)
+        if not dishes and not res and category != "mix":
+            # Groq недоступен — предлагаем блюда из сохранённых рецептов
+            return fallback_corpus.suggest_dishes(safe_products)
+        if not dishes:
+            logger.error(f"Ошибка парсинга JSON: список блюд для '{category}' не получен")
+            return []
         try:
-            dishes = json.loads(GroqService._extract_json(res))
             if category == "mix":
                 if len(dishes) != 4:
                     expected_names = [
@@ -212,13 +527,19 @@ class GroqService:
                             else:
                                 new_dishes.append({"name": expected_names[i], "desc": "Вкусное блюдо"})
                         dishes = new_dishes
+            await product_index.put(safe_products, f"dishes:{category}", dishes)
             return dishes
         except Exception as e:
             logger.error(f"Ошибка парсинга JSON: {e}")
             return []
 
     @staticmethod
-    async def generate_full_menu_recipe(dishes_list: List[Dict[str, str]], products: str) -> str:
+    @traced()
+    async def generate_full_menu_recipe(
+        dishes_list: List[Dict[str, str]],
+        products: str,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
         """Генерация единого рецепта для всех 4 блюд комплексного обеда (ЧИСТЫЙ HTML)"""
         safe_products = GroqService._sanitize_input(products, max_length=600)
         
@@ -269,17 +590,46 @@ class GroqService:
 💡 <b>Совет шеф-повара:</b>
 [Полезный совет ТОЛЬКО на русском языке]"""
         
-        res = await GroqService._send_groq_request(prompt, "Напиши рецепт", task_type="full_menu")
+        res = await GroqService._send_groq_request(prompt, "Напиши рецепт", task_type="full_menu", on_progress=on_progress)
         if GroqService._is_refusal(res): return "Не удалось сгенерировать рецепт."
         return res + "\n\n👨‍🍳 <b>Приятного аппетита!</b>"
 
     @staticmethod
-    async def generate_recipe(dish_name: str, products: str) -> str:
+    @traced()
+    async def generate_recipe(
+        dish_name: str,
+        products: str,
+        use_cache: bool = True,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        description: str = "",
+        menu: str = ""
+    ) -> str:
+        """Рецепт блюда. description и menu задаются для блюда комплексного обеда:
+        название там общее ("Суп"), а продукты делятся между блюдами"""
         safe_dish_name = GroqService._sanitize_input(dish_name, max_length=150)
         safe_products = GroqService._sanitize_input(products, max_length=600)
         input_language = GroqService._detect_input_language(safe_products)
+        safe_description = GroqService._sanitize_input(description, max_length=300)
+        safe_menu = GroqService._sanitize_input(menu, max_length=300)
+
+        dish_context = ""
+        if safe_description:
+            dish_context += f"\n📝 ОПИСАНИЕ: {safe_description}"
+        if safe_menu:
+            dish_context += f"\n🍱 ЧАСТЬ ОБЕДА: {safe_menu}. Бери продукты, подходящие именно этому блюду."
+
+        cache_dish = f"{safe_dish_name} — {safe_description}" if safe_description else safe_dish_name
+        cache_key, prod_key = recipe_cache.make_key(
+            "mix" if safe_menu else "recipe", cache_dish, safe_products, input_language
+        )
+        if use_cache:
+            cached = await recipe_cache.get(cache_key)
+            if cached:
+                return cached
+        else:
+            recipe_cache.mark_bypass()
 
-        prompt = f"""Ты профессиональный шеф. Напиши рецепт: "{safe_dish_name}"
+        prompt = f"""Ты профессиональный шеф. Напиши рецепт: "{safe_dish_name}"{dish_context}
 🛒 ПРОДУКТЫ: {safe_products}
 📦 БАЗА: соль, сахар, вода, масло, специи.
 {GroqService.FLAVOR_RULES}
@@ -317,16 +667,75 @@ class GroqService:
 💡 <b>Совет шеф-повара:</b>
 [Полезный совет ТОЛЬКО на русском языке]"""
         
-        res = await GroqService._send_groq_request(prompt, "Напиши рецепт", task_type="recipe")
+        # "Другой вариант" (use_cache=False) не склеиваем с чужими запросами — нужен новый ответ
+        res = await GroqService._send_groq_request(
+            prompt, "Напиши рецепт", task_type="recipe", on_progress=on_progress, coalesce=use_cache
+        )
+        if not res:
+            return GroqService._fallback_recipe(safe_dish_name, safe_products)
         if GroqService._is_refusal(res):
             return res
-        return res + "\n\n👨‍🍳 <b>Приятного аппетита!</b>"
+        recipe = res + "\n\n👨‍🍳 <b>Приятного аппетита!</b>"
+        await recipe_cache.set(cache_key, cache_dish, prod_key, input_language, recipe)
+        if not safe_menu:
+            fallback_corpus.add(safe_dish_name, safe_products, recipe)
+        return recipe
+
+    @staticmethod
+    @traced()
+    async def generate_mix_recipes(
+        dishes_list: List[Dict[str, str]],
+        products: str,
+        use_cache: bool = True,
+        on_dish_ready: Optional[Callable[[int, str], Awaitable[None]]] = None
+    ) -> List[str]:
+        """Рецепты блюд комплексного обеда: по отдельному запросу recipe на блюдо, параллельно.
+        on_dish_ready(index, text) вызывается по мере готовности; "" — блюдо не удалось"""
+        menu = ", ".join(dish.get("name", "") for dish in dishes_list)
+
+        async def one(index: int, dish: Dict[str, str]) -> str:
+            try:
+                text = await GroqService.generate_recipe(
+                    dish.get("name", ""), products, use_cache=use_cache,
+                    description=dish.get("desc", ""), menu=menu
+                )
+            except Exception as e:
+                logger.error(f"Ошибка генерации блюда обеда '{dish.get('name')}': {e}")
+                text = ""
+            if not text or GroqService._is_refusal(text):
+                text = ""
+            if on_dish_ready:
+                try:
+                    await on_dish_ready(index, text)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки блюда обеда: {e}")
+            return text
+
+        return list(await asyncio.gather(*(one(i, dish) for i, dish in enumerate(dishes_list))))
 
     @staticmethod
-    async def generate_freestyle_recipe(dish_name: str) -> str:
+    @traced()
+    async def generate_freestyle_recipe(
+        dish_name: str,
+        use_cache: bool = True,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        task_type: str = "freestyle"
+    ) -> str:
         safe_dish_name = GroqService._sanitize_input(dish_name, max_length=100)
         input_language = GroqService._detect_input_language(safe_dish_name)
 
+        cache_key, prod_key = recipe_cache.make_key("freestyle", safe_dish_name, "", input_language)
+        if use_cache:
+            # Популярные блюда заранее сгенерированы в библиотеку
+            library_recipe = await recipe_library.get(safe_dish_name)
+            if library_recipe:
+                return library_recipe
+            cached = await recipe_cache.get(cache_key)
+            if cached:
+                return cached
+        else:
+            recipe_cache.mark_bypass()
+
         prompt = f"""Ты креативный шеф-повар. Рецепт: "{safe_dish_name}"
 {GroqService.FLAVOR_RULES}
 
@@ -363,12 +772,33 @@ class GroqService:
 💡 <b>Совет шеф-повара:</b>
 [Полезный совет ТОЛЬКО на русском языке]"""
 
-        res = await GroqService._send_groq_request(prompt, "Создай рецепт", task_type="freestyle")
+        # "Другой вариант" (use_cache=False) не склеиваем с чужими запросами — нужен новый ответ
+        res = await GroqService._send_groq_request(
+            prompt, "Создай рецепт", task_type=task_type, on_progress=on_progress, coalesce=use_cache
+        )
+        if not res:
+            return GroqService._fallback_recipe(safe_dish_name)
         if GroqService._is_refusal(res):
             return res
-        return res + "\n\n👨‍🍳 <b>Приятного аппетита!</b>"
+        recipe = res + "\n\n👨‍🍳 <b>Приятного аппетита!</b>"
+        await recipe_cache.set(cache_key, safe_dish_name, prod_key, input_language, recipe)
+        fallback_corpus.add(safe_dish_name, "", recipe)
+        return recipe
+
+    @staticmethod
+    def _fallback_recipe(dish_name: str, products: str = "") -> str:
+        """Похожий рецепт из сохранённых, когда Groq не ответил ("" — ничего подходящего)"""
+        recipe = fallback_corpus.find_recipe(dish_name, products)
+        if not recipe:
+            return ""
+        return GroqService.FALLBACK_NOTICE + recipe
 
     @staticmethod
     def _is_refusal(text: str) -> bool:
         refusals = ["cannot fulfill", "against my policy", "не могу выполнить", "⛔"]
-        return any(ph in text.lower() for ph in refusals)
\ No newline at end of file
+        return any(ph in text.lower() for ph in refusals)
+
+
+# Пакетная проверка продуктов от разных пользователей (VALIDATION_BATCH_ENABLED)
+validation_batcher = MicroBatcher("validation", GroqService._validate_batch, GroqService._validate_single)
+intake_batcher = MicroBatcher("intake", GroqService._intake_batch, GroqService._intake_single)
@@ -1,19 +1,29 @@
 import os
 import io
+import asyncio
 import logging
+from datetime import datetime, timedelta, timezone
 from aiogram import Dispatcher, F
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from config import MIX_PARALLEL_ENABLED, HISTORY_PAGE_SIZE
 from utils import VoiceProcessor
 from groq_service import GroqService
+from tracing import traced
 from state_manager import state_manager
 from database import db as database
+from message_streamer import MessageStreamer, make_html_safe
+from prefetch import dish_prefetcher
+from bot_stats import bot_stats
 
 # Инициализация
 voice_processor = VoiceProcessor()
 groq_service = GroqService()
 logger = logging.getLogger(__name__)
 
+RECIPE_UNAVAILABLE_TEXT = "😔 Сервис рецептов временно недоступен. Попробуйте через минуту."
+
 # --- СЛОВАРЬ КАТЕГОРИЙ ---
 CATEGORY_MAP = {
     "breakfast": "🍳 Завтраки",
@@ -68,10 +78,37 @@ def get_hide_keyboard():
 
 def get_stats_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📖 Вся история", callback_data="hist_n")],
         [InlineKeyboardButton(text="🗑 Очистить мою историю", callback_data="clear_my_history")],
         [InlineKeyboardButton(text="❌ Закрыть", callback_data="delete_msg")]
     ])
 
+# Курсор в callback_data: "<микросекунды created_at>.<id>" — до 34 байт из 64 допустимых.
+# По нему же открываем рецепт: created_at указывает на одну месячную секцию recipes
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def encode_history_cursor(recipe: dict) -> str:
+    return f"{(recipe['created_at'] - _EPOCH) // timedelta(microseconds=1)}.{recipe['id']}"
+
+def decode_history_cursor(value: str) -> tuple:
+    micros, recipe_id = value.split(".")
+    return _EPOCH + timedelta(microseconds=int(micros)), int(recipe_id)
+
+def get_history_keyboard(recipes: list, has_older: bool, has_newer: bool):
+    builder = []
+    for recipe in recipes:
+        btn_text = f"{recipe['created_at'].strftime('%d.%m.%y')} · {recipe['dish_name'][:40]}"
+        builder.append([InlineKeyboardButton(text=btn_text, callback_data=f"hist_o:{encode_history_cursor(recipe)}")])
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"hist_p:{encode_history_cursor(recipes[0])}"))
+    if has_older:
+        nav.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"hist_n:{encode_history_cursor(recipes[-1])}"))
+    if nav:
+        builder.append(nav)
+    builder.append([InlineKeyboardButton(text="❌ Закрыть", callback_data="delete_msg")])
+    return InlineKeyboardMarkup(inline_keyboard=builder)
+
 # --- ХЭНДЛЕРЫ КОМАНД ---
 
 async def cmd_start(message: Message):
@@ -132,11 +169,12 @@ async def cmd_author(message: Message):
 async def cmd_stats(message: Message):
     """Показать статистику бота"""
     try:
-        stats = await database.get_stats()
+        # Общие числа — из снимка в памяти, последние рецепты — из кеша
+        stats = await bot_stats.get()
         user_id = message.from_user.id
         
         # Получаем данные пользователя
-        user_recipes = await database.get_user_recipes(user_id, limit=5)
+        user_recipes = await bot_stats.recent_recipes(user_id)
         recipes_text = "\n".join([f"• {r['dish_name']} ({r['created_at'].strftime('%d.%m')})" 
                                   for r in user_recipes]) if user_recipes else "Пока нет сохраненных рецептов"
         
@@ -153,6 +191,30 @@ async def cmd_stats(message: Message):
         logger.error(f"Ошибка статистики: {e}")
         await message.answer("❌ Ошибка получения статистики")
 
+async def render_history_page(user_id: int, cursor: str = None, newer: bool = False):
+    """Текст и клавиатура страницы истории. Без курсора — самые свежие рецепты"""
+    position = decode_history_cursor(cursor) if cursor else None
+    recipes, has_more = await database.get_recipe_page(user_id, HISTORY_PAGE_SIZE, position, newer)
+    if not recipes and position is not None:
+        # Записи по краю страницы удалены (очистка истории) — начинаем сначала
+        recipes, has_more = await database.get_recipe_page(user_id, HISTORY_PAGE_SIZE)
+        position = None
+    if not recipes:
+        return "📖 Пока нет сохраненных рецептов", get_hide_keyboard()
+    has_older = has_more if not newer else True
+    has_newer = (has_more if newer else True) if position is not None else False
+    text = "📖 <b>Ваши рецепты</b>\n\nНажмите на рецепт, чтобы открыть его."
+    return text, get_history_keyboard(recipes, has_older, has_newer)
+
+async def cmd_history(message: Message):
+    """Вся история рецептов постранично"""
+    try:
+        text, markup = await render_history_page(message.from_user.id)
+        await message.answer(text, reply_markup=markup, parse_mode="HTML")
+    except Exception as e:
+        logger.error(f"Ошибка истории: {e}")
+        await message.answer("❌ Ошибка получения истории")
+
 # --- ФУНКЦИИ ДЛЯ ОПРЕДЕЛЕНИЯ НАМЕРЕНИЯ ---
 
 def is_recipe_request(text: str) -> bool:
@@ -197,9 +259,12 @@ async def handle_direct_recipe(message: Message):
         return
 
     wait = await message.answer(f"⚡️ Ищу: <b>{dish_name}</b>...", parse_mode="HTML")
+    streamer = MessageStreamer(wait)
     try:
-        recipe = await groq_service.generate_freestyle_recipe(dish_name)
-        await wait.delete()
+        recipe = await groq_service.generate_freestyle_recipe(dish_name, on_progress=streamer.on_progress)
+        if not recipe:
+            await streamer.finish(RECIPE_UNAVAILABLE_TEXT, reply_markup=get_hide_keyboard())
+            return
         
         # Сохраняем состояние
         await state_manager.set_current_dish(user_id, dish_name)
@@ -208,9 +273,12 @@ async def handle_direct_recipe(message: Message):
         # Сохраняем рецепт в историю БД
         await state_manager.save_recipe_to_history(user_id, dish_name, recipe)
         
-        await message.answer(recipe, reply_markup=get_hide_keyboard(), parse_mode="HTML")
+        await streamer.finish(recipe, reply_markup=get_hide_keyboard())
     except Exception as e:
-        await wait.delete()
+        try:
+            await wait.delete()
+        except Exception:
+            pass
         logger.error(f"Ошибка генерации рецепта: {e}")
         await message.answer("❌ Ошибка генерации рецепта.")
 
@@ -261,9 +329,12 @@ async def handle_direct_recipe_from_voice(message: Message, recognized_text: str
         return
 
     wait = await message.answer(f"⚡️ Ищу: <b>{dish_name}</b>...", parse_mode="HTML")
+    streamer = MessageStreamer(wait)
     try:
-        recipe = await groq_service.generate_freestyle_recipe(dish_name)
-        await wait.delete()
+        recipe = await groq_service.generate_freestyle_recipe(dish_name, on_progress=streamer.on_progress)
+        if not recipe:
+            await streamer.finish(RECIPE_UNAVAILABLE_TEXT, reply_markup=get_hide_keyboard())
+            return
         
         # Сохраняем состояние
         await state_manager.set_current_dish(user_id, dish_name)
@@ -272,9 +343,12 @@ async def handle_direct_recipe_from_voice(message: Message, recognized_text: str
         # Сохраняем рецепт в историю БД
         await state_manager.save_recipe_to_history(user_id, dish_name, recipe)
         
-        await message.answer(recipe, reply_markup=get_hide_keyboard(), parse_mode="HTML")
+        await streamer.finish(recipe, reply_markup=get_hide_keyboard())
     except Exception as e:
-        await wait.delete()
+        try:
+            await wait.delete()
+        except Exception:
+            pass
         logger.error(f"Ошибка генерации рецепта: {e}")
         await message.answer("❌ Ошибка генерации рецепта.")
 
@@ -296,6 +370,7 @@ async def handle_text(message: Message):
 
 # --- ГЛАВНАЯ ЛОГИКА ОБРАБОТКИ ПРОДУКТОВ ---
 
+@traced()
 async def process_products_input(message: Message, user_id: int, text: str):
     """Основная логика обработки ввода продуктов (ТОЛЬКО для продуктов)"""
     # Сначала проверяем, что это не запрос рецепта (дополнительная защита)
@@ -310,6 +385,9 @@ async def process_products_input(message: Message, user_id: int, text: str):
             await state_manager.clear_state(user_id)
             return
 
+    # Список продуктов меняется — заготовленные списки блюд устарели
+    dish_prefetcher.cancel(user_id)
+
     # Если уже был рецепт - сброс
     if state_manager.get_state(user_id) == "recipe_sent":
         await state_manager.clear_session(user_id)
@@ -318,12 +396,14 @@ async def process_products_input(message: Message, user_id: int, text: str):
     current_products = state_manager.get_products(user_id)
     
     if not current_products:
-        # Валидация при первом вводе
-        is_valid = await groq_service.validate_ingredients(text)
-        if not is_valid:
+        # Валидация при первом вводе (заодно подбираем категории для кнопки "Готовить")
+        intake = await groq_service.validate_and_categorize(text)
+        if not intake["valid"]:
             await message.answer(f"🤨 <b>\"{text}\"</b> — не похоже на продукты.", parse_mode="HTML")
             return
         
+        if intake["categories"]:
+            state_manager.cache_categories(user_id, text, intake["categories"])
         await state_manager.set_products(user_id, text)
         msg_text = f"✅ Принято: <b>{text}</b>"
     else:
@@ -336,6 +416,7 @@ async def process_products_input(message: Message, user_id: int, text: str):
 
 # --- ЛОГИКА КАТЕГОРИЙ И БЛЮД ---
 
+@traced()
 async def start_category_flow(message: Message, user_id: int):
     """Начало выбора категории"""
     products = state_manager.get_products(user_id)
@@ -343,11 +424,15 @@ async def start_category_flow(message: Message, user_id: int):
         await message.answer("Список продуктов пуст. Начните заново /start")
         return
 
-    wait = await message.answer("👨‍🍳 Думаю, что приготовить...")
-    
-    categories = await groq_service.analyze_categories(products)
-    
-    await wait.delete()
+    # Категории могли быть подобраны ещё при вводе продуктов
+    categories = state_manager.get_cached_categories(user_id)
+    if not categories:
+        wait = await message.answer("👨‍🍳 Думаю, что приготовить...")
+        categories = await groq_service.analyze_categories(products)
+        await wait.delete()
+        if categories:
+            state_manager.cache_categories(user_id, products, categories)
+
     if not categories:
         await message.answer("Из этого сложно что-то приготовить.")
         return
@@ -360,13 +445,18 @@ async def start_category_flow(message: Message, user_id: int):
         await message.answer("📂 <b>Выберите категорию:</b>", 
                            reply_markup=get_categories_keyboard(categories), 
                            parse_mode="HTML")
+        # Пока пользователь выбирает, готовим списки для самых вероятных категорий
+        dish_prefetcher.schedule(user_id, products, categories)
 
+@traced()
 async def show_dishes_for_category(message: Message, user_id: int, products: str, category: str):
     """Показать блюда выбранной категории"""
     cat_name = CATEGORY_MAP.get(category, "Блюда")
     wait = await message.answer(f"🍳 Подбираю {cat_name}...")
     
-    dishes_list = await groq_service.generate_dishes_list(products, category)
+    dishes_list = await dish_prefetcher.take(user_id, products, category)
+    if dishes_list is None:
+        dishes_list = await groq_service.generate_dishes_list(products, category)
     
     if not dishes_list:
         await wait.delete()
@@ -394,14 +484,19 @@ async def show_dishes_for_category(message: Message, user_id: int, products: str
         
     await message.answer(response_text, reply_markup=kb, parse_mode="HTML")
 
-async def generate_and_send_recipe(message: Message, user_id: int, dish_name: str):
+@traced()
+async def generate_and_send_recipe(message: Message, user_id: int, dish_name: str, use_cache: bool = True):
     """Генерация и отправка рецепта"""
     wait = await message.answer(f"👨‍🍳 Пишу рецепт: <b>{dish_name}</b>...", parse_mode="HTML")
+    streamer = MessageStreamer(wait)
     products = state_manager.get_products(user_id)
     
-    recipe = await groq_service.generate_recipe(dish_name, products)
-    
-    await wait.delete()
+    recipe = await groq_service.generate_recipe(
+        dish_name, products, use_cache=use_cache, on_progress=streamer.on_progress
+    )
+    if not recipe:
+        await streamer.finish(RECIPE_UNAVAILABLE_TEXT, reply_markup=get_recipe_back_keyboard())
+        return
     
     # Сохраняем состояние
     await state_manager.set_current_dish(user_id, dish_name)
@@ -410,7 +505,64 @@ async def generate_and_send_recipe(message: Message, user_id: int, dish_name: st
     # СОХРАНЯЕМ РЕЦЕПТ В БД
     await state_manager.save_recipe_to_history(user_id, dish_name, recipe)
     
-    await message.answer(recipe, reply_markup=get_recipe_back_keyboard(), parse_mode="HTML")
+    await streamer.finish(recipe, reply_markup=get_recipe_back_keyboard())
+
+def get_mix_name(dishes: list) -> str:
+    return " + ".join([d['name'] for d in dishes])
+
+def get_mix_progress_text(names: list, results: list) -> str:
+    lines = ["🍱 <b>Готовлю комплексный обед:</b>\n"]
+    for name, result in zip(names, results):
+        icon = "⏳" if result is None else ("✅" if result else "❌")
+        lines.append(f"{icon} {name}")
+    return "\n".join(lines)
+
+async def send_html(message: Message, text: str, reply_markup=None):
+    """Отправка HTML от LLM; если Telegram не принял разметку — чиним её"""
+    try:
+        return await message.answer(text, reply_markup=reply_markup, parse_mode="HTML")
+    except TelegramBadRequest:
+        return await message.answer(make_html_safe(text), reply_markup=reply_markup, parse_mode="HTML")
+
+@traced()
+async def generate_and_send_mix(message: Message, user_id: int, dishes: list, use_cache: bool = True):
+    """Комплексный обед: блюда генерируются параллельно и отправляются по порядку,
+    как только готовы все предыдущие. Неудачное блюдо не мешает остальным"""
+    names = [d['name'] for d in dishes]
+    results = [None] * len(dishes)
+    progress = await message.answer(get_mix_progress_text(names, results), parse_mode="HTML")
+    products = state_manager.get_products(user_id)
+    sent = 0
+    send_lock = asyncio.Lock()
+
+    async def on_dish_ready(index: int, text: str):
+        nonlocal sent
+        results[index] = text
+        async with send_lock:
+            while sent < len(results) and results[sent] is not None:
+                body = results[sent] or f"❌ Не удалось приготовить: <b>{names[sent]}</b>"
+                markup = get_recipe_back_keyboard() if sent == len(results) - 1 else None
+                await send_html(message, body, reply_markup=markup)
+                sent += 1
+            try:
+                await progress.edit_text(get_mix_progress_text(names, results), parse_mode="HTML")
+            except TelegramBadRequest:
+                pass
+
+    recipes = await groq_service.generate_mix_recipes(
+        dishes, products, use_cache=use_cache, on_dish_ready=on_dish_ready
+    )
+    try:
+        await progress.delete()
+    except Exception:
+        pass
+
+    mix_name = get_mix_name(dishes)
+    await state_manager.set_current_dish(user_id, mix_name)
+    await state_manager.set_state(user_id, "recipe_sent")
+    ready = [recipe for recipe in recipes if recipe]
+    if ready:
+        await state_manager.save_recipe_to_history(user_id, mix_name, "\n\n".join(ready))
 
 # --- CALLBACK ОБРАБОТЧИКИ ---
 
@@ -421,6 +573,7 @@ async def handle_callback(callback: CallbackQuery):
     
     # 1. Сброс
     if data == "restart":
+        dish_prefetcher.cancel(user_id)
         await state_manager.clear_session(user_id)
         await callback.message.answer("🗑 Список очищен. Жду продукты.")
         await callback.answer()
@@ -430,8 +583,9 @@ async def handle_callback(callback: CallbackQuery):
     if data == "clear_my_history":
         try:
             # Получаем ID пользователя из БД
-            async with database.pool.acquire() as conn:
+            async with database.acquire() as conn:
                 await conn.execute("DELETE FROM recipes WHERE user_id = $1", user_id)
+            bot_stats.forget_recipes(user_id)
             await callback.message.edit_text("✅ Ваша история рецептов очищена.")
         except Exception as e:
             logger.error(f"Ошибка очистки истории: {e}")
@@ -484,7 +638,11 @@ async def handle_callback(callback: CallbackQuery):
             # Обработка комплексного обеда
             if data == "dish_all_mix":
                 dishes = state_manager.get_generated_dishes(user_id)
-                dish_name = " + ".join([d['name'] for d in dishes])
+                if MIX_PARALLEL_ENABLED and dishes:
+                    await callback.answer("Готовлю...")
+                    await generate_and_send_mix(callback.message, user_id, dishes)
+                    return
+                dish_name = get_mix_name(dishes)
             else:
                 index = int(data.split("_")[1])
                 dish_name = state_manager.get_generated_dish(user_id, index)
@@ -505,10 +663,40 @@ async def handle_callback(callback: CallbackQuery):
             await callback.answer("Нет данных.")
             return
         await callback.answer("Генерирую...")
-        await generate_and_send_recipe(callback.message, user_id, dish_name)
+        # Пользователь просит именно новый вариант — кеш не используем
+        dishes = state_manager.get_generated_dishes(user_id)
+        if MIX_PARALLEL_ENABLED and dishes and dish_name == get_mix_name(dishes):
+            await generate_and_send_mix(callback.message, user_id, dishes, use_cache=False)
+            return
+        await generate_and_send_recipe(callback.message, user_id, dish_name, use_cache=False)
+        return
+
+    # 8. История рецептов: листание и открытие рецепта
+    if data.startswith("hist_"):
+        action, _, argument = data.partition(":")
+        try:
+            if action == "hist_o":
+                created_at, recipe_id = decode_history_cursor(argument)
+                recipe = await database.get_recipe_text(recipe_id, user_id, created_at)
+                if not recipe:
+                    await callback.answer("Рецепт не найден.")
+                    return
+                await callback.answer()
+                await send_html(callback.message, recipe, reply_markup=get_hide_keyboard())
+                return
+            text, markup = await render_history_page(user_id, argument or None, newer=action == "hist_p")
+            if argument:
+                await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+            else:
+                await callback.message.answer(text, reply_markup=markup, parse_mode="HTML")
+        except TelegramBadRequest:
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка истории: {e}")
+        await callback.answer()
         return
 
-    # 8. Удаление сообщения
+    # 9. Удаление сообщения
     if data == "delete_msg":
         await callback.message.delete()
         await callback.answer()
@@ -521,6 +709,7 @@ def register_handlers(dp: Dispatcher):
     dp.message.register(cmd_start, Command("start"))
     dp.message.register(cmd_author, Command("author"))
     dp.message.register(cmd_stats, Command("stats"))
+    dp.message.register(cmd_history, Command("history"))
     
     # Затем обработчик запросов рецептов (до общего обработчика текста!)
     dp.message.register(handle_direct_recipe, F.text.lower().startswith("дай рецепт"))
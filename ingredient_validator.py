@@ -0,0 +1,193 @@
+import re
+import logging
+from typing import Dict, List, Optional
+from config import LOCAL_VALIDATOR_ENABLED, LOCAL_VALIDATOR_ACCEPT_RATIO
+from ingredients import split_products, fold_word as _fold, stem_word as _stem
+from food_lexicon import (
+    FOOD_WORDS_RU, FOOD_WORDS_EN, IRREGULAR_FORMS, NEUTRAL_WORDS, FILLER_WORDS,
+    BLOCKED_ROOTS, BLOCKED_WORDS_RU, BLOCKED_WORDS_EN
+)
+
+logger = logging.getLogger(__name__)
+
+# Окончания, которые допускаем после основы слова (падежи, число, роды)
+ENDINGS = frozenset("""
+а я о е и ы у ю ь й
+ей ой ом ем ам ям ах ях ов ев ью ию ии ия ие ые ий ый ая яя ое ее ую юю ым им ых их
+ого его ому ему ыми ими ами ями
+s es ies y
+""".split()) | {""}
+
+_WORD_RE = re.compile(r'[a-zа-яё]+')
+_MIN_FUZZY_LENGTH = 5
+
+# Приставки, с которыми русский мат встречается чаще всего
+_RU_PREFIXES = "за на по про вы от до у с съ об объ из раз разъ при под подъ пере недо не ни".split()
+_EN_SUFFIXES = "s es y ty er ers ing ed head heads".split()
+_PROFANITY_RE = re.compile(
+    "(?:{prefixes})?(?:{ru})|(?:{en})(?:{suffixes})?$".format(
+        prefixes="|".join(_RU_PREFIXES),
+        ru="|".join(root.replace('ё', 'е') for root in BLOCKED_ROOTS if not root.isascii()),
+        en="|".join(root for root in BLOCKED_ROOTS if root.isascii()),
+        suffixes="|".join(_EN_SUFFIXES),
+    )
+)
+
+
+class _TrieNode:
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.terminal = False
+
+
+class StemTrie:
+    """Префиксное дерево основ: точный поиск основа+окончание и поиск с одной опечаткой"""
+
+    def __init__(self, words: List[str]):
+        self.root = _TrieNode()
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        node = self.root
+        for char in _fold(_stem(word)):
+            node = node.children.setdefault(char, _TrieNode())
+        node.terminal = True
+
+    def match(self, word: str) -> bool:
+        """Слово = основа из словаря + допустимое окончание"""
+        node = self.root
+        for i, char in enumerate(word):
+            if node.terminal and word[i:] in ENDINGS:
+                return True
+            node = node.children.get(char)
+            if node is None:
+                return False
+        return node.terminal
+
+    def match_fuzzy(self, word: str, max_distance: int = 1) -> bool:
+        """Как match, но основа может отличаться на max_distance правок (Левенштейн).
+        Первую букву считаем верной — это резко сужает перебор"""
+        first = self.root.children.get(word[:1])
+        if first is None:
+            return False
+        stack = [(first, word[0], list(range(len(word) + 1)))]
+        while stack:
+            node, char, prev_row = stack.pop()
+            row = [prev_row[0] + 1]
+            for j in range(1, len(word) + 1):
+                cost = 0 if word[j - 1] == char else 1
+                row.append(min(row[j - 1] + 1, prev_row[j] + 1, prev_row[j - 1] + cost))
+            if node.terminal:
+                for j, distance in enumerate(row):
+                    if distance <= max_distance and word[j:] in ENDINGS:
+                        return True
+            if min(row) <= max_distance:
+                stack.extend((child, next_char, row) for next_char, child in node.children.items())
+        return False
+
+
+class IngredientValidator:
+    """Локальная проверка списка продуктов по словарю.
+
+    classify() возвращает True/False для однозначных случаев
+    и None, если решение нужно оставить LLM.
+    """
+
+    def __init__(self, accept_ratio: float = LOCAL_VALIDATOR_ACCEPT_RATIO, enabled: bool = LOCAL_VALIDATOR_ENABLED):
+        self.accept_ratio = accept_ratio
+        self.enabled = enabled
+        self.food = StemTrie((FOOD_WORDS_RU + FOOD_WORDS_EN + IRREGULAR_FORMS).replace('-', ' ').split())
+        self.neutral = StemTrie(NEUTRAL_WORDS.split())
+        food_words = {_fold(w) for w in (FOOD_WORDS_RU + FOOD_WORDS_EN + IRREGULAR_FORMS).split()}
+        self.neutral_exact = {_fold(w) for w in NEUTRAL_WORDS.split()} - food_words
+        self.filler = StemTrie(FILLER_WORDS.split())
+        self.blocked = StemTrie((BLOCKED_WORDS_RU + BLOCKED_WORDS_EN).split())
+        self._stats = {"accepted": 0, "rejected": 0, "ambiguous": 0}
+
+    def _words(self, text: str) -> List[str]:
+        return [_fold(w) for w in _WORD_RE.findall(text.lower())]
+
+    def _is_neutral(self, word: str) -> bool:
+        # Основы нейтральных слов короткие и глотают продукты: "со" + "м" = "сом",
+        # "сырой" -> "сыр". Словарную форму узнаём точно, остальные — если это не продукт
+        if word in self.neutral_exact:
+            return True
+        return self.neutral.match(word) and not self.food.match(word)
+
+    def _is_food(self, word: str) -> bool:
+        if self.food.match(word):
+            return True
+        return len(word) >= _MIN_FUZZY_LENGTH and self.food.match_fuzzy(word)
+
+    @staticmethod
+    def _is_profane(raw_word: str) -> bool:
+        # Мат ищем в исходном написании и только с начала слова: "shitake" и "ham, his" — не мат
+        return _PROFANITY_RE.match(raw_word) is not None
+
+    def _decide(self, text: str) -> Optional[bool]:
+        stripped = text.strip() if text else ""
+        if len(stripped) < 3:
+            return False
+
+        raw_words = _WORD_RE.findall(stripped.lower().replace('ё', 'е'))
+        if not raw_words:
+            # Другая письменность (китайский, арабский...) — решает LLM; без букв вовсе — мусор
+            return None if any(c.isalpha() for c in stripped) else False
+        if any(self._is_profane(w) for w in raw_words):
+            return False
+
+        known = 0
+        total = 0
+        has_blocked = False
+        for item in split_products(stripped) or [stripped]:
+            words = [w for w in self._words(item) if not self._is_neutral(w)]
+            if not words:
+                continue
+            total += 1
+            blocked = [self.blocked.match(w) for w in words]
+            if any(not is_blocked and self._is_food(w) for w, is_blocked in zip(words, blocked)):
+                known += 1
+            elif any(blocked):
+                has_blocked = True
+
+        if total == 0:
+            # Одни служебные слова ("у меня есть", "привет", "и") — продуктов нет.
+            # Остались количества и признаки ("200 г", "свежий") — пусть решает LLM
+            words = self._words(stripped)
+            if all(self.filler.match(w) and not self.food.match(w) for w in words):
+                return False
+            return None
+        if known == 0 and has_blocked:
+            # Несъедобное без единого продукта: "стекло и гвозди"
+            return False
+        if known / total >= self.accept_ratio:
+            return True
+        return None
+
+    def classify(self, text: str) -> Optional[bool]:
+        if not self.enabled:
+            return None
+        verdict = self._decide(text)
+        if verdict is True:
+            self._stats["accepted"] += 1
+        elif verdict is False:
+            self._stats["rejected"] += 1
+        else:
+            self._stats["ambiguous"] += 1
+        return verdict
+
+    def get_stats(self) -> Dict:
+        total = sum(self._stats.values())
+        local = self._stats["accepted"] + self._stats["rejected"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "local_rate": round(local / total, 3) if total else 0.0,
+        }
+
+
+# Глобальный экземпляр
+ingredient_validator = IngredientValidator()
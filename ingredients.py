@@ -0,0 +1,75 @@
+import re
+from typing import List
+from food_lexicon import NEUTRAL_WORDS, FOOD_WORDS_RU, FOOD_WORDS_EN, IRREGULAR_FORMS
+
+_ADJECTIVE_ENDINGS = ("ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие")
+_WORD_RE = re.compile(r'[a-zа-я]+')
+
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, ё -> е, схлопывание пробелов"""
+    if not text:
+        return ""
+    text = text.lower().replace('ё', 'е')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def fold_word(word: str) -> str:
+    """Сводим частые орфографические варианты: ё -> е, безударное о/а"""
+    return word.replace('ё', 'е').replace('о', 'а')
+
+
+def stem_word(word: str) -> str:
+    """Основа слова: отрезаем окончание начальной формы"""
+    if len(word) > 4 and word.endswith(_ADJECTIVE_ENDINGS):
+        return word[:-2]
+    if len(word) > 2 and word[-1] in "аеиоуыэюяьйy":
+        return word[:-1]
+    return word
+
+
+def split_products(products: str) -> List[str]:
+    """Разбивает строку продуктов на отдельные позиции"""
+    if not products:
+        return []
+    if ',' not in products and ';' not in products and '\n' not in products:
+        return [i.strip() for i in products.split() if len(i.strip()) > 1]
+    return [i.strip() for i in re.split(r'[,;\n\.]', products) if len(i.strip()) > 1]
+
+
+def canonical_products(products: str) -> List[str]:
+    """Канонический набор продуктов: нормализован, без дублей, отсортирован"""
+    items = set()
+    for item in split_products(products):
+        item = normalize_text(re.sub(r'[^\w\s-]', ' ', item))
+        if len(item) > 1:
+            items.add(item)
+    return sorted(items)
+
+
+def products_key(products: str) -> str:
+    """Строковый ключ канонического набора продуктов"""
+    return ",".join(canonical_products(products))
+
+
+_FOOD_STEMS = frozenset(
+    fold_word(stem_word(w)) for w in normalize_text(FOOD_WORDS_RU + FOOD_WORDS_EN + IRREGULAR_FORMS).replace('-', ' ').split()
+)
+# Служебные слова сравниваем целиком, а не по основе: основа "сырой" — это "сыр", "со" — "соя".
+# Слова, у которых основа совпадает с продуктом ("clove", "зеленый"), из ключа не выбрасываем
+_STOP_WORDS = frozenset(w for w in normalize_text(NEUTRAL_WORDS).split() if fold_word(stem_word(w)) not in _FOOD_STEMS)
+
+
+def ingredient_set(products: str) -> List[str]:
+    """Набор ингредиентов для сравнения между пользователями: слова приведены к основе,
+    служебные слова и количества отброшены, без дублей, отсортирован.
+    "яйца, молоко, мука" и "мука молоко яйца." дают один и тот же набор"""
+    items = set()
+    for item in split_products(products):
+        stems = {
+            fold_word(stem_word(w)) for w in _WORD_RE.findall(normalize_text(item))
+            if len(w) > 1 and w not in _STOP_WORDS
+        }
+        if stems:
+            items.add(" ".join(sorted(stems)))
+    return sorted(items)
@@ -0,0 +1,318 @@
+import re
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Mapping, Optional, Tuple
+import groq
+from config import LLM_MAX_CONCURRENCY, LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX
+
+logger = logging.getLogger(__name__)
+
+# Полосы в порядке приоритета: дешёвые короткие задачи идут раньше тяжёлых рецептов
+LANES = ("fast", "normal", "heavy", "background")
+LANE_BY_TASK = {
+    "validation": "fast",
+    "intake": "fast",
+    "categorization": "fast",
+    "validation_batch": "fast",
+    "intake_batch": "fast",
+    "generation": "normal",
+    "recipe": "heavy",
+    "freestyle": "heavy",
+    "full_menu": "heavy",
+    "library": "background",
+    "prefetch": "background",
+}
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Разбирает длительность из заголовков Groq: "2m59.56s", "7.66s", "120ms" """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(num) * _DURATION_UNITS[unit] for num, unit in parts)
+
+
+class StreamInterrupted(Exception):
+    """Стрим оборвался после того, как часть ответа уже показана — повторять нельзя"""
+
+
+class TokenBucket:
+    """Ведро токенов, которое подстраивается под x-ratelimit-* заголовки Groq"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.capacity: Optional[float] = None  # None — лимит ещё неизвестен
+        self.level = 0.0
+        self.rate = 0.0  # пополнение в секунду
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def sync(self, limit: Optional[str], remaining: Optional[str], reset: Optional[str]):
+        """Синхронизируем ведро с ответом сервера"""
+        try:
+            if remaining is None:
+                return
+            remaining_value = float(remaining)
+            limit_value = float(limit) if limit is not None else max(remaining_value, self.capacity or 0)
+        except ValueError:
+            return
+        reset_seconds = parse_reset_duration(reset)
+        self.capacity = max(limit_value, 1.0)
+        self.level = remaining_value
+        if reset_seconds and reset_seconds > 0:
+            self.rate = max((limit_value - remaining_value) / reset_seconds, self.capacity / 86400)
+        elif not self.rate:
+            self.rate = self.capacity / 60
+        self._updated_at = time.monotonic()
+
+    async def take(self, amount: float):
+        """Ждём, пока в ведре наберётся нужное количество, и забираем его"""
+        if self.capacity is None:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return
+            deficit = amount - self.level
+            await asyncio.sleep(min(deficit / self.rate if self.rate else 1.0, 30.0))
+
+    def get_stats(self) -> Dict:
+        self._refill()
+        return {
+            "capacity": self.capacity,
+            "level": round(self.level, 1),
+            "rate_per_sec": round(self.rate, 3),
+        }
+
+
+class LLMScheduler:
+    """Очередь запросов к Groq: ограничение параллельности, приоритетные полосы,
+    темп по заголовкам лимитов и повторы с джиттером"""
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._active = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        # Лимиты Groq считаются отдельно для каждой модели: model -> (запросы, токены)
+        self._buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._stats = {
+            lane: {
+                "submitted": 0,
+                "completed": 0,
+                "failed": 0,
+                "retries": 0,
+                "rate_limited": 0,
+                "max_depth": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+            }
+            for lane in LANES
+        }
+
+    @staticmethod
+    def lane_for(task_type: str) -> str:
+        return LANE_BY_TASK.get(task_type, "normal")
+
+    def buckets_for(self, model: str) -> Tuple[TokenBucket, TokenBucket]:
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            buckets = (TokenBucket("requests"), TokenBucket("tokens"))
+            self._buckets[model] = buckets
+        return buckets
+
+    # ==================== СЛОТЫ ====================
+
+    def _has_waiters_before(self, lane: str) -> bool:
+        """Есть ли в очереди кто-то с таким же или более высоким приоритетом"""
+        for other in LANES[:LANES.index(lane) + 1]:
+            if self._waiters[other]:
+                return True
+        return False
+
+    async def _acquire(self, lane: str):
+        if self._active < self.max_concurrency and not self._has_waiters_before(lane):
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = self._waiters[lane]
+        queue.append(future)
+        stats = self._stats[lane]
+        stats["max_depth"] = max(stats["max_depth"], len(queue))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже передан нам — возвращаем его
+                self._release()
+            else:
+                try:
+                    queue.remove(future)
+                except ValueError:
+                    pass
+            raise
+
+    def _release(self):
+        self._active -= 1
+        for lane in LANES:
+            queue = self._waiters[lane]
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    self._active += 1
+                    future.set_result(None)
+                    return
+
+    def has_spare_capacity(self) -> bool:
+        """Есть ли свободный слот без очереди и запас токенов (для фоновых задач)"""
+        if self._active >= self.max_concurrency:
+            return False
+        if any(self._waiters[lane] for lane in LANES):
+            return False
+        for _, bucket in self._buckets.values():
+            if bucket.capacity is not None:
+                bucket._refill()
+                if bucket.level < bucket.capacity / 2:
+                    return False
+        return True
+
+    # ==================== ЛИМИТЫ ====================
+
+    def observe_headers(self, headers: Optional[Mapping[str, str]], model: str = "default"):
+        """Подстраиваем темп модели под x-ratelimit-* заголовки ответа"""
+        if not headers:
+            return
+        requests_bucket, tokens_bucket = self.buckets_for(model)
+        requests_bucket.sync(
+            headers.get("x-ratelimit-limit-requests"),
+            headers.get("x-ratelimit-remaining-requests"),
+            headers.get("x-ratelimit-reset-requests"),
+        )
+        tokens_bucket.sync(
+            headers.get("x-ratelimit-limit-tokens"),
+            headers.get("x-ratelimit-remaining-tokens"),
+            headers.get("x-ratelimit-reset-tokens"),
+        )
+
+    def _backoff(self, attempt: int, error: Exception, model: str = "default") -> float:
+        """Пауза перед повтором: retry-after от сервера или экспонента с джиттером"""
+        response = getattr(error, "response", None)
+        if response is not None:
+            self.observe_headers(response.headers, model)
+            retry_after = parse_reset_duration(response.headers.get("retry-after"))
+            if retry_after:
+                return retry_after + random.uniform(0, self.backoff_base)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        return isinstance(error, (
+            groq.RateLimitError,
+            groq.APIConnectionError,
+            groq.InternalServerError,
+        ))
+
+    # ==================== ЗАПУСК ====================
+
+    async def run(
+        self,
+        lane: str,
+        estimated_tokens: int,
+        call: Callable[[], Awaitable[Tuple[Any, Optional[Mapping[str, str]]]]],
+        model: str = "default"
+    ) -> Any:
+        """Выполняет call() в своей полосе. call возвращает (результат, заголовки ответа).
+        Темп задают лимиты той модели, к которой обращается call"""
+        stats = self._stats[lane]
+        requests_bucket, tokens_bucket = self.buckets_for(model)
+        stats["submitted"] += 1
+        attempt = 0
+        while True:
+            queued_at = time.monotonic()
+            await self._acquire(lane)
+            try:
+                await requests_bucket.take(1)
+                await tokens_bucket.take(estimated_tokens)
+                waited = time.monotonic() - queued_at
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+
+                result, headers = await call()
+                self.observe_headers(headers, model)
+                stats["completed"] += 1
+                return result
+            except Exception as e:
+                if isinstance(e, groq.RateLimitError):
+                    stats["rate_limited"] += 1
+                if not self._is_retryable(e) or attempt >= self.max_retries:
+                    stats["failed"] += 1
+                    raise
+                delay = self._backoff(attempt, e, model)
+            finally:
+                self._release()
+
+            attempt += 1
+            stats["retries"] += 1
+            logger.warning(f"⏳ Groq [{lane}/{model}] повтор {attempt}/{self.max_retries} через {delay:.1f}с")
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict:
+        lanes = {}
+        for lane in LANES:
+            stats = self._stats[lane]
+            started = stats["completed"] + stats["failed"] + stats["retries"]
+            lanes[lane] = {
+                "depth": len(self._waiters[lane]),
+                "max_depth": stats["max_depth"],
+                "submitted": stats["submitted"],
+                "completed": stats["completed"],
+                "failed": stats["failed"],
+                "retries": stats["retries"],
+                "rate_limited": stats["rate_limited"],
+                "wait_avg": round(stats["wait_total"] / started, 3) if started else 0.0,
+                "wait_max": round(stats["wait_max"], 3),
+            }
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "lanes": lanes,
+            "models": {
+                model: {
+                    "requests_bucket": requests_bucket.get_stats(),
+                    "tokens_bucket": tokens_bucket.get_stats(),
+                }
+                for model, (requests_bucket, tokens_bucket) in self._buckets.items()
+            },
+        }
+
+
+# Глобальный экземпляр
+llm_scheduler = LLMScheduler()
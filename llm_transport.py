@@ -0,0 +1,157 @@
+"""Транспорт запросов к Groq: live, record, replay.
+
+    LLM_TRANSPORT=live    — обычная работа
+    LLM_TRANSPORT=record  — работаем с Groq и пишем пары запрос/ответ в журнал
+    LLM_TRANSPORT=replay  — отвечаем из журнала, Groq не нужен (и GROQ_API_KEY тоже)
+
+Журнал — JSON-строки (gzip, если путь кончается на .gz): хеш запроса, задача, модель,
+текст ответа и латентность. Сами промпты не храним — только хеш.
+Ключ не включает модель: при воспроизведении model_router может выбрать другую.
+"""
+import os
+import json
+import gzip
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+from config import LLM_TRANSPORT, LLM_JOURNAL, LLM_REPLAY_LATENCY, LLM_REPLAY_SPEED
+
+logger = logging.getLogger(__name__)
+
+MODES = ("live", "record", "replay")
+# recorded — латентность этого ответа, sampled — случайная из записанных для задачи, none — без задержки
+LATENCY_MODES = ("recorded", "sampled", "none")
+# На сколько кусков резать ответ при имитации стрима
+_STREAM_CHUNKS = 20
+
+
+class ReplayMiss(Exception):
+    """В журнале нет ответа на такой запрос"""
+
+
+def request_key(messages: List[Dict[str, str]], temperature: float, max_tokens: int, json_mode: bool) -> str:
+    payload = json.dumps([messages, round(temperature, 3), max_tokens, json_mode], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class LLMTransport:
+    def __init__(
+        self,
+        mode: str = LLM_TRANSPORT,
+        journal: str = LLM_JOURNAL,
+        latency: str = LLM_REPLAY_LATENCY,
+        speed: float = LLM_REPLAY_SPEED
+    ):
+        if mode not in MODES:
+            raise ValueError(f"LLM_TRANSPORT должен быть одним из {MODES}, а не {mode!r}")
+        if latency not in LATENCY_MODES:
+            raise ValueError(f"LLM_REPLAY_LATENCY должен быть одним из {LATENCY_MODES}, а не {latency!r}")
+        self.mode = mode
+        self.journal = journal
+        self.latency = latency
+        self.speed = speed
+        # ключ -> записанные ответы (повторный одинаковый запрос получает следующий по кругу)
+        self._entries: Dict[str, List[Dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._latencies: Dict[str, List[float]] = {}
+        self._loaded = False
+        self._stats = {"live": 0, "recorded": 0, "replayed": 0, "misses": 0}
+
+    def load(self):
+        """Читаем журнал для replay (лениво, при первом запросе)"""
+        self._loaded = True
+        if not os.path.exists(self.journal):
+            logger.warning(f"⚠️ Журнал LLM {self.journal} не найден — все запросы будут промахами")
+            return
+        with _open(self.journal, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._entries.setdefault(entry["k"], []).append(entry)
+                self._latencies.setdefault(entry["task"], []).append(entry["lat"])
+        logger.info(f"📼 Журнал LLM загружен: {sum(map(len, self._entries.values()))} ответов, "
+                    f"{len(self._entries)} разных запросов")
+
+    def _append(self, entry: Dict):
+        # Пишем сразу: прерванная запись не теряет уже полученные ответы
+        with _open(self.journal, "a") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def _replay_delay(self, entry: Dict) -> float:
+        if self.latency == "none":
+            return 0.0
+        latency = entry["lat"]
+        if self.latency == "sampled":
+            latency = random.choice(self._latencies.get(entry["task"]) or [latency])
+        return latency / self.speed
+
+    async def call(
+        self,
+        live_call: Callable[..., Awaitable[Tuple[str, Mapping[str, str]]]],
+        task_type: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        json_mode: bool = False
+    ) -> Tuple[str, Mapping[str, str]]:
+        """live_call — настоящий вызов API (GroqService._call_groq)"""
+        if self.mode == "live":
+            self._stats["live"] += 1
+            return await live_call(model, messages, temperature, max_tokens, on_progress, json_mode)
+
+        key = request_key(messages, temperature, max_tokens, json_mode)
+        if self.mode == "record":
+            started = time.monotonic()
+            text, headers = await live_call(model, messages, temperature, max_tokens, on_progress, json_mode)
+            self._append({
+                "k": key, "task": task_type, "model": model,
+                "lat": round(time.monotonic() - started, 3), "text": text,
+            })
+            self._stats["recorded"] += 1
+            return text, headers
+
+        if not self._loaded:
+            self.load()
+        entries = self._entries.get(key)
+        if not entries:
+            self._stats["misses"] += 1
+            raise ReplayMiss(f"нет ответа для {task_type} ({key})")
+        cursor = self._cursor.get(key, 0)
+        self._cursor[key] = cursor + 1
+        entry = entries[cursor % len(entries)]
+        delay = self._replay_delay(entry)
+        text = entry["text"]
+
+        if on_progress is None or json_mode:
+            await asyncio.sleep(delay)
+        else:
+            # Имитируем стрим: ответ кусками, равномерно по записанной латентности
+            step = max(1, len(text) // _STREAM_CHUNKS)
+            chunks = [text[i:i + step] for i in range(0, len(text), step)] or [""]
+            for chunk in chunks:
+                await asyncio.sleep(delay / len(chunks))
+                try:
+                    await on_progress(chunk)
+                except Exception as e:
+                    logger.warning(f"Ошибка обработки стрима: {e}")
+        self._stats["replayed"] += 1
+        return text, {}
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, "mode": self.mode, "journal_keys": len(self._entries)}
+
+
+# Глобальный экземпляр
+llm_transport = LLMTransport()
@@ -0,0 +1,413 @@
+"""Нагрузочный тест бота целиком: настоящий Dispatcher с register_handlers,
+синтетические апдейты через feed_update, поддельные Telegram Bot API, Groq и распознавание речи.
+
+    python loadtest.py [--users 20] [--flows 3] [--database-url postgresql://...]
+    python loadtest.py --replay temp/llm_journal.jsonl.gz   # ответы Groq из журнала llm_transport
+
+Сценарий пользователя: /start → продукты → "Добавить" → ещё продукты → "Готовить" →
+категория → блюдо → "Другой вариант" → голосовое "рецепт ...". Для каждого шага —
+p50/p95/p99 времени обработки апдейта; в конце — пропускная способность.
+Без --database-url используется БД в памяти (с задержкой --db-latency-ms на запрос).
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import itertools
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("loadtest")
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Chef"}
+
+PRODUCTS = [
+    "картошка, лук, морковь",
+    "курица, рис, чеснок",
+    "яйца, молоко, мука",
+    "фарш, макароны, сыр",
+    "гречка, тушёнка",
+    "помидоры, огурцы, перец",
+    "творог, сметана, изюм",
+    "лосось, лимон, укроп",
+    "свекла, капуста, говядина",
+    "кабачки, баклажаны, чеснок",
+]
+EXTRA_PRODUCTS = ["сливочное масло", "зелень", "сметана", "томатная паста", "шампиньоны", "сыр"]
+VOICE_REQUESTS = ["рецепт борщ", "рецепт блины", "рецепт плов", "рецепт сырники", "рецепт солянка"]
+DISHES = [
+    "Омлет с овощами", "Картофельная запеканка", "Куриный суп с лапшой", "Плов с курицей",
+    "Овощное рагу", "Гречка по-купечески", "Макароны по-флотски", "Сырники", "Борщ",
+    "Запечённый лосось", "Салат из свежих овощей", "Блины", "Тушёная капуста", "Котлеты",
+]
+STEPS = ("start", "products", "add_more", "more_products", "cook", "category", "dish", "another", "voice")
+
+
+# ==================== ПОДДЕЛЬНЫЕ ВНЕШНИЕ СЕРВИСЫ ====================
+
+def make_fake_telegram(latency: float):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import EditMessageText, GetFile, SendMessage
+    from aiogram.types import InlineKeyboardMarkup
+
+    class FakeTelegram(BaseSession):
+        """Bot API в памяти: отвечает как Telegram и запоминает последнюю клавиатуру в каждом чате"""
+
+        def __init__(self):
+            super().__init__()
+            self.latency = latency
+            self.calls: Counter = Counter()
+            # chat_id -> (сообщение с клавиатурой, callback_data кнопок)
+            self.keyboards: Dict[int, Tuple[Dict, List[str]]] = {}
+            # file_id голосового -> "распознанный" текст
+            self.voice_texts: Dict[str, str] = {}
+            self._message_ids = itertools.count(1)
+
+        async def close(self):
+            pass
+
+        async def make_request(self, bot, method, timeout=None):
+            await asyncio.sleep(self.latency)
+            self.calls[type(method).__name__] += 1
+            result = True
+            if isinstance(method, (SendMessage, EditMessageText)):
+                message_id = method.message_id if isinstance(method, EditMessageText) else next(self._message_ids)
+                result = {
+                    "message_id": message_id, "date": int(time.time()), "text": method.text,
+                    "chat": {"id": method.chat_id, "type": "private"}, "from": BOT_USER,
+                }
+                if isinstance(method.reply_markup, InlineKeyboardMarkup):
+                    buttons = [b.callback_data for row in method.reply_markup.inline_keyboard for b in row if b.callback_data]
+                    self.keyboards[method.chat_id] = (result, buttons)
+            elif isinstance(method, GetFile):
+                result = {"file_id": method.file_id, "file_unique_id": method.file_id,
+                          "file_path": f"voice/{method.file_id}.ogg"}
+            return self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result})).result
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            file_id = url.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+            yield self.voice_texts.get(file_id, "").encode("utf-8")
+
+    return FakeTelegram()
+
+
+class FakeVoiceProcessor:
+    """Вместо ffmpeg + Google: "аудиофайл" содержит сам текст"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def process_voice(self, voice_file_path: str) -> str:
+        await asyncio.sleep(self.latency)
+        with open(voice_file_path, encoding="utf-8") as f:
+            text = f.read()
+        os.remove(voice_file_path)
+        return text
+
+
+class FakeGroq:
+    """Транспорт llm_transport с правдоподобными ответами по типу задачи.
+    Задержка: время до первого токена + генерация с заданной скоростью"""
+
+    def __init__(self, ttft: float, tokens_per_second: float):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.calls: Counter = Counter()
+
+    @staticmethod
+    def _answer(task_type: str, messages: List[Dict[str, str]]) -> str:
+        user_text = messages[-1]["content"]
+        seed = int(hashlib.md5(messages[0]["content"].encode("utf-8")).hexdigest()[:8], 16)
+        intake = {"valid": True, "reason": "продукты", "ingredients": [], "categories": ["main", "soup", "salad", "mix"]}
+        if task_type in ("validation", "intake"):
+            return json.dumps(intake, ensure_ascii=False)
+        if task_type.endswith("_batch"):
+            ids = [int(line.split(".", 1)[0]) for line in user_text.splitlines() if line[:1].isdigit()]
+            return json.dumps([{"id": i, **intake} for i in ids], ensure_ascii=False)
+        if task_type == "categorization":
+            return '["main", "soup", "salad", "mix"]'
+        if task_type == "generation":
+            names = random.Random(seed).sample(DISHES, 5)
+            return json.dumps([{"name": n, "desc": "Просто и вкусно"} for n in names], ensure_ascii=False)
+        steps = "\n".join(f"{i}. Подготовьте продукты и готовьте на среднем огне {i * 3} минут." for i in range(1, 9))
+        return (
+            "🍽️ <b>Блюдо дня</b>\n\n📦 <b>Ингредиенты:</b>\n"
+            + "\n".join(f"🔸 Продукт {i} - {i * 50} г" for i in range(1, 8))
+            + "\n\n📊 <b>Пищевая ценность на 1 порцию:</b>\n🥚 Белки: 20 г\n🥑 Жиры: 15 г\n"
+            "🌾 Углеводы: 40 г\n⚡ Энерг. ценность: 380 ккал\n\n⏱ <b>Время:</b> 40 минут\n"
+            f"🔪 <b>Приготовление:</b>\n{steps}\n\n💡 <b>Совет шеф-повара:</b>\nПодавайте горячим."
+        )
+
+    async def call(self, live_call, task_type, model, messages, temperature, max_tokens,
+                   on_progress=None, json_mode=False):
+        self.calls[task_type] += 1
+        text = self._answer(task_type, messages)
+        generation = len(text) / 3 / self.tokens_per_second
+        await asyncio.sleep(self.ttft)
+        if on_progress is None or json_mode:
+            await asyncio.sleep(generation)
+            return text, {}
+        step = max(1, len(text) // 20)
+        chunks = [text[i:i + step] for i in range(0, len(text), step)]
+        for chunk in chunks:
+            await asyncio.sleep(generation / len(chunks))
+            await on_progress(chunk)
+        return text, {}
+
+    def get_stats(self) -> Dict:
+        return dict(self.calls)
+
+
+class MemoryDatabase:
+    """Замена Database для прогонов без Postgres: те же методы, что зовут обработчики"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.users: Dict[int, Dict] = {}
+        self.sessions: Dict[int, Dict] = {}
+        self.recipes: List[Dict] = []
+        self.queries = 0
+
+    async def _query(self):
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+
+    async def get_or_create_user(self, telegram_id, username=None, first_name=None, last_name=None, language="ru"):
+        await self._query()
+        return self.users.setdefault(telegram_id, {"id": telegram_id, "username": username, "language": language})
+
+    async def update_user_language(self, telegram_id, language):
+        await self._query()
+
+    async def create_or_update_session(self, telegram_id, **fields):
+        await self._query()
+        session = self.sessions.setdefault(telegram_id, {"user_id": telegram_id})
+        session.update({k: v for k, v in fields.items() if v is not None})
+        return session
+
+    async def save_sessions_batch(self, rows):
+        await self._query()
+        written = set()
+        for user_id, products, state, categories, dishes, current_dish, history in rows:
+            if user_id not in self.users:
+                continue
+            self.sessions[user_id] = {
+                "user_id": user_id, "products": products, "state": state, "categories": json.loads(categories),
+                "generated_dishes": json.loads(dishes), "current_dish": current_dish, "history": json.loads(history),
+            }
+            written.add(user_id)
+        return written
+
+    async def get_session(self, telegram_id):
+        await self._query()
+        return self.sessions.get(telegram_id)
+
+    async def clear_session(self, telegram_id):
+        await self._query()
+        self.sessions.pop(telegram_id, None)
+
+    async def save_recipe(self, telegram_id, dish_name, recipe_text, products_used=None):
+        await self._query()
+        self.recipes.append({"user_id": telegram_id, "dish_name": dish_name})
+        return len(self.recipes)
+
+    async def get_user_recipes(self, telegram_id, limit=10):
+        await self._query()
+        return [r for r in self.recipes if r["user_id"] == telegram_id][-limit:]
+
+
+# ==================== СЦЕНАРИЙ ====================
+
+class StepFailed(Exception):
+    """Бот ответил не так, как ждёт сценарий (нет нужной кнопки)"""
+
+
+class VirtualUser:
+    def __init__(self, user_id: int, harness: "Harness"):
+        self.user_id = user_id
+        self.h = harness
+        self.rng = random.Random(user_id)
+        self._update_ids = itertools.count(user_id * 1000)
+
+    def _base(self) -> Dict:
+        return {
+            "message_id": next(self._update_ids), "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False, "first_name": f"User{self.user_id}"},
+        }
+
+    async def text(self, step: str, text: str):
+        await self.h.feed(step, {"message": {**self._base(), "text": text}})
+
+    async def voice(self, step: str, text: str):
+        file_id = f"v{self.user_id}_{next(self._update_ids)}"
+        self.h.telegram.voice_texts[file_id] = text
+        voice = {"file_id": file_id, "file_unique_id": file_id, "duration": 2}
+        await self.h.feed(step, {"message": {**self._base(), "voice": voice}})
+
+    async def press(self, step: str, prefix: str, pick_random: bool = False):
+        """Нажать кнопку последней клавиатуры, callback_data которой начинается с prefix"""
+        message, buttons = self.h.telegram.keyboards.get(self.user_id, ({}, []))
+        options = [b for b in buttons if b.startswith(prefix)]
+        if not options:
+            self.h.errors[step] += 1
+            raise StepFailed(f"{step}: нет кнопки {prefix}* среди {buttons}")
+        data = self.rng.choice(options) if pick_random else options[0]
+        callback = {
+            "id": str(next(self._update_ids)), "chat_instance": str(self.user_id), "data": data,
+            "from": {"id": self.user_id, "is_bot": False, "first_name": f"User{self.user_id}"},
+            "message": message,
+        }
+        await self.h.feed(step, {"callback_query": callback})
+
+    async def flow(self):
+        rng = self.rng
+        await self.text("start", "/start")
+        await self.text("products", rng.choice(PRODUCTS))
+        await self.press("add_more", "action_add_more")
+        await self.text("more_products", rng.choice(EXTRA_PRODUCTS))
+        await self.press("cook", "action_cook")
+        await self.press("category", "cat_", pick_random=True)
+        # В комплексном обеде одна кнопка на все блюда
+        await self.press("dish", "dish_", pick_random=True)
+        await self.press("another", "repeat_recipe")
+        await self.voice("voice", rng.choice(VOICE_REQUESTS))
+
+
+class Harness:
+    def __init__(self, dp, bot, telegram):
+        self.dp = dp
+        self.bot = bot
+        self.telegram = telegram
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self._update_ids = itertools.count(1)
+
+    async def feed(self, step: str, payload: Dict):
+        from aiogram.types import Update
+
+        update = Update.model_validate({"update_id": next(self._update_ids), **payload}, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors[step] += 1
+            logger.warning(f"{step}: {e!r}")
+        self.latencies[step].append(time.perf_counter() - started)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def run(args) -> Dict:
+    from aiogram import Bot, Dispatcher
+    import handlers
+    import groq_service
+    from database import db
+    from state_manager import state_manager
+    from main import setup_dispatcher
+
+    telegram = make_fake_telegram(args.tg_latency_ms / 1000)
+    bot = Bot(token="123456:LOADTEST", session=telegram)
+    dp = Dispatcher()
+    setup_dispatcher(dp)
+
+    handlers.voice_processor = FakeVoiceProcessor(args.voice_latency_ms / 1000)
+    if args.replay:
+        from llm_transport import LLMTransport
+        groq_service.llm_transport = LLMTransport("replay", args.replay, latency="recorded", speed=1.0)
+    else:
+        groq_service.llm_transport = FakeGroq(args.groq_ttft, args.groq_tps)
+
+    memory_db = None
+    if args.database_url:
+        await db.connect()
+    else:
+        memory_db = MemoryDatabase(args.db_latency_ms / 1000)
+        for name in ("get_or_create_user", "update_user_language", "create_or_update_session",
+                     "save_sessions_batch", "get_session", "clear_session", "save_recipe", "get_user_recipes"):
+            setattr(db, name, getattr(memory_db, name))
+    state_manager.db_connected = True
+
+    harness = Harness(dp, bot, telegram)
+    flush_task = asyncio.create_task(state_manager.run_session_flush())
+
+    async def user(i: int):
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        vu = VirtualUser(10_000 + i, harness)
+        for _ in range(args.flows):
+            try:
+                await vu.flow()
+            except StepFailed as e:
+                logger.warning(str(e))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    flush_task.cancel()
+    await state_manager.flush_sessions()
+    if args.database_url:
+        await db.close()
+
+    return {
+        "elapsed": elapsed,
+        "latencies": harness.latencies,
+        "errors": harness.errors,
+        "telegram_calls": telegram.calls,
+        "groq": groq_service.llm_transport.get_stats(),
+        "db_queries": memory_db.queries if memory_db else None,
+    }
+
+
+def report(result: Dict, args):
+    latencies, errors = result["latencies"], result["errors"]
+    updates = sum(len(v) for v in latencies.values())
+    print(f"Пользователей: {args.users}, сценариев на пользователя: {args.flows}, время: {result['elapsed']:.1f}с")
+    print(f"{'шаг':>14} {'апдейтов':>9} {'ошибок':>7} {'p50,с':>7} {'p95,с':>7} {'p99,с':>7}")
+    for step in STEPS:
+        values = latencies.get(step, [])
+        print(f"{step:>14} {len(values):>9} {errors.get(step, 0):>7} {_percentile(values, 0.5):>7.2f} "
+              f"{_percentile(values, 0.95):>7.2f} {_percentile(values, 0.99):>7.2f}")
+    print(f"\nАпдейтов/с:    {updates / result['elapsed']:.1f}")
+    print(f"Сценариев/с:   {len(latencies.get('voice', [])) / result['elapsed']:.2f}")
+    print(f"Вызовы Groq:   {result['groq']}")
+    print(f"Вызовы Bot API: {dict(result['telegram_calls'])}")
+    if result["db_queries"] is not None:
+        print(f"Запросов к БД: {result['db_queries']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест кулинарного бота")
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--flows", type=int, default=3, help="сценариев подряд у каждого")
+    parser.add_argument("--ramp", type=float, default=2.0, help="за сколько секунд приходят пользователи")
+    parser.add_argument("--database-url", help="Postgres для прогона (по умолчанию БД в памяти)")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--tg-latency-ms", type=float, default=30.0, help="задержка Bot API")
+    parser.add_argument("--voice-latency-ms", type=float, default=500.0, help="распознавание речи")
+    parser.add_argument("--groq-ttft", type=float, default=0.3, help="время до первого токена, с")
+    parser.add_argument("--groq-tps", type=float, default=400.0, help="токенов в секунду")
+    parser.add_argument("--replay", help="журнал llm_transport вместо поддельного Groq")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    # config.py читает окружение при импорте
+    os.environ["DATABASE_URL"] = args.database_url or "postgresql://localhost/loadtest"
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:LOADTEST")
+    os.environ.setdefault("GROQ_API_KEY", "loadtest")
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR, stream=sys.stdout)
+    logger.setLevel(logging.WARNING)
+    random.seed(args.seed)
+    report(asyncio.run(run(args)), args)
+
+
+if __name__ == "__main__":
+    main()
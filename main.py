@@ -1,5 +1,6 @@
 import asyncio
 import os
+import json
 import logging
 import sys
 from aiogram import Bot, Dispatcher
@@ -9,6 +10,22 @@ from handlers import register_handlers
 from state_manager import state_manager
 from aiohttp import web
 from database import db
+from recipe_cache import recipe_cache
+from groq_service import inflight_requests, validation_batcher, intake_batcher
+from llm_scheduler import llm_scheduler
+from prefetch import dish_prefetcher
+from ingredient_validator import ingredient_validator
+from structured_output import structured_stats
+from model_router import model_router
+from circuit_breaker import groq_breaker
+from fallback_corpus import fallback_corpus
+from product_index import product_index
+from recipe_library import recipe_library
+from metrics import MetricsMiddleware, stats_collector, render_metrics
+from tracing import tracer
+from llm_transport import llm_transport
+from bot_stats import bot_stats
+from maintenance import maintenance
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,13 +41,66 @@ dp = Dispatcher()
 
 # --- Веб-сервер для Render ---
 async def health_check(request):
-    return web.Response(text="Bot is running OK")
+    # Сбой Groq — не повод перезапускать бота, поэтому статус всегда 200
+    breaker = groq_breaker.get_stats()
+    text = f"Bot is running OK | Groq circuit: {breaker['state']}"
+    if breaker["retry_in"] is not None:
+        text += f" (retry in {breaker['retry_in']}s, fallback recipes: {fallback_corpus.get_stats()['size']})"
+    return web.Response(text=text)
+
+def collect_stats() -> dict:
+    return {
+        "recipe_cache": recipe_cache.get_stats(),
+        "inflight_requests": inflight_requests.get_stats(),
+        "llm_scheduler": llm_scheduler.get_stats(),
+        "prefetch": dish_prefetcher.get_stats(),
+        "local_validator": ingredient_validator.get_stats(),
+        "structured_output": structured_stats.get_stats(),
+        "model_router": model_router.get_stats(),
+        "validation_batcher": validation_batcher.get_stats(),
+        "intake_batcher": intake_batcher.get_stats(),
+        "groq_circuit": groq_breaker.get_stats(),
+        "fallback_corpus": fallback_corpus.get_stats(),
+        "product_index": product_index.get_stats(),
+        "recipe_library": recipe_library.get_stats(),
+        "tracing": tracer.get_stats(),
+        "llm_transport": llm_transport.get_stats(),
+        "user_registry": db.get_registry_stats(),
+        "bot_stats": bot_stats.get_stats(),
+        "recipe_storage": db.get_body_stats(),
+        "maintenance": maintenance.get_stats(),
+    }
+
+async def stats_endpoint(request):
+    """Внутренние счётчики бота в JSON"""
+    return web.json_response(collect_stats())
+
+async def metrics_endpoint(request):
+    """Метрики в формате Prometheus"""
+    body, content_type = render_metrics()
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+async def traces_endpoint(request):
+    """Последние медленные взаимодействия с разбивкой по шагам (?limit=20)"""
+    try:
+        limit = int(request.query.get("limit", 20))
+    except ValueError:
+        limit = 20
+    return web.json_response(tracer.get_slow(limit), dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+def register_metrics():
+    # get_stats() модулей и размеры пула/кешей считаются только при запросе /metrics
+    stats_collector.add(collect_stats)
+    stats_collector.add(lambda: {"db_pool": db.get_pool_stats(), "state_manager": state_manager.get_stats()})
 
 async def start_web_server():
     try:
         app = web.Application()
         app.router.add_get('/', health_check)
         app.router.add_get('/health', health_check)
+        app.router.add_get('/stats', stats_endpoint)
+        app.router.add_get('/metrics', metrics_endpoint)
+        app.router.add_get('/traces', traces_endpoint)
         runner = web.AppRunner(app)
         await runner.setup()
         
@@ -41,12 +111,19 @@ async def start_web_server():
     except Exception as e:
         logger.error(f"❌ Error starting web server: {e}")
 
+def setup_dispatcher(dp: Dispatcher):
+    """Обработчики и middleware (общие для бота и нагрузочного теста loadtest.py)"""
+    register_handlers(dp)
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+
 # --- НАСТРОЙКА МЕНЮ БОТА ---
 async def setup_bot_commands(bot: Bot):
     commands = [
         BotCommand(command="/start", description="🔄 Рестарт / новые продукты"),
         BotCommand(command="/author", description="👨‍💻 Автор бота"),
-        BotCommand(command="/stats", description="📊 Статистика и история")
+        BotCommand(command="/stats", description="📊 Статистика и история"),
+        BotCommand(command="/history", description="📖 Все мои рецепты")
     ]
     try:
         await bot.set_my_commands(commands)
@@ -70,14 +147,32 @@ async def main():
     try:
         await state_manager.initialize()
         logger.info("✅ StateManager инициализирован")
+        asyncio.create_task(state_manager.run_session_flush())
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации StateManager: {e}")
     
+    # Пакетная запись last_active пользователей
+    asyncio.create_task(db.run_activity_flush())
+    # Перенос текстов старых рецептов в recipe_bodies (после переноса — пустой проход)
+    asyncio.create_task(db.run_body_migration())
+    # Удаление устаревших сессий, истории и кеша (один инстанс из нескольких)
+    asyncio.create_task(maintenance.run())
+    # Снимок статистики для /stats
+    asyncio.create_task(bot_stats.run_refresh())
+
+    # Запасные рецепты на случай недоступности Groq
+    await fallback_corpus.load()
+    asyncio.create_task(fallback_corpus.run_refresh())
+    await product_index.load()
+    await recipe_library.load()
+    asyncio.create_task(recipe_library.run_refresh())
+
     # 3. Запуск веб-сервера для Render
+    register_metrics()
     await start_web_server()
     
     # 4. Регистрация обработчиков (ВАЖНО: порядок имеет значение!)
-    register_handlers(dp)
+    setup_dispatcher(dp)
     logger.info("✅ Обработчики зарегистрированы (с правильным порядком)")
     
     # 5. Настройка команд бота
@@ -0,0 +1,126 @@
+"""Фоновое обслуживание БД: удаление устаревших данных.
+
+Раз в MAINTENANCE_INTERVAL секунд по очереди выполняются задачи:
+    sessions       — сессии без активности дольше SESSION_RETENTION_DAYS дней
+    recipes        — история сверх RECIPE_HISTORY_PER_USER последних рецептов на пользователя
+    recipe_bodies  — тексты рецептов, на которые больше никто не ссылается
+    recipe_cache   — записи кеша рецептов старше RECIPE_CACHE_DB_TTL
+
+Перед ними создаются секции recipes на RECIPE_PARTITIONS_AHEAD месяцев вперёд и удаляются
+секции старше RECIPE_RETENTION_MONTHS (если задано) — целиком, без построчного DELETE.
+
+Удаление идёт пакетами по MAINTENANCE_BATCH строк по первичному ключу с паузой между
+пакетами, поэтому ни один запрос не держит таблицу долго и не занимает пул.
+Из нескольких инстансов бота обслуживание выполняет один — тот, кто взял pg_try_advisory_lock.
+"""
+import time
+import asyncio
+import logging
+import asyncpg
+from typing import Awaitable, Callable, Dict, Optional
+from config import (
+    DATABASE_URL, MAINTENANCE_ENABLED, MAINTENANCE_INTERVAL, MAINTENANCE_BATCH, MAINTENANCE_PAUSE,
+    SESSION_RETENTION_DAYS, RECIPE_HISTORY_PER_USER, RECIPE_CACHE_DB_TTL, RECIPE_RETENTION_MONTHS
+)
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_try_advisory_lock: обслуживание выполняет один инстанс
+_LOCK_ID = 0x4D41_494E  # "MAIN"
+# Первый проход — вскоре после старта, но не в момент запуска
+_STARTUP_DELAY = 60
+
+
+class Maintenance:
+    def __init__(
+        self,
+        interval: float = MAINTENANCE_INTERVAL,
+        batch_size: int = MAINTENANCE_BATCH,
+        pause: float = MAINTENANCE_PAUSE
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.jobs: Dict[str, Callable[[Optional[object]], Awaitable[tuple]]] = {
+            "sessions": lambda after: db.cleanup_old_sessions(SESSION_RETENTION_DAYS, after or 0, self.batch_size),
+            "recipes": lambda after: db.trim_recipe_history(RECIPE_HISTORY_PER_USER, after or 0, limit=self.batch_size),
+            "recipe_bodies": lambda after: db.delete_orphan_bodies(after or b"", self.batch_size),
+            "recipe_cache": lambda after: db.cleanup_recipe_cache(RECIPE_CACHE_DB_TTL, after or "", self.batch_size),
+        }
+        self._stats = {
+            "runs": 0, "skipped": 0, "errors": 0, "last_run": None, "last_duration": None, "dropped_partitions": 0
+        }
+        self._deleted: Dict[str, int] = {name: 0 for name in self.jobs}
+
+    async def _run_job(self, name: str) -> int:
+        """Проходим таблицу пакетами от начала до конца"""
+        job = self.jobs[name]
+        after, deleted = None, 0
+        while True:
+            scanned, batch_deleted, after = await job(after)
+            deleted += batch_deleted
+            if batch_deleted:
+                self._deleted[name] += batch_deleted
+            if not scanned or after is None:
+                return deleted
+            await asyncio.sleep(self.pause)
+
+    async def run_once(self) -> Optional[Dict[str, int]]:
+        """Один проход всех задач. None — обслуживание уже идёт в другом инстансе"""
+        # Блокировка держится весь проход — на отдельном соединении, а не на одном из 5 в пуле.
+        # Закрытие соединения снимает её, даже если проход оборвался
+        lock_conn = await asyncpg.connect(DATABASE_URL, statement_cache_size=0)
+        try:
+            if not await lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", _LOCK_ID):
+                self._stats["skipped"] += 1
+                logger.info("⏳ Обслуживание БД уже идёт в другом инстансе")
+                return None
+            try:
+                started = time.monotonic()
+                result = {}
+                try:
+                    await db.ensure_recipe_partitions()
+                    if RECIPE_RETENTION_MONTHS:
+                        dropped = await db.drop_old_recipe_partitions(RECIPE_RETENTION_MONTHS)
+                        self._stats["dropped_partitions"] += len(dropped)
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logger.error(f"Ошибка обслуживания секций recipes: {e}")
+                for name in self.jobs:
+                    try:
+                        result[name] = await self._run_job(name)
+                    except Exception as e:
+                        # Одна задача не мешает остальным; недоделанное продолжим в следующий проход
+                        self._stats["errors"] += 1
+                        logger.error(f"Ошибка обслуживания {name}: {e}")
+                self._stats["runs"] += 1
+                self._stats["last_run"] = time.time()
+                self._stats["last_duration"] = round(time.monotonic() - started, 1)
+                if any(result.values()):
+                    logger.info(f"🧹 Обслуживание БД: удалено {result}")
+                return result
+            finally:
+                await lock_conn.execute("SELECT pg_advisory_unlock($1)", _LOCK_ID)
+        finally:
+            await lock_conn.close()
+
+    async def run(self):
+        if not MAINTENANCE_ENABLED:
+            return
+        await asyncio.sleep(_STARTUP_DELAY)
+        while True:
+            if db.pool:
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logger.error(f"Ошибка обслуживания БД: {e}")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, **{f"deleted_{name}": count for name, count in self._deleted.items()}}
+
+
+# Глобальный экземпляр
+maintenance = Maintenance()
@@ -0,0 +1,132 @@
+import re
+import html
+import time
+import asyncio
+import logging
+from typing import List, Optional
+from aiogram.types import Message, InlineKeyboardMarkup
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from config import STREAMING_ENABLED, STREAM_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на длину сообщения (оставляем запас под курсор и многоточие)
+PREVIEW_LIMIT = 4000
+ALLOWED_TAGS = ("b", "i", "u", "s", "code")
+_TAG_RE = re.compile(r'<(/?)(' + '|'.join(ALLOWED_TAGS) + r')>')
+_ESCAPED_TAG_RE = re.compile(r'&lt;(/?)(' + '|'.join(ALLOWED_TAGS) + r')&gt;')
+
+
+def make_html_safe(text: str, limit: int = PREVIEW_LIMIT) -> str:
+    """Делает незаконченный HTML от LLM пригодным для parse_mode=HTML"""
+    # Отрезаем недописанный тег в конце ("<b" или "</")
+    last_open = text.rfind('<')
+    if last_open > text.rfind('>'):
+        text = text[:last_open]
+
+    truncated = len(text) > limit
+    if truncated:
+        text = text[:limit]
+        last_open = text.rfind('<')
+        if last_open > text.rfind('>'):
+            text = text[:last_open]
+
+    # Экранируем всё, затем возвращаем разрешённые теги
+    text = _ESCAPED_TAG_RE.sub(r'<\1\2>', html.escape(text, quote=False))
+
+    # Балансируем теги: лишние закрывающие убираем, открытые закрываем
+    stack: List[str] = []
+    result = []
+    pos = 0
+    for match in _TAG_RE.finditer(text):
+        result.append(text[pos:match.start()])
+        pos = match.end()
+        closing, tag = match.group(1), match.group(2)
+        if not closing:
+            stack.append(tag)
+            result.append(match.group(0))
+        elif tag in stack:
+            while stack:
+                open_tag = stack.pop()
+                result.append(f"</{open_tag}>")
+                if open_tag == tag:
+                    break
+    result.append(text[pos:])
+    if truncated:
+        result.append("…")
+    result.extend(f"</{tag}>" for tag in reversed(stack))
+    return "".join(result)
+
+
+class MessageStreamer:
+    """Показывает ответ LLM по мере генерации, редактируя сообщение-заглушку"""
+
+    def __init__(self, message: Message, interval: float = STREAM_EDIT_INTERVAL, enabled: bool = STREAMING_ENABLED):
+        self.message = message
+        self.interval = interval
+        self.enabled = enabled
+        self._parts: List[str] = []
+        self._last_sent = ""
+        self._next_edit_at = 0.0
+        self._edit_task: Optional[asyncio.Task] = None
+        self._started_at = time.monotonic()
+        self.first_content_at: Optional[float] = None
+
+    @property
+    def on_progress(self):
+        """Колбэк для GroqService (None, если стриминг выключен)"""
+        return self.feed if self.enabled else None
+
+    async def feed(self, delta: str):
+        """Принимаем очередной кусок текста из стрима Groq"""
+        self._parts.append(delta)
+        if self.first_content_at is None:
+            self.first_content_at = time.monotonic()
+            logger.debug(f"⚡️ Первый токен через {self.first_content_at - self._started_at:.2f}с")
+        # Telegram не ждём: правка уходит в фоне, чтение стрима не тормозит
+        if self._edit_task is None and time.monotonic() >= self._next_edit_at:
+            self._edit_task = asyncio.create_task(self._edit_preview())
+
+    async def _edit_preview(self):
+        try:
+            text = make_html_safe("".join(self._parts)) + " ▌"
+            if text != self._last_sent:
+                await self.message.edit_text(text, parse_mode="HTML")
+                self._last_sent = text
+            self._next_edit_at = time.monotonic() + self.interval
+        except TelegramRetryAfter as e:
+            self._next_edit_at = time.monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            logger.debug(f"Промежуточная правка не удалась: {e}")
+            self._next_edit_at = time.monotonic() + self.interval
+        except Exception as e:
+            logger.warning(f"Ошибка промежуточной правки: {e}")
+            self._next_edit_at = time.monotonic() + self.interval
+        finally:
+            self._edit_task = None
+
+    async def finish(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+        """Финальный текст: правим заглушку, а если не вышло — отправляем заново"""
+        if self._edit_task:
+            try:
+                await self._edit_task
+            except Exception:
+                pass
+
+        if self.enabled and self._parts:
+            try:
+                return await self.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                try:
+                    return await self.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+                except Exception as e:
+                    logger.warning(f"Финальная правка не удалась: {e}")
+            except Exception as e:
+                logger.warning(f"Финальная правка не удалась: {e}")
+
+        try:
+            await self.message.delete()
+        except Exception:
+            pass
+        return await self.message.answer(text, reply_markup=reply_markup, parse_mode="HTML")
@@ -0,0 +1,132 @@
+import time
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# На горячем пути только observe()/inc() — это доли микросекунды.
+# Всё, что можно посчитать по запросу (размеры кешей, get_stats модулей), считаем при сборе /metrics.
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_seconds", "Время обработки апдейта",
+    ["handler"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+)
+UPDATES_ACTIVE = Gauge("bot_updates_active", "Апдейты в обработке")
+UPDATES_FAILED = Counter("bot_updates_failed_total", "Апдейты, упавшие с исключением", ["handler"])
+
+GROQ_LATENCY = Histogram(
+    "bot_groq_seconds", "Время запроса к Groq (без ожидания в очереди планировщика)",
+    ["task_type", "model", "outcome"], buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+)
+GROQ_TOKENS = Histogram(
+    "bot_groq_tokens", "Токены на запрос (оценка ~3 символа на токен, как в планировщике)",
+    ["task_type", "kind"], buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000)
+)
+
+DB_ACQUIRE_WAIT = Histogram(
+    "bot_db_acquire_seconds", "Ожидание соединения из пула asyncpg",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+
+# Ветки handle_callback: у cat_/dish_ в хвосте ключ категории или номер блюда
+_CALLBACK_PREFIXES = ("cat_", "dish_", "hist_")
+_CALLBACK_BRANCHES = frozenset((
+    "restart", "clear_my_history", "action_add_more", "action_cook",
+    "back_to_categories", "dish_all_mix", "repeat_recipe", "delete_msg",
+))
+
+
+def callback_branch(data: str) -> str:
+    """Метка для callback_data с ограниченным числом значений"""
+    if data in _CALLBACK_BRANCHES:
+        return data
+    for prefix in _CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix.rstrip("_")
+    return "other"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время и ошибки обработчиков, плюс корневой спан трейса. Регистрируется
+    как inner-middleware, поэтому обработчик уже выбран фильтрами и известен по имени"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Any],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        if isinstance(event, CallbackQuery) and name == "handle_callback":
+            name = f"handle_callback:{callback_branch(event.data or '')}"
+
+        user = getattr(event, "from_user", None)
+        UPDATES_ACTIVE.inc()
+        started = time.perf_counter()
+        try:
+            # Тот же апдейт — корень трейса (tracing.py)
+            with tracer.trace(name, user_id=user.id if user else None):
+                return await handler(event, data)
+        except Exception:
+            UPDATES_FAILED.labels(name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(name).observe(time.perf_counter() - started)
+            UPDATES_ACTIVE.dec()
+
+
+def observe_groq(task_type: str, model: str, seconds: float, ok: bool, prompt_chars: int, completion_chars: int):
+    GROQ_LATENCY.labels(task_type, model, "ok" if ok else "error").observe(seconds)
+    if ok:
+        GROQ_TOKENS.labels(task_type, "prompt").observe(prompt_chars // 3)
+        GROQ_TOKENS.labels(task_type, "completion").observe(completion_chars // 3)
+
+
+def _flatten(prefix: str, value: Any) -> Iterator[Tuple[str, float]]:
+    if isinstance(value, bool):
+        yield prefix, float(value)
+    elif isinstance(value, (int, float)):
+        yield prefix, float(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(f"{prefix}.{key}" if prefix else str(key), item)
+
+
+class StatsCollector:
+    """Отдаёт числовые поля get_stats() модулей как bot_component_stat{component, key}.
+    Считается только при запросе /metrics"""
+
+    def __init__(self):
+        # Каждый источник возвращает {компонент: get_stats() компонента}
+        self._sources: List[Callable[[], Dict[str, Dict]]] = []
+
+    def add(self, source: Callable[[], Dict[str, Dict]]):
+        self._sources.append(source)
+
+    def collect(self):
+        family = GaugeMetricFamily("bot_component_stat", "Счётчики из get_stats() модулей", labels=["component", "key"])
+        for source in self._sources:
+            try:
+                components = source()
+            except Exception as e:
+                logger.warning(f"Метрики недоступны: {e}")
+                continue
+            for component, stats in components.items():
+                for key, value in _flatten("", stats):
+                    family.add_metric([component, key], value)
+        yield family
+
+
+# Глобальный экземпляр
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
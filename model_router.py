@@ -0,0 +1,143 @@
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Mapping, Optional, Tuple
+from config import (
+    GROQ_MODEL, ROUTER_WINDOW, ROUTER_MIN_SAMPLES, ROUTER_MAX_ERROR_RATE,
+    ROUTER_RECOVER_RATIO, ROUTER_RECOVER_SAMPLES, ROUTER_PROBE_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _ModelHealth:
+    """Скользящее окно последних запросов к модели в рамках одного типа задач"""
+
+    def __init__(self, window: int):
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=window)  # (латентность, успех)
+        self.degraded = False
+        self.last_probe_at = 0.0
+        self.switches = 0
+
+    def _recent(self, last: Optional[int]) -> List[Tuple[float, bool]]:
+        samples = list(self.samples)
+        return samples[-last:] if last else samples
+
+    def p95(self, last: Optional[int] = None) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self._recent(last) if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self, last: Optional[int] = None) -> float:
+        samples = self._recent(last)
+        if not samples:
+            return 0.0
+        return sum(1 for _, ok in samples if not ok) / len(samples)
+
+
+class ModelRouter:
+    """Выбор модели для задачи: основная из LLM_CONFIG, пока её p95 и доля ошибок
+    в норме, иначе — следующая из fallbacks. Деградировавшая модель раз в
+    probe_interval получает пробный запрос и возвращается, когда показатели
+    опускаются ниже порогов с запасом recover_ratio (гистерезис)."""
+
+    def __init__(
+        self,
+        window: int = ROUTER_WINDOW,
+        min_samples: int = ROUTER_MIN_SAMPLES,
+        max_error_rate: float = ROUTER_MAX_ERROR_RATE,
+        recover_ratio: float = ROUTER_RECOVER_RATIO,
+        recover_samples: int = ROUTER_RECOVER_SAMPLES,
+        probe_interval: float = ROUTER_PROBE_INTERVAL
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.recover_ratio = recover_ratio
+        self.recover_samples = recover_samples
+        self.probe_interval = probe_interval
+        self._health: Dict[Tuple[str, str], _ModelHealth] = {}
+
+    def _get(self, task_type: str, model: str) -> _ModelHealth:
+        health = self._health.get((task_type, model))
+        if health is None:
+            health = _ModelHealth(self.window)
+            self._health[(task_type, model)] = health
+        return health
+
+    @staticmethod
+    def models_for(config: Mapping) -> List[str]:
+        models = [config.get("model", GROQ_MODEL)]
+        models += [m for m in config.get("fallbacks", []) if m not in models]
+        return models
+
+    def candidates(self, task_type: str, config: Mapping) -> List[str]:
+        """Модели в порядке попыток: здоровые по приоритету, затем деградировавшие.
+        Если деградировавшей модели пора на пробу — она идёт первой"""
+        now = time.monotonic()
+        healthy, degraded = [], []
+        probe = None
+        for model in self.models_for(config):
+            health = self._get(task_type, model)
+            if not health.degraded:
+                healthy.append(model)
+            elif not healthy and probe is None and now - health.last_probe_at >= self.probe_interval:
+                # Пробуем только модель приоритетнее всех здоровых
+                health.last_probe_at = now
+                probe = model
+            else:
+                degraded.append(model)
+        return ([probe] if probe else []) + healthy + degraded
+
+    def record(self, task_type: str, model: str, latency: float, ok: bool, config: Mapping):
+        """Результат одной попытки запроса к модели"""
+        health = self._get(task_type, model)
+        health.samples.append((latency, ok))
+        max_p95 = config.get("max_p95")
+
+        if not health.degraded:
+            if len(health.samples) < self.min_samples:
+                return
+            p95 = health.p95()
+            error_rate = health.error_rate()
+            too_slow = max_p95 is not None and p95 is not None and p95 > max_p95
+            if too_slow or error_rate > self.max_error_rate:
+                health.degraded = True
+                health.last_probe_at = time.monotonic()
+                health.switches += 1
+                # Оцениваем восстановление только по свежим пробам
+                health.samples.clear()
+                logger.warning(
+                    f"🔀 {task_type}: модель {model} деградировала "
+                    f"(p95={p95 if p95 is None else round(p95, 2)}с, ошибки={error_rate:.0%}), переключаемся на запасную"
+                )
+            return
+
+        if len(health.samples) < self.recover_samples:
+            return
+        # Возврат — по последним пробам, чтобы старые медленные ответы не держали модель в запасе
+        p95 = health.p95(self.recover_samples)
+        error_rate = health.error_rate(self.recover_samples)
+        fast_enough = max_p95 is None or (p95 is not None and p95 <= max_p95 * self.recover_ratio)
+        if fast_enough and error_rate <= self.max_error_rate * self.recover_ratio:
+            health.degraded = False
+            health.samples.clear()
+            logger.info(f"✅ {task_type}: модель {model} восстановилась, возвращаемся на неё")
+
+    def get_stats(self) -> Dict:
+        result: Dict[str, Dict] = {}
+        for (task_type, model), health in self._health.items():
+            p95 = health.p95()
+            result.setdefault(task_type, {})[model] = {
+                "degraded": health.degraded,
+                "samples": len(health.samples),
+                "p95": round(p95, 3) if p95 is not None else None,
+                "error_rate": round(health.error_rate(), 3),
+                "switches": health.switches,
+            }
+        return result
+
+
+# Глобальный экземпляр
+model_router = ModelRouter()
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+from config import PREFETCH_ENABLED, PREFETCH_TOP_N, PREFETCH_MAX_CONCURRENT
+from groq_service import GroqService
+from llm_scheduler import llm_scheduler
+from state_manager import state_manager
+from tracing import detach
+
+logger = logging.getLogger(__name__)
+
+
+class DishPrefetcher:
+    """Фоновая генерация списков блюд для самых вероятных категорий"""
+
+    def __init__(self, top_n: int = PREFETCH_TOP_N, max_concurrent: int = PREFETCH_MAX_CONCURRENT, enabled: bool = PREFETCH_ENABLED):
+        self.top_n = top_n
+        self.enabled = enabled
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        # user_id -> {category: (products, task)}
+        self._tasks: Dict[int, Dict[str, tuple]] = {}
+        # Заготовки, которые уже отправили запрос к LLM (а не ждут своей очереди)
+        self._calling: Set[asyncio.Task] = set()
+        self._stats = {
+            "started": 0,
+            "skipped": 0,      # не хватило свободной квоты LLM
+            "ready": 0,
+            "failed": 0,
+            "used_ready": 0,   # пользователь нажал категорию, список уже готов
+            "used_inflight": 0,  # нажал, пока список ещё генерировался
+            "misses": 0,       # нажал категорию, которую не заготавливали
+            "wasted": 0,       # готовый список выброшен без использования
+            "cancelled": 0,    # генерация отменена (продукты изменились)
+        }
+
+    def schedule(self, user_id: int, products: str, categories: List[str]):
+        """Запускаем заготовку списков для первых top_n категорий"""
+        if not self.enabled or not products:
+            return
+        self.cancel(user_id)
+        user_tasks = self._tasks.setdefault(user_id, {})
+        for category in categories[:self.top_n]:
+            # Заготовки не должны отнимать квоту у живых запросов
+            if not llm_scheduler.has_spare_capacity():
+                self._stats["skipped"] += 1
+                continue
+            task = asyncio.create_task(self._prefetch(user_id, products, category))
+            user_tasks[category] = (products, task)
+            task.add_done_callback(lambda _task, c=category: self._forget(user_id, c, _task))
+            self._stats["started"] += 1
+
+    def _forget(self, user_id: int, category: str, task: asyncio.Task):
+        """Готовая задача больше не нужна: результат уже лежит в сессии"""
+        user_tasks = self._tasks.get(user_id)
+        if user_tasks and user_tasks.get(category, (None, None))[1] is task:
+            del user_tasks[category]
+            if not user_tasks:
+                del self._tasks[user_id]
+
+    async def _prefetch(self, user_id: int, products: str, category: str) -> Optional[List[Dict]]:
+        # Фоновая работа: не дописываем спаны в трейс обработчика, который её запустил
+        detach()
+        async with self._semaphore:
+            # Пока заготовка ждала очереди, квоту могли занять живые запросы
+            if not llm_scheduler.has_spare_capacity():
+                self._stats["skipped"] += 1
+                return None
+            task = asyncio.current_task()
+            self._calling.add(task)
+            try:
+                # task_type "prefetch" идёт в фоновую полосу планировщика
+                dishes = await GroqService.generate_dishes_list(products, category, task_type="prefetch")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка заготовки списка блюд: {e}")
+                dishes = None
+            finally:
+                self._calling.discard(task)
+        if not dishes:
+            self._stats["failed"] += 1
+            return None
+        self._stats["ready"] += 1
+        state_manager.set_prefetched_dishes(user_id, category, products, dishes)
+        return dishes
+
+    async def take(self, user_id: int, products: str, category: str) -> Optional[List[Dict]]:
+        """Готовый (или догенерированный) список блюд для категории, если он есть"""
+        if not self.enabled:
+            return None
+
+        user_tasks = self._tasks.get(user_id, {})
+        entry = user_tasks.get(category)
+        if entry and entry[0] == products:
+            user_tasks.pop(category)
+        elif entry:
+            # Заготовка для старого набора продуктов не нужна; из словаря её уберёт _forget
+            self._cancel_task(entry[1])
+            entry = None
+
+        dishes = state_manager.pop_prefetched_dishes(user_id, category, products)
+        if dishes:
+            self._stats["used_ready"] += 1
+            return dishes
+
+        if entry:
+            _, task = entry
+            if not task.done() and task not in self._calling:
+                # Заготовка ещё ждёт очереди в фоновой полосе — живой запрос быстрее
+                self._cancel_task(task)
+            elif not task.done():
+                try:
+                    dishes = await asyncio.shield(task)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    dishes = None
+                if dishes:
+                    # Результат уже сохранён в сессии задачей — забираем его оттуда
+                    state_manager.pop_prefetched_dishes(user_id, category, products)
+                    self._stats["used_inflight"] += 1
+                    return dishes
+
+        self._stats["misses"] += 1
+        return None
+
+    def cancel(self, user_id: int):
+        """Продукты изменились или сессия сброшена — заготовки больше не нужны"""
+        for _, task in self._tasks.pop(user_id, {}).values():
+            self._cancel_task(task)
+        self._stats["wasted"] += state_manager.drop_prefetched_dishes(user_id)
+
+    def _cancel_task(self, task: asyncio.Task):
+        if not task.done():
+            task.cancel()
+            self._stats["cancelled"] += 1
+
+    def get_stats(self) -> Dict:
+        used = self._stats["used_ready"] + self._stats["used_inflight"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "use_rate": round(used / self._stats["started"], 3) if self._stats["started"] else 0.0,
+        }
+
+
+# Глобальный экземпляр
+dish_prefetcher = DishPrefetcher()
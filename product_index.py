@@ -0,0 +1,205 @@
+import json
+import time
+import random
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from config import PRODUCT_INDEX_ENABLED, PRODUCT_INDEX_SIZE, PRODUCT_INDEX_JACCARD, PRODUCT_INDEX_TTL
+from database import db
+from ingredients import ingredient_set
+
+logger = logging.getLogger(__name__)
+
+# 64 хеш-функции = 16 полос по 4 строки: кандидатами становятся наборы
+# с Жаккаром примерно от 0.5, дальше порог проверяется точно
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1337)  # фиксированные коэффициенты: сигнатуры одинаковы между рестартами
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def _hash_item(item: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash(items: List[str]) -> Tuple[int, ...]:
+    hashes = [_hash_item(item) for item in items]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("items", "bands", "values")
+
+    def __init__(self, items: frozenset, bands: List[Tuple[int, ...]]):
+        self.items = items
+        self.bands = bands
+        # kind -> (время записи, значение)
+        self.values: Dict[str, Tuple[float, Any]] = {}
+
+
+class ProductIndex:
+    """Кеш результатов LLM (категории, списки блюд) по набору продуктов.
+
+    Ключ — канонический набор ингредиентов (ingredients.ingredient_set). Если точного
+    совпадения нет, ищем похожий набор через MinHash/LSH и берём его результат,
+    когда коэффициент Жаккара не ниже порога. Размер ограничен (LRU),
+    записи дублируются в таблицу product_index и поднимаются при старте.
+    """
+
+    def __init__(
+        self,
+        max_size: int = PRODUCT_INDEX_SIZE,
+        threshold: float = PRODUCT_INDEX_JACCARD,
+        ttl: int = PRODUCT_INDEX_TTL,
+        enabled: bool = PRODUCT_INDEX_ENABLED
+    ):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # (номер полосы, значения полосы) -> ключи наборов
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+        self._stats = {"exact_hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "db_errors": 0}
+
+    @staticmethod
+    def _key(items: List[str]) -> str:
+        return hashlib.sha256("|".join(items).encode("utf-8")).hexdigest()
+
+    # ==================== ИНДЕКС ====================
+
+    def _insert(self, key: str, items: List[str]) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        signature = minhash(items)
+        bands = [signature[i * ROWS:(i + 1) * ROWS] for i in range(BANDS)]
+        entry = _Entry(frozenset(items), bands)
+        self._entries[key] = entry
+        for band_no, band in enumerate(bands):
+            self._buckets.setdefault((band_no, band), set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._evict()
+        return entry
+
+    def _evict(self):
+        key, entry = self._entries.popitem(last=False)
+        for band_no, band in enumerate(entry.bands):
+            bucket = self._buckets.get((band_no, band))
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[(band_no, band)]
+        self._stats["evictions"] += 1
+
+    def _candidates(self, items: List[str]) -> Set[str]:
+        signature = minhash(items)
+        keys: Set[str] = set()
+        for band_no in range(BANDS):
+            keys |= self._buckets.get((band_no, signature[band_no * ROWS:(band_no + 1) * ROWS]), set())
+        return keys
+
+    def _fresh_value(self, entry: _Entry, kind: str) -> Optional[Any]:
+        stored = entry.values.get(kind)
+        if stored is None:
+            return None
+        stored_at, value = stored
+        if time.time() - stored_at > self.ttl:
+            del entry.values[kind]
+            return None
+        return value
+
+    # ==================== API ====================
+
+    def get(self, products: str, kind: str) -> Optional[Any]:
+        """Результат для этого или достаточно похожего набора продуктов"""
+        if not self.enabled:
+            return None
+        items = ingredient_set(products)
+        if not items:
+            return None
+        key = self._key(items)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value = self._fresh_value(entry, kind)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return value
+
+        query = frozenset(items)
+        best_value, best_score = None, self.threshold
+        for candidate_key in self._candidates(items):
+            if candidate_key == key:
+                continue
+            candidate = self._entries[candidate_key]
+            score = jaccard(query, candidate.items)
+            if score >= best_score:
+                value = self._fresh_value(candidate, kind)
+                if value is not None:
+                    best_value, best_score = value, score
+        if best_value is not None:
+            self._stats["near_hits"] += 1
+            return best_value
+
+        self._stats["misses"] += 1
+        return None
+
+    async def put(self, products: str, kind: str, value: Any):
+        if not self.enabled or not value:
+            return
+        items = ingredient_set(products)
+        if not items:
+            return
+        key = self._key(items)
+        entry = self._insert(key, items)
+        entry.values[kind] = (time.time(), value)
+        self._stats["stores"] += 1
+        if db.pool:
+            try:
+                await db.save_product_index_entry(key, items, kind, json.dumps(value, ensure_ascii=False))
+            except Exception as e:
+                self._stats["db_errors"] += 1
+                logger.error(f"Ошибка записи индекса продуктов: {e}")
+
+    async def load(self):
+        """Восстанавливаем индекс из БД после рестарта (свежие записи, не больше max_size наборов)"""
+        if not self.enabled or not db.pool:
+            return
+        try:
+            rows = await db.get_product_index_entries(self.max_size, self.ttl)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки индекса продуктов: {e}")
+            return
+        # Строки идут от новых к старым; вставляем в обратном порядке, чтобы LRU совпал
+        for row in reversed(rows):
+            items = list(row["items"])
+            entry = self._insert(row["set_key"], items)
+            entry.values[row["kind"]] = (row["updated_at"].timestamp(), json.loads(row["payload"]))
+        logger.info(f"🧺 Индекс наборов продуктов загружен: {len(self._entries)} наборов")
+
+    def get_stats(self) -> Dict:
+        lookups = self._stats["exact_hits"] + self._stats["near_hits"] + self._stats["misses"]
+        hits = self._stats["exact_hits"] + self._stats["near_hits"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "buckets": len(self._buckets),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Глобальный экземпляр
+product_index = ProductIndex()
@@ -0,0 +1,97 @@
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from config import RECIPE_CACHE_SIZE, RECIPE_CACHE_TTL, RECIPE_CACHE_DB_TTL
+from database import db
+from ingredients import normalize_text, products_key
+
+logger = logging.getLogger(__name__)
+
+
+class RecipeCache:
+    """Двухуровневый кеш рецептов: LRU+TTL в памяти и таблица recipe_cache в БД"""
+
+    def __init__(self, max_size: int = RECIPE_CACHE_SIZE, ttl: int = RECIPE_CACHE_TTL, db_ttl: int = RECIPE_CACHE_DB_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_ttl = db_ttl
+        # key -> (время записи, текст рецепта)
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "db_errors": 0,
+        }
+
+    @staticmethod
+    def make_key(kind: str, dish_name: str, products: str = "", language: str = "ru") -> Tuple[str, str]:
+        """Ключ кеша: тип запроса + нормализованное блюдо + набор продуктов + язык"""
+        prod_key = products_key(products or "")
+        raw = "|".join([kind, normalize_text(dish_name), prod_key, language])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest(), prod_key
+
+    async def get(self, key: str) -> Optional[str]:
+        """Ищем рецепт сначала в памяти, затем в БД"""
+        entry = self._memory.get(key)
+        if entry:
+            stored_at, text = entry
+            if time.monotonic() - stored_at < self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return text
+            del self._memory[key]
+
+        if db.pool:
+            try:
+                text = await db.get_cached_recipe(key, self.db_ttl)
+                if text:
+                    self._remember(key, text)
+                    self._stats["db_hits"] += 1
+                    return text
+            except Exception as e:
+                self._stats["db_errors"] += 1
+                logger.error(f"Ошибка чтения кеша рецептов: {e}")
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, dish_name: str, prod_key: str, language: str, text: str):
+        """Сохраняем рецепт в оба уровня кеша"""
+        if not text:
+            return
+        self._remember(key, text)
+        self._stats["stores"] += 1
+        if db.pool:
+            try:
+                await db.save_cached_recipe(key, dish_name, prod_key, language, text)
+            except Exception as e:
+                self._stats["db_errors"] += 1
+                logger.error(f"Ошибка записи кеша рецептов: {e}")
+
+    def mark_bypass(self):
+        """Учитываем осознанный обход кеша (\"Другой вариант\")"""
+        self._stats["bypassed"] += 1
+
+    def _remember(self, key: str, text: str):
+        self._memory[key] = (time.monotonic(), text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        lookups = self._stats["memory_hits"] + self._stats["db_hits"] + self._stats["misses"]
+        hits = self._stats["memory_hits"] + self._stats["db_hits"]
+        return {
+            **self._stats,
+            "size": len(self._memory),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Глобальный экземпляр
+recipe_cache = RecipeCache()
@@ -0,0 +1,184 @@
+"""Библиотека заранее сгенерированных рецептов популярных блюд.
+
+Запросы "рецепт борщ", "рецепт блины" повторяются постоянно, поэтому самые частые
+блюда генерируются заранее фоновой задачей, а generate_freestyle_recipe сначала
+смотрит сюда.
+
+    python recipe_library.py plan [--top 200] [--seed dishes.txt]
+    python recipe_library.py run [--concurrency 2] [--limit 100] [--top 200] [--seed dishes.txt]
+    python recipe_library.py status
+
+Каждое блюдо сохраняется сразу после генерации, поэтому прерванный run
+продолжается с того же места. Готовые рецепты обновляются раз в
+LIBRARY_REFRESH_DAYS (с разбросом, чтобы не обновлять всё разом).
+"""
+import sys
+import random
+import asyncio
+import argparse
+import logging
+from typing import Dict, List, Optional
+from config import LIBRARY_REFRESH_DAYS, LIBRARY_MAX_ATTEMPTS
+from database import db
+from ingredients import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_try_advisory_lock: два run одновременно не генерируют одно и то же
+_LOCK_ID = 0x5245_4C49  # "RELI"
+
+
+class RecipeLibrary:
+    """Готовые рецепты в памяти бота (загружаются из таблицы recipe_library)"""
+
+    def __init__(self):
+        # нормализованное название -> текст рецепта
+        self._recipes: Dict[str, str] = {}
+        self._stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(dish_name: str) -> str:
+        return normalize_text(dish_name)
+
+    async def get(self, dish_name: str) -> Optional[str]:
+        recipe = self._recipes.get(self.key(dish_name))
+        if recipe:
+            self._stats["hits"] += 1
+        else:
+            self._stats["misses"] += 1
+        return recipe
+
+    async def load(self):
+        if not db.pool:
+            return
+        try:
+            rows = await db.get_library_recipes()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки библиотеки рецептов: {e}")
+            return
+        self._recipes = {row["dish_key"]: row["recipe_text"] for row in rows}
+        logger.info(f"📖 Библиотека рецептов загружена: {len(self._recipes)} блюд")
+
+    async def run_refresh(self, interval: int = 3600):
+        """Подхватываем рецепты, сгенерированные отдельным процессом"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.load()
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, "size": len(self._recipes)}
+
+
+# Глобальный экземпляр
+recipe_library = RecipeLibrary()
+
+
+# ==================== ПАКЕТНАЯ ГЕНЕРАЦИЯ ====================
+
+def _read_seed(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+async def plan(top: int, seed: Optional[str] = None) -> int:
+    """Ставим в очередь самые частые блюда из истории и блюда из seed-файла"""
+    from groq_service import GroqService
+
+    dishes = [(row["dish_name"], row["requests"]) for row in await db.get_top_dishes(top)]
+    if seed:
+        # Блюда из seed-файла идут впереди истории
+        dishes = [(name, 1_000_000 - i) for i, name in enumerate(_read_seed(seed))] + dishes
+
+    candidates = {}
+    for name, requests in dishes:
+        safe_name = GroqService._sanitize_input(name, max_length=100)
+        key = RecipeLibrary.key(safe_name)
+        if key and key not in candidates:
+            candidates[key] = (key, safe_name, GroqService._detect_input_language(safe_name), int(requests))
+    await db.upsert_library_candidates(list(candidates.values()))
+    logger.info(f"🗂 В очереди библиотеки: {len(candidates)} блюд")
+    return len(candidates)
+
+
+async def _generate_one(item: Dict, semaphore: asyncio.Semaphore, counters: Dict[str, int]):
+    from groq_service import GroqService
+
+    async with semaphore:
+        try:
+            # task_type "library" идёт в фоновую полосу планировщика и не мешает пользователям
+            recipe = await GroqService.generate_freestyle_recipe(
+                item["dish_name"], use_cache=False, task_type="library"
+            )
+        except Exception as e:
+            recipe, error = "", str(e)
+        else:
+            error = ""
+            if not recipe or recipe.startswith(GroqService.FALLBACK_NOTICE):
+                error = "Groq недоступен"
+            elif GroqService._is_refusal(recipe) or len(recipe) < 300:
+                error = "рецепт не получен"
+
+        if error:
+            await db.mark_library_failed(item["dish_key"], error)
+            counters["failed"] += 1
+            logger.warning(f"⚠️ {item['dish_name']}: {error}")
+            return
+        refresh = LIBRARY_REFRESH_DAYS * 86400 * random.uniform(0.8, 1.2)
+        await db.save_library_recipe(item["dish_key"], recipe, refresh)
+        counters["done"] += 1
+        logger.info(f"✅ {item['dish_name']}")
+
+
+async def run(concurrency: int, limit: int) -> Dict[str, int]:
+    """Генерируем очередь; безопасно прерывать и запускать повторно"""
+    counters = {"done": 0, "failed": 0}
+    async with db.acquire() as lock_conn:
+        if not await lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", _LOCK_ID):
+            logger.warning("⏳ Генерация библиотеки уже идёт в другом процессе")
+            return counters
+        try:
+            work = await db.get_library_work(limit, LIBRARY_MAX_ATTEMPTS)
+            logger.info(f"📝 К генерации: {len(work)} блюд, параллельно {concurrency}")
+            semaphore = asyncio.Semaphore(concurrency)
+            await asyncio.gather(*(_generate_one(item, semaphore, counters) for item in work))
+        finally:
+            await lock_conn.execute("SELECT pg_advisory_unlock($1)", _LOCK_ID)
+    return counters
+
+
+async def _main(args):
+    await db.connect()
+    try:
+        if args.command == "plan":
+            await plan(args.top, args.seed)
+        elif args.command == "run":
+            if not args.no_plan:
+                await plan(args.top, args.seed)
+            counters = await run(args.concurrency, args.limit)
+            print(f"Готово: {counters['done']}, ошибок: {counters['failed']}")
+        print(await db.get_library_status())
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Библиотека популярных рецептов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("plan", "run"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--top", type=int, default=200, help="сколько популярных блюд взять из истории")
+        sub.add_argument("--seed", help="файл с названиями блюд, по одному на строку")
+        if name == "run":
+            sub.add_argument("--concurrency", type=int, default=2)
+            sub.add_argument("--limit", type=int, default=100, help="сколько блюд сгенерировать за запуск")
+            sub.add_argument("--no-plan", action="store_true", help="не пополнять очередь перед запуском")
+    subparsers.add_parser("status")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+class _Flight:
+    __slots__ = ("task", "waiters", "chunks", "listeners")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Уже пришедшие куски стрима и колбэки ожидающих, которым рассылаем новые
+        self.chunks: List[str] = []
+        self.listeners: List[ProgressCallback] = []
+
+    async def broadcast(self, delta: str):
+        self.chunks.append(delta)
+        for listener in list(self.listeners):
+            try:
+                await listener(delta)
+            except Exception as e:
+                logger.warning(f"Ошибка обработки стрима: {e}")
+
+
+class SingleFlight:
+    """Склейка одинаковых одновременных вызовов: выполняется один, результат получают все.
+
+    Если передан on_progress, factory получает общий колбэк прогресса: куски ответа
+    рассылаются всем ожидающим, а присоединившийся позже сначала получает уже пришедшее.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._stats = {"calls": 0, "shared": 0, "abandoned": 0}
+
+    async def do(
+        self,
+        key: Hashable,
+        factory: Callable[..., Awaitable[Any]],
+        on_progress: Optional[ProgressCallback] = None
+    ) -> Any:
+        self._stats["calls"] += 1
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.ensure_future(factory(flight.broadcast) if on_progress else factory())
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _task: self._forget(key, flight))
+        else:
+            self._stats["shared"] += 1
+
+        flight.waiters += 1
+        try:
+            if on_progress:
+                await self._catch_up(flight, on_progress)
+            # shield: отмена одного ожидающего не отменяет общий вызов для остальных
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done():
+                flight.waiters -= 1
+                if flight.waiters == 0:
+                    # Результат больше никому не нужен
+                    self._stats["abandoned"] += 1
+                    flight.task.cancel()
+            raise
+        finally:
+            if on_progress in flight.listeners:
+                flight.listeners.remove(on_progress)
+
+    @staticmethod
+    async def _catch_up(flight: _Flight, on_progress: ProgressCallback):
+        """Отдаём опоздавшему уже пришедший текст и подписываем на новые куски.
+        Между последней проверкой и подпиской нет await — ни один кусок не теряется"""
+        sent = 0
+        while sent < len(flight.chunks):
+            pending = len(flight.chunks)
+            try:
+                await on_progress("".join(flight.chunks[sent:pending]))
+            except Exception as e:
+                logger.warning(f"Ошибка обработки стрима: {e}")
+            sent = pending
+        flight.listeners.append(on_progress)
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, "inflight": len(self._inflight)}
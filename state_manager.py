@@ -1,11 +1,20 @@
+import time
+import json
+import asyncio
 import logging
-from typing import Dict, List, Optional
+import asyncpg
+from typing import Dict, List, Optional, Set
 from datetime import datetime
 from database import db
-from config import MAX_HISTORY_MESSAGES
+from tracing import traced
+from bot_stats import bot_stats
+from config import MAX_HISTORY_MESSAGES, SESSION_WRITE_BEHIND, SESSION_FLUSH_SECONDS, SESSION_FLUSH_BATCH
 
 logger = logging.getLogger(__name__)
 
+# Сколько сессия ждёт строки в users (get_or_create_user), прежде чем её перестанут переписывать в БД
+_UNREGISTERED_SESSION_TTL = 600
+
 class StateManagerDB:
     def __init__(self):
         # Кеш в памяти для быстрого доступа
@@ -17,12 +26,22 @@ class StateManagerDB:
             'dishes': {},
             'current_dish': {},
             'user_lang': {},
-            'products_lang': {}
+            'products_lang': {},
+            'prefetched': {},
+            'categories_for': {}
         }
         
         # Флаг инициализации БД
         self.db_connected = False
 
+        # Отложенная запись (SESSION_WRITE_BEHIND): user_id -> когда сессия впервые изменилась после записи
+        self.write_behind = SESSION_WRITE_BEHIND
+        self._dirty: Dict[int, float] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_wakeup = asyncio.Event()
+        self._flush_stats = {"flushes": 0, "flushed_sessions": 0, "flush_errors": 0, "dropped_sessions": 0,
+                             "requeued_sessions": 0, "max_lag": 0.0}
+
     async def initialize(self):
         """Инициализация подключения к БД"""
         try:
@@ -35,10 +54,14 @@ class StateManagerDB:
 
     # ==================== ОСНОВНЫЕ МЕТОДЫ ====================
 
+    @traced()
     async def load_user_session(self, user_id: int) -> bool:
         """Загружаем сессию пользователя из БД в кеш"""
         if not self.db_connected:
             return False
+        if user_id in self._dirty:
+            # В памяти изменения новее, чем в БД
+            return True
             
         try:
             session = await db.get_session(user_id)
@@ -58,10 +81,16 @@ class StateManagerDB:
         
         return False
 
+    @traced()
     async def save_session_to_db(self, user_id: int):
-        """Сохраняем сессию пользователя в БД"""
+        """Сохраняем сессию пользователя в БД (в режиме write-behind — только помечаем)"""
         if not self.db_connected:
             return
+        if self.write_behind:
+            self._dirty.setdefault(user_id, time.monotonic())
+            if len(self._dirty) >= SESSION_FLUSH_BATCH:
+                self._flush_wakeup.set()
+            return
             
         try:
             # Собираем все данные из кеша
@@ -78,6 +107,87 @@ class StateManagerDB:
         except Exception as e:
             logger.error(f"Ошибка сохранения сессии в БД: {e}")
 
+    def _session_row(self, user_id: int) -> tuple:
+        return (
+            user_id,
+            self._cache['products'].get(user_id),
+            self._cache['states'].get(user_id),
+            json.dumps(self._cache['categories'].get(user_id) or [], ensure_ascii=False),
+            json.dumps(self._cache['dishes'].get(user_id) or [], ensure_ascii=False),
+            self._cache['current_dish'].get(user_id),
+            json.dumps(self._cache['history'].get(user_id, [])[-MAX_HISTORY_MESSAGES:], ensure_ascii=False),
+        )
+
+    async def flush_sessions(self):
+        """Записываем изменённые сессии одним запросом"""
+        async with self._flush_lock:
+            if not self._dirty or not self.db_connected:
+                return
+            dirty, self._dirty = self._dirty, {}
+            # Снимок берём до первого await: изменения во время записи попадут в следующий пакет
+            rows = [self._session_row(user_id) for user_id in dirty]
+            try:
+                written = await db.save_sessions_batch(rows)
+            except Exception as e:
+                self._flush_stats["flush_errors"] += 1
+                logger.error(f"Ошибка пакетной записи сессий ({len(rows)}): {e}")
+                written = await self._flush_rows_one_by_one(rows, dirty)
+                if written is None:
+                    return
+            self._requeue_unregistered(dirty, written)
+            self._flush_stats["flushes"] += 1
+            self._flush_stats["flushed_sessions"] += len(written)
+            if written:
+                lag = time.monotonic() - min(dirty[user_id] for user_id in written)
+                self._flush_stats["max_lag"] = round(max(self._flush_stats["max_lag"], lag), 2)
+
+    def _requeue_unregistered(self, dirty: Dict[int, float], written: Set[int]):
+        """Незаписанные сессии — пользователи без строки в users. Ждём, пока get_or_create_user её создаст,
+        но не дольше _UNREGISTERED_SESSION_TTL: заглушки в users не создаём, они попали бы в /stats"""
+        now = time.monotonic()
+        for user_id, since in dirty.items():
+            if user_id in written:
+                continue
+            if now - since > _UNREGISTERED_SESSION_TTL:
+                self._flush_stats["dropped_sessions"] += 1
+                logger.warning(f"Сессия пользователя {user_id} отброшена: нет записи в users")
+                continue
+            self._flush_stats["requeued_sessions"] += 1
+            self._dirty[user_id] = min(since, self._dirty.get(user_id, since))
+
+    async def _flush_rows_one_by_one(self, rows: List[tuple], dirty: Dict[int, float]) -> Optional[Set[int]]:
+        """Пакет не записался: пишем сессии по одной, чтобы одна плохая строка не держала остальные.
+        Если БД недоступна целиком — возвращаем всё в очередь (None). Строки, которые не пишутся и по одной,
+        отбрасываем (и убираем из dirty): сессия остаётся в памяти и уйдёт в БД при следующем изменении.
+        Возвращает user_id записанных"""
+        written = set()
+        for row in rows:
+            user_id = row[0]
+            try:
+                written |= await db.save_sessions_batch([row])
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError) as e:
+                # Проблема не в строке, а в соединении — повторим весь остаток позже
+                for uid, since in dirty.items():
+                    self._dirty[uid] = min(since, self._dirty.get(uid, since))
+                logger.error(f"БД недоступна при записи сессий: {e}")
+                return None
+            except Exception as e:
+                del dirty[user_id]
+                self._flush_stats["dropped_sessions"] += 1
+                logger.error(f"Сессия пользователя {user_id} не записана и отброшена: {e}")
+        logger.info(f"💾 Сессии записаны по одной: {len(written)} из {len(rows)}")
+        return written
+
+    async def run_session_flush(self):
+        """Фоновая запись: не реже раза в SESSION_FLUSH_SECONDS или как только набрался пакет"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=SESSION_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            await self.flush_sessions()
+
     # ==================== ИСТОРИЯ (с автосохранением) ====================
 
     def get_history(self, user_id: int) -> List[Dict]:
@@ -114,9 +224,13 @@ class StateManagerDB:
 
     async def set_products(self, user_id: int, products: str):
         self._cache['products'][user_id] = products
+        if self._cache['categories_for'].get(user_id) != products:
+            self._cache['categories_for'].pop(user_id, None)
         await self.save_session_to_db(user_id)
 
     async def append_products(self, user_id: int, new_products: str):
+        # Список изменился — категории, подобранные заранее, больше не годятся
+        self._cache['categories_for'].pop(user_id, None)
         current = self._cache['products'].get(user_id)
         if current:
             self._cache['products'][user_id] = f"{current}, {new_products}"
@@ -148,6 +262,18 @@ class StateManagerDB:
     def get_categories(self, user_id: int) -> List[str]:
         return self._cache['categories'].get(user_id, [])
 
+    def cache_categories(self, user_id: int, products: str, categories: List[str]):
+        """Категории, подобранные для конкретного списка продуктов (сохранятся вместе с сессией)"""
+        self._cache['categories'][user_id] = categories
+        self._cache['categories_for'][user_id] = products
+
+    def get_cached_categories(self, user_id: int) -> Optional[List[str]]:
+        """Категории, если они подобраны для текущего списка продуктов"""
+        products = self._cache['products'].get(user_id)
+        if products and self._cache['categories_for'].get(user_id) == products:
+            return self._cache['categories'].get(user_id) or None
+        return None
+
     async def set_generated_dishes(self, user_id: int, dishes: List[Dict]):
         self._cache['dishes'][user_id] = dishes
         await self.save_session_to_db(user_id)
@@ -168,6 +294,25 @@ class StateManagerDB:
     def get_current_dish(self, user_id: int) -> Optional[str]:
         return self._cache['current_dish'].get(user_id)
 
+    # ==================== УПРЕЖДАЮЩИЕ СПИСКИ БЛЮД (только в памяти) ====================
+
+    def set_prefetched_dishes(self, user_id: int, category: str, products: str, dishes: List[Dict]):
+        self._cache['prefetched'].setdefault(user_id, {})[category] = {
+            "products": products,
+            "dishes": dishes
+        }
+
+    def pop_prefetched_dishes(self, user_id: int, category: str, products: str) -> Optional[List[Dict]]:
+        """Забираем заготовленный список, если он построен для тех же продуктов"""
+        entry = self._cache['prefetched'].get(user_id, {}).pop(category, None)
+        if entry and entry["products"] == products:
+            return entry["dishes"]
+        return None
+
+    def drop_prefetched_dishes(self, user_id: int) -> int:
+        """Сбрасываем все заготовки пользователя, возвращаем их количество"""
+        return len(self._cache['prefetched'].pop(user_id, {}))
+
     # ==================== МУЛЬТИЯЗЫЧНОСТЬ ====================
 
     async def set_user_lang(self, user_id: int, lang: str):
@@ -203,6 +348,7 @@ class StateManagerDB:
                 recipe_text=recipe_text,
                 products_used=products
             )
+            bot_stats.note_recipe(user_id, dish_name)
             logger.info(f"📝 Рецепт сохранён в историю: {dish_name}")
         except Exception as e:
             logger.error(f"Ошибка сохранения рецепта: {e}")
@@ -217,16 +363,28 @@ class StateManagerDB:
                 del self._cache[cache_key][user_id]
         
         # Очищаем БД
-        if self.db_connected:
+        if self.db_connected and self.write_behind:
+            # Пустая сессия запишется вместе с остальными
+            await self.save_session_to_db(user_id)
+        elif self.db_connected:
             try:
                 await db.clear_session(user_id)
                 logger.info(f"🧹 Сессия очищена для user_id={user_id}")
             except Exception as e:
                 logger.error(f"Ошибка очистки сессии в БД: {e}")
 
+    def get_stats(self) -> Dict:
+        """Размеры кешей в памяти (число пользователей в каждом) и отложенная запись"""
+        return {
+            **{name: len(cache) for name, cache in self._cache.items()},
+            **self._flush_stats,
+            "dirty": len(self._dirty),
+        }
+
     async def shutdown(self):
         """Graceful shutdown - закрываем соединение с БД"""
         if self.db_connected:
+            await self.flush_sessions()
             await db.close()
             self.db_connected = False
             logger.info("💤 StateManagerDB завершил работу")
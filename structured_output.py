@@ -0,0 +1,313 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ключи категорий блюд — те же, что в CATEGORY_MAP (handlers.py)
+CATEGORY_KEYS = ("mix", "breakfast", "soup", "main", "salad", "snack", "dessert", "drink", "sauce")
+
+# Схемы ответов по типам задач. Поддерживается небольшое подмножество JSON Schema:
+# type, properties, required, items, min_items, enum, default
+SCHEMAS: Dict[str, Dict] = {
+    "validation": {
+        "type": "object",
+        "properties": {
+            "valid": {"type": "boolean"},
+            "reason": {"type": "string", "default": ""},
+        },
+        "required": ["valid"],
+        "example": '{"valid": true, "reason": "кратко"}',
+    },
+    "intake": {
+        "type": "object",
+        "properties": {
+            "valid": {"type": "boolean"},
+            "ingredients": {"type": "array", "items": {"type": "string"}, "default": []},
+            "categories": {"type": "array", "items": {"type": "string", "enum": CATEGORY_KEYS}, "default": []},
+        },
+        "required": ["valid"],
+        "example": '{"valid": true, "ingredients": ["...", "..."], "categories": ["cat1", "cat2"]}',
+    },
+    "categorization": {
+        "type": "array",
+        "items": {"type": "string", "enum": CATEGORY_KEYS},
+        "min_items": 1,
+        "example": '["mix", "cat2", "cat3", "cat4"]',
+    },
+    "generation": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "desc": {"type": "string", "default": ""},
+            },
+            "required": ["name"],
+        },
+        "min_items": 1,
+        "example": '[{ "name": "...", "desc": "..." }]',
+    },
+}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "integer": int,
+}
+
+
+def _batch_schema(task_type: str) -> Dict:
+    """Схема пакетного ответа: массив объектов задачи с номером id"""
+    item = SCHEMAS[task_type]
+    return {
+        "type": "array",
+        "items": {
+            **item,
+            "properties": {"id": {"type": "integer"}, **item["properties"]},
+            "required": ["id"] + item["required"],
+        },
+        "min_items": 1,
+        "example": '[{"id": 1, ...}, {"id": 2, ...}]',
+    }
+
+
+# Заготовка списков блюд (prefetch) — тот же ответ, что у generation
+SCHEMAS["prefetch"] = SCHEMAS["generation"]
+
+# Пакетные варианты задач (validation_batcher)
+for _task in ("validation", "intake"):
+    SCHEMAS[f"{_task}_batch"] = _batch_schema(_task)
+
+
+def uses_json_mode(task_type: str) -> bool:
+    """JSON-режим Groq (response_format=json_object) умеет только объекты в корне"""
+    schema = SCHEMAS.get(task_type)
+    return bool(schema) and schema["type"] == "object"
+
+
+class TolerantJSONParser:
+    """Инкрементальный разбор JSON из ответа LLM.
+
+    Текст можно подавать кусками (feed). Всё до первой { или [ и после
+    закрытия корневого значения игнорируется. Обрезанный ответ чинится:
+    недописанный последний элемент (в том числе оборванная строка), висящие
+    запятые и недописанные ключи отбрасываются, открытые скобки закрываются.
+    Оборванную строку не закрываем: "Кот вместо "Котлеты" — не ответ модели.
+    """
+
+    _CLOSERS = {"{": "}", "[": "]"}
+
+    def __init__(self):
+        self._out: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.complete = False
+        self._fixed = False
+        # Точки, где JSON можно обрезать без потерь: (длина _out, закрывающие скобки)
+        self._safe_points: List[Tuple[int, str]] = []
+
+    def _closers(self) -> str:
+        return "".join(self._CLOSERS[c] for c in reversed(self._stack))
+
+    def _mark_safe(self):
+        self._safe_points.append((len(self._out), self._closers()))
+
+    def _drop_trailing_comma(self):
+        i = len(self._out) - 1
+        while i >= 0 and self._out[i].isspace():
+            i -= 1
+        if i >= 0 and self._out[i] == ",":
+            del self._out[i:]
+            self._fixed = True
+
+    def feed(self, chunk: str):
+        for char in chunk:
+            if self.complete:
+                return
+            if not self._started:
+                if char not in "{[":
+                    continue
+                self._started = True
+
+            if self._in_string:
+                self._out.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._out.append(char)
+            elif char in "{[":
+                self._out.append(char)
+                self._stack.append(char)
+                self._mark_safe()
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                self._drop_trailing_comma()
+                self._out.append(self._CLOSERS[self._stack.pop()])
+                if not self._stack:
+                    self.complete = True
+                    return
+                self._mark_safe()
+            elif char == ",":
+                self._mark_safe()
+                self._out.append(char)
+            else:
+                self._out.append(char)
+
+    def result(self) -> Tuple[Optional[Any], bool]:
+        """Текущее значение и флаг "пришлось чинить". (None, False) — разобрать не удалось"""
+        text = "".join(self._out)
+        if not self._started:
+            return None, False
+        if self.complete:
+            try:
+                return json.loads(text), self._fixed
+            except ValueError:
+                pass
+
+        # Пробуем дописать хвост как есть, если он не обрывается посреди строки
+        if not self._in_string:
+            candidate = text.rstrip().rstrip(",")
+            for literal in ("true", "false", "null"):
+                for cut in range(1, len(literal)):
+                    if candidate.endswith(literal[:cut]) and not candidate.endswith(literal):
+                        candidate = candidate + literal[cut:]
+                        break
+            try:
+                return json.loads(candidate + self._closers()), True
+            except ValueError:
+                pass
+
+        # Откатываемся к последней безопасной точке
+        for length, closers in reversed(self._safe_points):
+            prefix = "".join(self._out[:length]).rstrip().rstrip(",")
+            try:
+                return json.loads(prefix + closers), True
+            except ValueError:
+                continue
+        return None, False
+
+
+def parse_tolerant(text: str) -> Tuple[Optional[Any], bool]:
+    parser = TolerantJSONParser()
+    parser.feed(text or "")
+    return parser.result()
+
+
+def _conform(value: Any, schema: Dict) -> Tuple[Any, bool]:
+    """Проверяет value по схеме, подставляя default. Возвращает (значение, ok)"""
+    expected = schema.get("type")
+    if expected == "array" and isinstance(value, dict):
+        # JSON-режим часто заворачивает список в объект: {"dishes": [...]}
+        lists = [v for v in value.values() if isinstance(v, list)]
+        if len(lists) == 1:
+            value = lists[0]
+    if expected and not isinstance(value, _TYPES[expected]):
+        return value, False
+    if "enum" in schema:
+        # Модель иногда пишет "Soup" или " main"
+        if isinstance(value, str):
+            value = value.strip().lower()
+        if value not in schema["enum"]:
+            return value, False
+
+    if expected == "object":
+        result = {}
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                return value, False
+        for key, item in value.items():
+            sub_schema = properties.get(key)
+            if sub_schema is None:
+                result[key] = item
+                continue
+            conformed, ok = _conform(item, sub_schema)
+            if not ok:
+                if "default" not in sub_schema:
+                    return value, False
+                conformed = sub_schema["default"]
+            result[key] = conformed
+        for key, sub_schema in properties.items():
+            if key not in result and "default" in sub_schema:
+                result[key] = sub_schema["default"]
+        return result, True
+
+    if expected == "array":
+        item_schema = schema.get("items")
+        items = []
+        for item in value:
+            if item_schema:
+                item, ok = _conform(item, item_schema)
+                if not ok:
+                    # Битые элементы пропускаем, остальные оставляем
+                    continue
+            items.append(item)
+        if len(items) < schema.get("min_items", 0):
+            return items, False
+        return items, True
+
+    return value, True
+
+
+class StructuredOutputStats:
+    """Счётчики разбора ответов по типам задач"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def record(self, task_type: str, outcome: str):
+        stats = self._stats.setdefault(task_type, {
+            "total": 0, "ok": 0, "repaired": 0, "reasked": 0, "reask_ok": 0, "failed": 0
+        })
+        stats[outcome] += 1
+
+    def get_stats(self) -> Dict:
+        result = {}
+        for task_type, stats in self._stats.items():
+            total = stats["total"]
+            result[task_type] = {
+                **stats,
+                "parse_failure_rate": round((total - stats["ok"] - stats["repaired"]) / total, 3) if total else 0.0,
+            }
+        return result
+
+
+def parse_structured(task_type: str, text: str) -> Tuple[Optional[Any], str]:
+    """Разбор ответа по схеме задачи. Статус: "ok", "repaired" или "failed" """
+    value, repaired = parse_tolerant(text)
+    if value is None:
+        return None, "failed"
+    schema = SCHEMAS.get(task_type)
+    if schema:
+        value, ok = _conform(value, schema)
+        if not ok:
+            return None, "failed"
+    return value, "repaired" if repaired else "ok"
+
+
+def reask_prompt(task_type: str, user_text: str, bad_answer: str) -> str:
+    """Текст повторного запроса, когда ответ не удалось ни разобрать, ни починить"""
+    example = SCHEMAS.get(task_type, {}).get("example", "")
+    return (
+        f"{user_text}\n\n"
+        "⚠️ Твой предыдущий ответ не удалось разобрать как JSON:\n"
+        f"{bad_answer[:1500]}\n\n"
+        f"Верни ТОЛЬКО корректный JSON строго по схеме: {example}"
+    )
+
+
+# Глобальный экземпляр
+structured_stats = StructuredOutputStats()
@@ -0,0 +1,151 @@
+import json
+import time
+import logging
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from config import TRACE_SLOW_MS, TRACE_BUFFER_SIZE, TRACE_MAX_SPANS
+
+logger = logging.getLogger(__name__)
+
+# Текущий спан взаимодействия. asyncio копирует контекст в задачи,
+# поэтому спаны из gather/create_task попадают в трейс породившего их обработчика
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "started", "duration", "children", "error", "root")
+
+    def __init__(self, name: str, attrs: Dict[str, Any], root: Optional["Span"] = None):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+        # У корня храним число спанов трейса (attrs корня не трогаем)
+        self.root = root if root is not None else self
+
+    def to_dict(self, origin: float) -> Dict:
+        data = {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 1),
+            # Незавершённый спан (фоновая задача пережила обработчик)
+            "ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+class Tracer:
+    """Трейсы взаимодействий: обработчик -> LLM -> БД.
+
+    Спаны собираются для каждого апдейта (это пара объектов на шаг), но сохраняются
+    только медленные трейсы — не быстрее slow_ms. Они пишутся в лог одной JSON-строкой
+    и в кольцевой буфер, который отдаёт /traces.
+    """
+
+    def __init__(self, slow_ms: float = TRACE_SLOW_MS, buffer_size: int = TRACE_BUFFER_SIZE, max_spans: int = TRACE_MAX_SPANS):
+        self.slow_ms = slow_ms
+        self.max_spans = max_spans
+        self._slow: deque = deque(maxlen=buffer_size)
+        self._span_counts: Dict[int, int] = {}
+        self._stats = {"traces": 0, "slow": 0, "dropped_spans": 0}
+
+    @contextmanager
+    def trace(self, name: str, **attrs) -> Iterator[Span]:
+        """Корень взаимодействия; внутри уже идущего трейса работает как обычный спан"""
+        if _current.get() is not None:
+            with span(name, **attrs) as child:
+                yield child
+            return
+        root = Span(name, attrs)
+        self._span_counts[id(root)] = 1
+        token = _current.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            root.duration = time.perf_counter() - root.started
+            _current.reset(token)
+            self._span_counts.pop(id(root), None)
+            self._finish(root)
+
+    def _allow_span(self, root: Span) -> bool:
+        count = self._span_counts.get(id(root))
+        if count is None:
+            # Трейс уже завершён: фоновая задача пережила обработчик
+            return False
+        if count >= self.max_spans:
+            self._stats["dropped_spans"] += 1
+            return False
+        self._span_counts[id(root)] = count + 1
+        return True
+
+    def _finish(self, root: Span):
+        self._stats["traces"] += 1
+        if root.duration * 1000 < self.slow_ms:
+            return
+        self._stats["slow"] += 1
+        record = {"at": time.time(), **root.to_dict(root.started)}
+        self._slow.append(record)
+        logger.warning(f"🐢 Медленное взаимодействие {root.name}: {root.duration * 1000:.0f} мс "
+                       f"{json.dumps(record, ensure_ascii=False, default=str)}")
+
+    def get_slow(self, limit: int = 20) -> List[Dict]:
+        """Последние медленные трейсы, новые первыми"""
+        return list(self._slow)[::-1][:limit]
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, "buffered": len(self._slow), "slow_ms": self.slow_ms}
+
+
+# Глобальный экземпляр
+tracer = Tracer()
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """Шаг внутри текущего трейса. Вне трейса ничего не делает"""
+    parent = _current.get()
+    if parent is None or not tracer._allow_span(parent.root):
+        yield None
+        return
+    child = Span(name, attrs, parent.root)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.duration = time.perf_counter() - child.started
+        _current.reset(token)
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: корутина целиком — спан с именем функции"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def detach():
+    """Отвязать текущую задачу от трейса (фоновая работа не от имени пользователя)"""
+    _current.set(None)
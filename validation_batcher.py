@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import VALIDATION_BATCH_ENABLED, VALIDATION_BATCH_WINDOW_MS, VALIDATION_BATCH_MAX
+from tracing import detach
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Копит одиночные запросы несколько миллисекунд и отправляет их одним пакетом.
+
+    send_batch(items) возвращает список результатов в том же порядке; None на месте
+    элемента — ответ для него не разобран, такой элемент уходит отдельным send_single.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        send_batch: Callable[[List[Any]], Awaitable[List[Optional[Any]]]],
+        send_single: Callable[[Any], Awaitable[Any]],
+        window_ms: int = VALIDATION_BATCH_WINDOW_MS,
+        max_batch: int = VALIDATION_BATCH_MAX,
+        enabled: bool = VALIDATION_BATCH_ENABLED
+    ):
+        self.name = name
+        self.send_batch = send_batch
+        self.send_single = send_single
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.enabled = enabled
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats = {
+            "submitted": 0,
+            "batches": 0,
+            "batched_items": 0,
+            "singles": 0,      # окно закрылось с одним запросом
+            "fallbacks": 0,    # элемент не разобран в пакете — отдельный запрос
+            "batch_errors": 0,
+        }
+
+    async def submit(self, item: Any) -> Any:
+        if not self.enabled:
+            return await self.send_single(item)
+
+        self._stats["submitted"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # Отменённые за время окна запросы не отправляем
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if batch:
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        # Пакет общий для нескольких пользователей — не приписываем его трейсу первого
+        detach()
+        items = [item for item, _ in batch]
+        if len(items) == 1:
+            self._stats["singles"] += 1
+            results: List[Optional[Any]] = [None]
+        else:
+            self._stats["batches"] += 1
+            self._stats["batched_items"] += len(items)
+            try:
+                results = await self.send_batch(items)
+            except Exception as e:
+                logger.error(f"Ошибка пакетного запроса {self.name}: {e}")
+                self._stats["batch_errors"] += 1
+                results = [None] * len(items)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing and len(items) > 1:
+            self._stats["fallbacks"] += len(missing)
+            logger.warning(f"⚠️ {self.name}: {len(missing)} из {len(items)} не разобрано в пакете, запрашиваем по одному")
+        fallback = await asyncio.gather(
+            *(self.send_single(items[i]) for i in missing), return_exceptions=True
+        )
+        for i, result in zip(missing, fallback):
+            results[i] = result
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_stats(self) -> Dict:
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "avg_batch_size": round(self._stats["batched_items"] / batches, 2) if batches else 0.0,
+        }